@@ -0,0 +1,121 @@
+"""
+Deterministic chat model for offline benchmarks.
+
+Answers the bot's prompts (table selection, SQL generation and repair, help)
+from fixed tables, after a configurable latency. Same seed, same latencies.
+"""
+import re
+import random
+import asyncio
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# question -> (tables, sql) for the synthetic hafsql fixture
+AIQUERY_CASES = {
+    "last 5 posts by user1": (
+        ["comments"],
+        "SELECT author, permlink, title, created FROM hafsql.comments "
+        "WHERE author = 'user1' AND title <> '' ORDER BY created DESC LIMIT 5"),
+    "how many comments did user2 write": (
+        ["comments"],
+        "SELECT author, COUNT(*) AS comments FROM hafsql.comments "
+        "WHERE author = 'user2' AND title = '' GROUP BY author"),
+    "top 10 authors by posts in january 2020": (
+        ["comments"],
+        "SELECT author, COUNT(*) AS posts FROM hafsql.comments "
+        "WHERE title <> '' AND created >= '2020-01-01' AND created < '2020-02-01' "
+        "GROUP BY author ORDER BY posts DESC LIMIT 10"),
+    "last 10 transfers from user3": (
+        ["operation_transfer_table"],
+        'SELECT timestamp, "from", "to", amount, symbol, memo FROM hafsql.operation_transfer_table '
+        "WHERE \"from\" = 'user3' ORDER BY timestamp DESC LIMIT 10"),
+    "who sent the most hbd to user1": (
+        ["operation_transfer_table"],
+        'SELECT "from", SUM(amount) AS total FROM hafsql.operation_transfer_table '
+        "WHERE \"to\" = 'user1' AND symbol = 'HBD' GROUP BY \"from\" ORDER BY total DESC LIMIT 10"),
+    "when was user5 created and how many posts does it have": (
+        ["accounts_table"],
+        "SELECT name, created, post_count FROM hafsql.accounts_table WHERE name = 'user5'"),
+    "top accounts by reputation": (
+        ["accounts_table"],
+        "SELECT name, reputation FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 10"),
+    "latest posts of the most reputable account": (
+        ["accounts_table", "comments"],
+        "SELECT c.author, c.title, c.created FROM hafsql.comments c "
+        "WHERE c.author = (SELECT name FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 1) "
+        "AND c.title <> '' ORDER BY c.created DESC LIMIT 5"),
+}
+
+DEFAULT_CASE = (["comments"], "SELECT author, title, created FROM hafsql.comments ORDER BY created DESC LIMIT 10")
+
+HELP_TEXT = (
+    "You can ask in plain English with `!aiquery`, for example `!aiquery last 5 posts by alice`. "
+    "Posts and comments live in `comments`: posts have a title, comments have `title = ''`. "
+    "Transfers are in `operation_transfer_table` with `from`, `to`, `amount` and `symbol`. "
+    "Account details such as creation date and reputation are in `accounts_table`.\n\n"
+    "```sql\nSELECT author, title, created FROM hafsql.comments\n"
+    "WHERE author = 'alice' AND title <> ''\nORDER BY created DESC LIMIT 5;\n```"
+)
+
+
+def _question(prompt, marker):
+    match = re.search(marker + r"\s*(.+)", prompt)
+    return match.group(1).strip().lower() if match else ""
+
+
+class FakeChatModel:
+    """Stand-in for ChatGroq/ChatOpenAI: ainvoke, astream, model_copy"""
+    _llm_type = "fake"
+    model_name = "fake-sql"
+
+    def __init__(self, latency=0.3, jitter=0.1, seed=42, chunk_size=16, temperature=0.1):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_size = chunk_size
+        self.temperature = temperature
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def model_copy(self, update=None):
+        copy = FakeChatModel(self.latency, self.jitter, self.random.random(), self.chunk_size, self.temperature)
+        for key, value in (update or {}).items():
+            setattr(copy, key, value)
+        return copy
+
+    def _delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def respond(self, prompt):
+        """Response text for one of the bot's prompts"""
+        if "selecting the most relevant tables" in prompt:
+            tables, _ = AIQUERY_CASES.get(_question(prompt, r"# User Question:"), DEFAULT_CASE)
+            return "```json\n" + str(tables).replace("'", '"') + "\n```"
+        # SQL generation and repair prompts
+        if "RESPOND ONLY THE SQL" in prompt:
+            _, sql = AIQUERY_CASES.get(_question(prompt, r"Question:"), DEFAULT_CASE)
+            return f"```sql\n{sql}\n```"
+        return HELP_TEXT
+
+    def _usage(self, prompt, text):
+        input_tokens = len(prompt) // 4
+        output_tokens = len(text) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    async def ainvoke(self, prompt):
+        prompt = str(prompt)
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        text = self.respond(prompt)
+        return AIMessage(content=text, usage_metadata=self._usage(prompt, text))
+
+    async def astream(self, prompt):
+        prompt = str(prompt)
+        self.calls += 1
+        text = self.respond(prompt)
+        chunks = [text[n:n + self.chunk_size] for n in range(0, len(text), self.chunk_size)]
+        # Time to first token is most of the latency, the rest is spread over chunks
+        await asyncio.sleep(self._delay() * 0.7)
+        for chunk in chunks:
+            await asyncio.sleep(self.latency * 0.3 / len(chunks))
+            yield AIMessageChunk(content=chunk)
+        yield AIMessageChunk(content="", usage_metadata=self._usage(prompt, text))
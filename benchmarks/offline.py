@@ -0,0 +1,243 @@
+"""
+Offline end-to-end benchmark of CommandHandler against a local Postgres fixture
+and a deterministic fake LLM: no Discord, no HafSQL, no LLM key needed.
+
+Needs a local Postgres the benchmark may create the hafsql schema in
+(BENCH_PG_URL, default postgresql://postgres@localhost/hafsql_bench).
+Run from the repository root:
+    python -m benchmarks.offline
+    python -m benchmarks.offline --workloads aiquery,hafsql --concurrency 1,8,32 --llm-latency 0.5
+    python -m benchmarks.offline --compare latest
+
+Results are saved in benchmarks/results/, --compare reports p95 and throughput
+changes against a previous run and exits with status 1 on regressions.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tracemalloc
+from config import DB_CONFIG, CACHE_CONFIG, QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SCHEMA_CONFIG, METRICS_CONFIG
+from benchmarks.pg_fixture import DEFAULT_URL, load_fixture, use_fixture_database
+from benchmarks.fake_llm import FakeChatModel, AIQUERY_CASES
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+HAFSQL_QUERIES = [
+    "SELECT author, title, created FROM hafsql.comments WHERE author = 'user1' AND title <> '' ORDER BY created DESC LIMIT 10",
+    "SELECT author, COUNT(*) AS posts FROM hafsql.comments WHERE created >= '2020-03-01' AND created < '2020-03-08' GROUP BY author ORDER BY posts DESC LIMIT 20",
+    "SELECT \"from\", \"to\", amount, symbol FROM hafsql.operation_transfer_table WHERE \"to\" = 'user2' ORDER BY timestamp DESC LIMIT 50",
+    "SELECT name, created, reputation FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 25",
+    "SELECT symbol, COUNT(*), SUM(amount) FROM hafsql.operation_transfer_table WHERE \"from\" = 'user3' GROUP BY symbol",
+]
+
+TABLEINFO_MESSAGES = ["!tableinfo comments", "!tableinfo accounts", "!tableinfo transfer", "!tableinfo missing"]
+
+HELP_MESSAGES = [
+    "!help how do I find the latest posts of an account",
+    "!help which table has transfers",
+    "!help how do I count comments per day",
+]
+
+
+def build_workloads(handler):
+    """name -> list of coroutine factories, one per distinct request"""
+    return {
+        "hafsql": [lambda q=q: handler.handle_hafsql(q, "bench") for q in HAFSQL_QUERIES],
+        "aiquery": [lambda q=q: handler.handle_aiquery(q, "bench") for q in AIQUERY_CASES],
+        "tableinfo": [lambda m=m: handler.handle_tableinfo(m, "bench") for m in TABLEINFO_MESSAGES],
+        "help": [lambda m=m: handler.handle_help(m, "bench") for m in HELP_MESSAGES],
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_cell(requests, total, concurrency):
+    """Run total requests round robin over the workload's requests, concurrency at a time"""
+    latencies = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(n):
+        nonlocal errors
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await requests[n % len(requests)]()
+            except Exception as e:
+                errors += 1
+                print(f"    error: {e}")
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(total)))
+    wall = time.perf_counter() - start
+    return latencies, wall, errors
+
+
+async def run(args):
+    use_fixture_database(args.url)
+    counts = load_fixture(args.url, args.scale, args.reload)
+
+    # Measure the pipeline, not the caches, unless asked for
+    CACHE_CONFIG["enabled"] = args.cache
+    QUESTION_CACHE_CONFIG["enabled"] = args.cache
+    TEMPLATE_CONFIG["enabled"] = args.cache
+    SCHEMA_CONFIG["snapshot_path"] = ""
+    METRICS_CONFIG["trace_log"] = ""
+
+    from database import Database
+    from commands import CommandHandler
+
+    llm = FakeChatModel(latency=args.llm_latency, jitter=args.llm_jitter, seed=args.seed)
+    eval_llm = FakeChatModel(latency=args.llm_latency, jitter=args.llm_jitter, seed=args.seed + 1)
+    handler = CommandHandler(Database(DB_CONFIG), llm, eval_llm)
+    workloads = build_workloads(handler)
+
+    results = []
+    print(f"{'workload':<10} {'conc':>5} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8} {'peak MiB':>9} {'errors':>7}")
+    try:
+        for name in args.workloads:
+            # Warm up connections and parser caches outside the measurement
+            await run_cell(workloads[name], len(workloads[name]), 1)
+            for concurrency in args.concurrency:
+                if args.tracemalloc:
+                    tracemalloc.start()
+                latencies, wall, errors = await run_cell(workloads[name], args.requests, concurrency)
+                peak = 0
+                if args.tracemalloc:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+                cell = {
+                    "workload": name,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "errors": errors,
+                    "p50": percentile(latencies, 50),
+                    "p95": percentile(latencies, 95),
+                    "p99": percentile(latencies, 99),
+                    "throughput": len(latencies) / wall,
+                    "peak_bytes": peak,
+                }
+                results.append(cell)
+                print(f"{name:<10} {concurrency:>5} {cell['requests']:>5} "
+                      f"{cell['p50'] * 1000:>7.1f}ms {cell['p95'] * 1000:>7.1f}ms {cell['p99'] * 1000:>7.1f}ms "
+                      f"{cell['throughput']:>8.1f} {peak / 2 ** 20:>9.1f} {errors:>7}")
+    finally:
+        handler.db.close()
+
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {
+            "scale": args.scale,
+            "rows": counts,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "requests": args.requests,
+            "cache": args.cache,
+            "pool_size": DB_CONFIG["pool_size"],
+            "max_overflow": DB_CONFIG["max_overflow"],
+        },
+        # ru_maxrss is KiB on Linux
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "llm_calls": llm.calls + eval_llm.calls,
+        "results": results,
+    }
+
+
+def save(report):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"offline-{report['time'].replace(':', '')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def latest_result(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    paths = sorted(
+        os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR)
+        if name.startswith("offline-") and name.endswith(".json")
+    )
+    paths = [path for path in paths if path != exclude]
+    return paths[-1] if paths else None
+
+
+def compare(report, baseline, threshold):
+    """Print p95 and throughput change per cell, returns number of regressions"""
+    previous = {(cell["workload"], cell["concurrency"]): cell for cell in baseline["results"]}
+    if baseline["settings"] != report["settings"]:
+        print(f"Note: settings differ from the baseline: {baseline['settings']}")
+
+    regressions = 0
+    print("")
+    print(f"{'workload':<10} {'conc':>5} {'p95 before':>11} {'p95 now':>9} {'change':>8} {'req/s change':>13}")
+    for cell in report["results"]:
+        before = previous.get((cell["workload"], cell["concurrency"]))
+        if before is None:
+            continue
+        p95_change = cell["p95"] / before["p95"] - 1 if before["p95"] else 0.0
+        throughput_change = cell["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        regressed = p95_change > threshold or throughput_change < -threshold
+        regressions += regressed
+        print(f"{cell['workload']:<10} {cell['concurrency']:>5} {before['p95'] * 1000:>9.1f}ms "
+              f"{cell['p95'] * 1000:>7.1f}ms {p95_change:>+8.1%} {throughput_change:>+13.1%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("BENCH_PG_URL", DEFAULT_URL))
+    parser.add_argument("--scale", type=float, default=1.0, help="fixture row count multiplier")
+    parser.add_argument("--reload", action="store_true", help="recreate the fixture tables")
+    parser.add_argument("--workloads", default="hafsql,aiquery,tableinfo,help")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=50, help="requests per workload and concurrency")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache", action="store_true", help="keep query, question and SQL template caches enabled")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="skip peak memory tracking (it slows Python code down)")
+    parser.add_argument("--compare", help="baseline results file, or 'latest'")
+    parser.add_argument("--threshold", type=float, default=0.10, help="regression threshold (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+    args.workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    report = asyncio.run(run(args))
+    path = save(report)
+    print("")
+    print(f"max RSS: {report['max_rss_bytes'] / 2 ** 20:.1f} MiB, fake LLM calls: {report['llm_calls']}")
+    print(f"Results saved to {path}")
+
+    if args.compare:
+        baseline_path = latest_result(exclude=path) if args.compare == "latest" else args.compare
+        if not baseline_path:
+            print("No previous results to compare with.")
+            return 0
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline_path}")
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
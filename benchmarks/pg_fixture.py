@@ -0,0 +1,136 @@
+"""
+Synthetic HAF shaped hafsql schema in a local Postgres, for offline benchmarks.
+
+Tables follow the HafSQL names the prompts refer to (accounts_table, comments,
+operation_transfer_table). Data is generated server side with a fixed seed,
+authors and transfer parties are skewed towards a few busy accounts.
+"""
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from config import DB_CONFIG
+
+DEFAULT_URL = "postgresql://postgres@localhost/hafsql_bench"
+
+# Row counts at scale 1.0
+ROW_COUNTS = {
+    "accounts": 50_000,
+    "comments": 500_000,
+    "transfers": 300_000,
+}
+
+FIXTURE_SQL = [
+    "CREATE SCHEMA IF NOT EXISTS hafsql",
+    "DROP TABLE IF EXISTS hafsql.accounts_table, hafsql.comments, hafsql.operation_transfer_table, hafsql.bench_fixture",
+    "SELECT setseed(0.42)",
+
+    """CREATE TABLE hafsql.accounts_table (
+        id bigint PRIMARY KEY,
+        name varchar(16) NOT NULL,
+        created timestamp NOT NULL,
+        reputation bigint NOT NULL,
+        post_count integer NOT NULL,
+        json_metadata text
+    )""",
+    """INSERT INTO hafsql.accounts_table
+    SELECT g, 'user' || g, timestamp '2016-03-24' + g * interval '17 minutes',
+        floor(random() * 1e12)::bigint, floor(power(random(), 4) * 20000)::int, '{}'
+    FROM generate_series(1, :accounts) g""",
+    "CREATE UNIQUE INDEX ON hafsql.accounts_table (name)",
+
+    """CREATE TABLE hafsql.comments (
+        id bigint PRIMARY KEY,
+        author varchar(16) NOT NULL,
+        permlink varchar(255) NOT NULL,
+        parent_author varchar(16) NOT NULL,
+        parent_permlink varchar(255) NOT NULL,
+        title text NOT NULL,
+        body text NOT NULL,
+        category varchar(255) NOT NULL,
+        created timestamp NOT NULL,
+        net_votes integer NOT NULL,
+        pending_payout_value numeric NOT NULL
+    )""",
+    """INSERT INTO hafsql.comments
+    SELECT g,
+        'user' || (1 + floor(power(random(), 3) * :accounts)::int),
+        'permlink-' || g,
+        CASE WHEN g % 4 = 0 THEN '' ELSE 'user' || (1 + floor(power(random(), 3) * :accounts)::int) END,
+        CASE WHEN g % 4 = 0 THEN 'hive-' || (g % 100) ELSE 'permlink-' || greatest(g - 3, 1) END,
+        CASE WHEN g % 4 = 0 THEN 'Post title ' || g ELSE '' END,
+        repeat('lorem ipsum dolor sit amet ', 5 + (g % 60)),
+        'hive-' || (g % 100),
+        timestamp '2020-01-01' + g * interval '2 minutes',
+        floor(random() * 200)::int,
+        round((random() * 50)::numeric, 3)
+    FROM generate_series(1, :comments) g""",
+    "CREATE INDEX ON hafsql.comments (author, created)",
+    "CREATE INDEX ON hafsql.comments (created)",
+
+    """CREATE TABLE hafsql.operation_transfer_table (
+        id bigint PRIMARY KEY,
+        block_num integer NOT NULL,
+        trx_id varchar(40) NOT NULL,
+        timestamp timestamp NOT NULL,
+        "from" varchar(16) NOT NULL,
+        "to" varchar(16) NOT NULL,
+        amount numeric NOT NULL,
+        symbol varchar(8) NOT NULL,
+        memo text NOT NULL
+    )""",
+    """INSERT INTO hafsql.operation_transfer_table
+    SELECT g, 40000000 + g * 3, md5(g::text),
+        timestamp '2020-01-01' + g * interval '3 minutes',
+        'user' || (1 + floor(power(random(), 3) * :accounts)::int),
+        'user' || (1 + floor(power(random(), 3) * :accounts)::int),
+        round((random() * 1000)::numeric, 3),
+        CASE WHEN g % 3 = 0 THEN 'HBD' ELSE 'HIVE' END,
+        CASE WHEN g % 5 = 0 THEN 'invoice ' || g ELSE '' END
+    FROM generate_series(1, :transfers) g""",
+    """CREATE INDEX ON hafsql.operation_transfer_table ("from", timestamp)""",
+    """CREATE INDEX ON hafsql.operation_transfer_table ("to", timestamp)""",
+
+    "CREATE TABLE hafsql.bench_fixture (accounts integer, comments integer, transfers integer)",
+    "INSERT INTO hafsql.bench_fixture VALUES (:accounts, :comments, :transfers)",
+    "ANALYZE hafsql.accounts_table",
+    "ANALYZE hafsql.comments",
+    "ANALYZE hafsql.operation_transfer_table",
+]
+
+
+def row_counts(scale):
+    return {name: max(10, int(rows * scale)) for name, rows in ROW_COUNTS.items()}
+
+
+def load_fixture(url, scale=1.0, reload=False):
+    """Create the synthetic schema unless it is already loaded at this scale, returns row counts"""
+    counts = row_counts(scale)
+    engine = create_engine(url)
+    try:
+        with engine.begin() as connection:
+            loaded = None
+            if not reload:
+                exists = connection.execute(text("SELECT to_regclass('hafsql.bench_fixture')")).scalar()
+                if exists:
+                    loaded = connection.execute(
+                        text("SELECT accounts, comments, transfers FROM hafsql.bench_fixture")).fetchone()
+            if loaded and tuple(loaded) == (counts["accounts"], counts["comments"], counts["transfers"]):
+                print(f"Fixture already loaded: {counts}")
+                return counts
+
+            print(f"Loading fixture: {counts}")
+            for statement in FIXTURE_SQL:
+                # Only pass the parameters a statement uses, DDL has none
+                params = {name: value for name, value in counts.items() if f":{name}" in statement}
+                connection.execute(text(statement), params)
+    finally:
+        engine.dispose()
+    return counts
+
+
+def use_fixture_database(url):
+    """Point DB_CONFIG at the fixture database, before Database() is created"""
+    parsed = make_url(url)
+    DB_CONFIG["server"] = parsed.host or "localhost"
+    DB_CONFIG["database"] = parsed.database
+    DB_CONFIG["user"] = parsed.username
+    DB_CONFIG["password"] = parsed.password
@@ -0,0 +1,175 @@
+"""
+Record a corpus of !aiquery questions once, then replay it offline to judge
+prompt or pipeline changes on LLM calls, tokens, retries and latency.
+
+Record (needs HafSQL and an LLM key, HafSQL results are recorded too):
+    python -m benchmarks.replay --record --cassette corpus.jsonl
+Replay (no network; the schema comes from schema_snapshot.json):
+    python -m benchmarks.replay --cassette corpus.jsonl [--instant]
+
+Questions are read from --questions (one per line), default is a built-in list.
+A changed prompt is answered with the most similar call recorded for the same question.
+"""
+import sys
+import time
+import asyncio
+import argparse
+from sqlalchemy.exc import SQLAlchemyError
+from config import DB_CONFIG, LLM_CONFIG, CACHE_CONFIG, QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG
+import metrics
+from cassette import Cassette, CassetteChatModel, CassetteMissError, prompt_key
+
+QUESTIONS = [
+    "last 5 posts by alice",
+    "how many posts did alice write this month",
+    "top 10 authors by number of posts in the last week",
+    "who sent the most transfers to bob",
+    "last 10 transfers from alice",
+    "how many followers does alice have",
+    "alice hbd and hive balance",
+    "top 10 accounts by reputation",
+    "who reblogged the latest post from alice",
+    "proposals created this year",
+]
+
+
+class ReplayedDatabaseError(SQLAlchemyError):
+    """Database error recorded in the cassette"""
+
+
+def record_database(db, cassette):
+    """Route execute_query and explain_query of db through the cassette"""
+    execute_query = db.execute_query
+    explain_query = db.explain_query
+
+    async def cassette_execute_query(query, fetch_size=100, params=None):
+        key = prompt_key(f"{fetch_size}:{query}" + (f":{sorted(params.items())}" if params else ""))
+        if cassette.mode == "replay":
+            entry = cassette.replay("query", key, query)
+            await cassette.wait(entry)
+            if "error" in entry:
+                raise ReplayedDatabaseError(entry["error"])
+            return [tuple(row) for row in entry["rows"]], entry["header"]
+
+        start = time.perf_counter()
+        try:
+            rows, header = await execute_query(query, fetch_size, params)
+        except SQLAlchemyError as e:
+            cassette.record("query", key, {"prompt": query, "error": str(e), "latency": time.perf_counter() - start})
+            raise
+        cassette.record("query", key, {
+            "prompt": query, "rows": [list(row) for row in rows], "header": list(header),
+            "latency": time.perf_counter() - start
+        })
+        return rows, header
+
+    async def cassette_explain_query(query, params=None):
+        key = prompt_key(query + (f":{sorted(params.items())}" if params else ""))
+        if cassette.mode == "replay":
+            entry = cassette.replay("explain", key, query)
+            await cassette.wait(entry)
+            return entry["plan"]
+
+        start = time.perf_counter()
+        plan = await explain_query(query, params)
+        cassette.record("explain", key, {"prompt": query, "plan": plan, "latency": time.perf_counter() - start})
+        return plan
+
+    db.execute_query = cassette_execute_query
+    db.explain_query = cassette_explain_query
+
+
+def create_handler(cassette):
+    from database import Database
+    from commands import CommandHandler
+    from llm import create_chat_model
+
+    # Every question has to reach the LLM and the database
+    CACHE_CONFIG["enabled"] = False
+    QUESTION_CACHE_CONFIG["enabled"] = False
+    TEMPLATE_CONFIG["enabled"] = False
+
+    db = Database(DB_CONFIG)
+    record_database(db, cassette)
+    sql_llm = eval_llm = None
+    if cassette.mode == "record":
+        eval_llm = create_chat_model(LLM_CONFIG["eval_temp"], "Tables-Evaluator")
+        sql_llm = create_chat_model(LLM_CONFIG["query_temp"], "SQL-Generator")
+    return CommandHandler(
+        db,
+        CassetteChatModel(sql_llm, cassette, "SQL-Generator"),
+        CassetteChatModel(eval_llm, cassette, "Tables-Evaluator"))
+
+
+def counter(trace, name, **labels):
+    labels = tuple(sorted(labels.items()))
+    return sum(
+        amount for (counter_name, counter_labels), amount in trace.counters.items()
+        if counter_name == name and (not labels or counter_labels == labels)
+    )
+
+
+async def run(args):
+    cassette = Cassette(args.cassette, "record" if args.record else "replay", realtime=not args.instant)
+    handler = create_handler(cassette)
+
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    rows = []
+    print(f"{'question':<50} {'calls':>5} {'tokens':>7} {'retries':>7} {'latency':>8}  status")
+    try:
+        for question in questions:
+            status = "ok"
+            missed = cassette.stats["missed"]
+            start = time.perf_counter()
+            with cassette.scope(question), metrics.trace("aiquery", record=False) as trace:
+                try:
+                    await handler.handle_aiquery(question, "replay")
+                except CassetteMissError:
+                    status = "missing"
+                except Exception as e:
+                    status = "failed" if "Failed after" in str(e) else f"error: {e}"
+            latency = time.perf_counter() - start
+            if cassette.stats["missed"] > missed:
+                # Retries hide the miss, the replay does not match this question anymore
+                status = "missing"
+            row = {
+                "calls": counter(trace, "llm_calls"),
+                "tokens": counter(trace, "llm_tokens"),
+                "retries": counter(trace, "retries"),
+                "latency": latency,
+                "status": status,
+            }
+            rows.append(row)
+            print(f"{question[:50]:<50} {row['calls']:>5} {row['tokens']:>7} {row['retries']:>7} "
+                  f"{latency:>7.2f}s  {status}")
+    finally:
+        handler.db.close()
+
+    n = len(rows)
+    print("")
+    print(f"questions:             {n}")
+    print(f"answered:              {sum(row['status'] == 'ok' for row in rows)}")
+    print(f"LLM calls / question:  {sum(row['calls'] for row in rows) / n:.2f}")
+    print(f"tokens / question:     {sum(row['tokens'] for row in rows) / n:.0f}")
+    print(f"retries / question:    {sum(row['retries'] for row in rows) / n:.2f}")
+    print(f"mean latency:          {sum(row['latency'] for row in rows) / n:.2f}s"
+          f"{' (instant replay)' if cassette.mode == 'replay' and not cassette.realtime else ''}")
+    print(f"cassette:              {cassette.stats}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cassette", default="llm_cassette.jsonl")
+    parser.add_argument("--record", action="store_true", help="call HafSQL and the LLM, append to the cassette")
+    parser.add_argument("--instant", action="store_true", help="replay without the recorded latencies")
+    parser.add_argument("--questions", help="file with one question per line")
+    args = parser.parse_args(argv if argv is not None else sys.argv[1:])
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Load test CommandScheduler with simulated users, no Discord or HafSQL needed.
+
+A few heavy users flood !aiquery while light users and an admin send
+occasional commands at an arrival rate above the worker capacity.
+Reports per group latency percentiles and rejected requests.
+
+Run from the repository root:
+    python -m benchmarks.scheduler_load
+"""
+import time
+import random
+import asyncio
+from scheduler import CommandScheduler, QueueFullError
+
+DURATION = 20           # seconds of simulated traffic
+LLM_JOB_SECONDS = 0.5   # fake !aiquery latency
+DB_JOB_SECONDS = 0.1    # fake !hafsql latency
+WORKERS = {"llm": 4, "db": 4, "meta": 1}
+
+# group -> (users, requests per second per user, command class, is_admin)
+USER_GROUPS = {
+    "heavy": (3, 4.0, "llm", False),
+    "light": (20, 0.3, "llm", False),
+    "sql": (10, 0.5, "db", False),
+    "admin": (1, 0.5, "llm", True),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def simulate_user(scheduler, group, user_id, rate, command_class, is_admin, results):
+    job_seconds = LLM_JOB_SECONDS if command_class == "llm" else DB_JOB_SECONDS
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(random.expovariate(rate))
+        submitted = time.perf_counter()
+
+        async def job(submitted=submitted):
+            await asyncio.sleep(job_seconds)
+            results[group]["latency"].append(time.perf_counter() - submitted)
+
+        try:
+            scheduler.submit(command_class, user_id, job, is_admin=is_admin)
+        except QueueFullError:
+            results[group]["rejected"] += 1
+
+
+async def main():
+    random.seed(42)
+    scheduler = CommandScheduler(max_queued=40, max_queued_per_user=3, workers=WORKERS)
+    scheduler.start()
+
+    results = {group: {"latency": [], "rejected": 0} for group in USER_GROUPS}
+    users = []
+    for group, (count, rate, command_class, is_admin) in USER_GROUPS.items():
+        for n in range(count):
+            users.append(simulate_user(
+                scheduler, group, f"{group}-{n}", rate, command_class, is_admin, results))
+
+    await asyncio.gather(*users)
+    # Let queued work drain
+    while scheduler.queued() or any(scheduler.busy.values()):
+        await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    print(f"{'group':<8} {'done':>6} {'rejected':>9} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for group, result in results.items():
+        latency = result["latency"]
+        print(f"{group:<8} {len(latency):>6} {result['rejected']:>9} "
+              f"{percentile(latency, 50):>7.2f}s {percentile(latency, 95):>7.2f}s "
+              f"{percentile(latency, 99):>7.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Latency vs token spend of speculative SQL candidates against serial retries.
+
+Needs the same .env as the bot (HafSQL connection and an LLM key).
+Caches are disabled so every question goes through generation.
+Run from the repository root:
+    python -m benchmarks.speculative_sql [candidates ...]
+"""
+import sys
+import time
+import asyncio
+from config import SPECULATIVE_CONFIG
+from workers import create_command_handler
+
+QUESTIONS = [
+    "last 5 posts by alice",
+    "how many posts did alice write this month",
+    "top 10 authors by number of posts in the last week",
+    "who sent the most transfers to bob",
+    "how many followers does alice have",
+    "alice hbd and hive balance",
+    "top 10 accounts by reputation",
+    "who reblogged the latest post from alice",
+    "accounts delegating to bob",
+    "proposals created this year",
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(handler, candidates):
+    """Answer all questions, returns latencies, tokens and failures"""
+    SPECULATIVE_CONFIG["enabled"] = candidates > 1
+    SPECULATIVE_CONFIG["candidates"] = candidates
+    handler.candidate_llms = None
+    spent = {"prompt": 0, "completion": 0}
+    invoke_llm = handler._invoke_llm
+
+    async def counting_invoke_llm(prompt, llm=None):
+        # Prompt tokens are billed even when the candidate is cancelled later
+        spent["prompt"] += handler.prompt_builder.count_tokens(prompt)
+        response = await invoke_llm(prompt, llm)
+        spent["completion"] += handler.prompt_builder.count_tokens(response.content)
+        return response
+
+    handler._invoke_llm = counting_invoke_llm
+    latencies, failures = [], 0
+    try:
+        for question in QUESTIONS:
+            handler.db.flush_query_cache()
+            start = time.perf_counter()
+            try:
+                await handler.retry_sql_generation(question, "benchmark")
+            except Exception as e:
+                failures += 1
+                print(f"    failed: {question}: {e}")
+            latencies.append(time.perf_counter() - start)
+    finally:
+        handler._invoke_llm = invoke_llm
+    return latencies, spent, failures
+
+
+async def main():
+    sweep = [int(k) for k in sys.argv[1:]] or [1, 2, 3]
+    handler = create_command_handler()
+    handler.question_cache = None
+
+    results = []
+    for candidates in sweep:
+        print(f"running with {candidates} candidate(s)...")
+        latencies, spent, failures = await run(handler, candidates)
+        results.append((candidates, latencies, spent, failures))
+
+    n = len(QUESTIONS)
+    print("")
+    print(f"{'K':>3} {'p50':>8} {'p95':>8} {'mean':>8} {'tokens/q':>9} {'failed':>7}")
+    for candidates, latencies, spent, failures in results:
+        tokens = (spent["prompt"] + spent["completion"]) / n
+        print(f"{candidates:>3} {percentile(latencies, 0.5):>7.2f}s {percentile(latencies, 0.95):>7.2f}s "
+              f"{sum(latencies) / n:>7.2f}s {tokens:>9.0f} {failures:>7}")
+    print(f"speculative stats: {handler.speculative_stats}")
+
+    handler.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
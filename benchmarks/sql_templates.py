@@ -0,0 +1,85 @@
+"""
+!aiquery latency and LLM calls for questions that only differ in accounts or
+counts from already answered ones, with and without SQL templates.
+
+Uses the local Postgres fixture and the fake LLM of benchmarks.offline
+(BENCH_PG_URL, default postgresql://postgres@localhost/hafsql_bench).
+Run from the repository root:
+    python -m benchmarks.sql_templates [--llm-latency 0.5]
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+from config import DB_CONFIG, CACHE_CONFIG, QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SCHEMA_CONFIG, METRICS_CONFIG
+from benchmarks.pg_fixture import DEFAULT_URL, load_fixture, use_fixture_database
+from benchmarks.fake_llm import FakeChatModel, AIQUERY_CASES
+
+
+def variants(question, n):
+    """Same question about other accounts and counts"""
+    for k in range(1, n + 1):
+        text = re.sub(r"\buser\d+\b", f"user{10 + k}", question)
+        yield re.sub(r"\b(5|10)\b", lambda m: str(int(m.group()) + k), text)
+
+
+async def run(args, templates):
+    from database import Database
+    from commands import CommandHandler
+
+    TEMPLATE_CONFIG["enabled"] = templates
+    llm = FakeChatModel(latency=args.llm_latency, jitter=0, seed=args.seed)
+    eval_llm = FakeChatModel(latency=args.llm_latency, jitter=0, seed=args.seed + 1)
+    handler = CommandHandler(Database(DB_CONFIG), llm, eval_llm)
+    try:
+        # Answered once through the LLM, this is where templates are learned
+        for question in AIQUERY_CASES:
+            await handler.retry_sql_generation(question, "bench")
+        calls = llm.calls + eval_llm.calls
+
+        latencies = []
+        for question in AIQUERY_CASES:
+            for variant in variants(question, args.variants):
+                start = time.perf_counter()
+                try:
+                    await handler.retry_sql_generation(variant, "bench")
+                except Exception as e:
+                    print(f"    failed: {variant}: {e}")
+                latencies.append(time.perf_counter() - start)
+        stats = handler.template_cache.stats() if handler.template_cache is not None else None
+        return latencies, llm.calls + eval_llm.calls - calls, stats
+    finally:
+        handler.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("BENCH_PG_URL", DEFAULT_URL))
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--variants", type=int, default=5, help="reworded questions per case")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv if argv is not None else sys.argv[1:])
+
+    use_fixture_database(args.url)
+    load_fixture(args.url)
+    # Variants differ in entities, the question cache never answers them; results are not cached
+    CACHE_CONFIG["enabled"] = False
+    QUESTION_CACHE_CONFIG["enabled"] = True
+    SCHEMA_CONFIG["snapshot_path"] = ""
+    METRICS_CONFIG["trace_log"] = ""
+
+    print(f"{'templates':<10} {'questions':>9} {'LLM calls':>9} {'mean':>9} {'p50':>9}")
+    for templates in (False, True):
+        latencies, calls, stats = asyncio.run(run(args, templates))
+        latencies.sort()
+        print(f"{'on' if templates else 'off':<10} {len(latencies):>9} {calls:>9} "
+              f"{sum(latencies) / len(latencies) * 1000:>7.1f}ms {latencies[len(latencies) // 2] * 1000:>7.1f}ms")
+        if stats:
+            print(f"\ntemplates: {stats['entries']}, hit rate {stats['hit_rate']:.1%}, "
+                  f"failed {stats['failures']}, SQL generation time saved {stats['seconds_saved']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
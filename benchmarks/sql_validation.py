@@ -0,0 +1,77 @@
+"""
+Measure DB round-trips saved by local SQL validation.
+
+Input is a recorded JSONL file, one {"question": ..., "sql": ...} per line,
+e.g. the "Generated SQL" lines collected from the bot output.
+Every SQL is validated locally, then executed on HafSQL to check the verdict.
+
+Needs the same .env as the bot. Run from the repository root:
+    python -m benchmarks.sql_validation recorded_sql.jsonl
+"""
+import sys
+import json
+import time
+import asyncio
+from config import DB_CONFIG
+from database import Database
+from sql_validator import SQLValidator, SQLValidationError
+
+
+async def main(path):
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    db = Database(DB_CONFIG)
+    validator = SQLValidator(db)
+
+    saved_round_trips = 0
+    false_rejections = 0
+    missed_errors = 0
+    validation_time = 0.0
+    db_error_time = 0.0
+
+    for record in records:
+        start = time.perf_counter()
+        try:
+            sql_query = validator.validate(record["sql"])
+            local_error = None
+        except SQLValidationError as e:
+            sql_query = record["sql"]
+            local_error = str(e)
+        validation_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            await db.execute_query(sql_query)
+            db_error = None
+        except Exception as e:
+            db_error = str(e).splitlines()[0]
+        elapsed = time.perf_counter() - start
+
+        if local_error and db_error:
+            saved_round_trips += 1
+            db_error_time += elapsed
+        elif local_error:
+            false_rejections += 1
+            print(f"FALSE REJECTION: {record.get('question', '')}\n    {local_error}")
+        elif db_error:
+            missed_errors += 1
+            print(f"MISSED: {record.get('question', '')}\n    {db_error}")
+
+    n = len(records)
+    print("")
+    print(f"queries:                 {n}")
+    print(f"mean validation time:    {validation_time / n * 1e3:.2f}ms")
+    print(f"DB round-trips saved:    {saved_round_trips} ({db_error_time:.2f}s of failing queries)")
+    print(f"errors only found by DB: {missed_errors}")
+    print(f"false rejections:        {false_rejections}")
+    print(f"LIMIT added:             {validator.limits_added}")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1]))
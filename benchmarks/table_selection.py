@@ -0,0 +1,78 @@
+"""
+Compare local table index selection against the LLM evaluator.
+
+Needs the same .env as the bot (HafSQL connection and an LLM key).
+Run from the repository root:
+    python -m benchmarks.table_selection
+"""
+import time
+import asyncio
+from workers import create_command_handler
+
+QUESTIONS = [
+    "last 5 posts by alice",
+    "latest comments from bob",
+    "how many posts did alice write this month",
+    "top 10 authors by number of posts in the last week",
+    "who sent the most transfers to bob",
+    "last 10 transfers from alice",
+    "how many followers does alice have",
+    "who does bob follow",
+    "alice hbd and hive balance",
+    "top 10 accounts by reputation",
+    "when was the account alice created",
+    "who reblogged the latest post from alice",
+    "accounts delegating to bob",
+    "list the communities alice is subscribed to",
+    "proposals created this year",
+    "transfers to savings from alice",
+]
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+async def main():
+    handler = create_command_handler()
+    index = handler._get_table_index()
+
+    local_times, llm_times, agreements = [], [], []
+    confident_count = 0
+    top1_matches = 0
+
+    print(f"{'question':<55} {'local':>10} {'llm':>10} {'agree':>6}")
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        local_tables, confident = index.suggest(question)
+        local_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        llm_tables = await handler._get_suggested_tables(question, allow_local=False)
+        llm_times.append(time.perf_counter() - start)
+
+        agreement = jaccard(local_tables, llm_tables)
+        agreements.append(agreement)
+        confident_count += confident
+        top1_matches += bool(local_tables) and local_tables[0] in llm_tables
+
+        print(f"{question[:55]:<55} {local_times[-1] * 1e6:>8.0f}us "
+              f"{llm_times[-1] * 1e3:>8.0f}ms {agreement:>6.2f}"
+              f"{'' if confident else '  (low confidence)'}")
+        print(f"    local: {local_tables}")
+        print(f"    llm:   {llm_tables}")
+
+    n = len(QUESTIONS)
+    print("")
+    print(f"local mean latency: {sum(local_times) / n * 1e6:.0f}us")
+    print(f"llm mean latency:   {sum(llm_times) / n * 1e3:.0f}ms")
+    print(f"mean agreement:     {sum(agreements) / n:.2f}")
+    print(f"top-1 in llm set:   {top1_matches}/{n}")
+    print(f"confident (no llm): {confident_count}/{n}")
+
+    handler.db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
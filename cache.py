@@ -0,0 +1,291 @@
+import re
+import sys
+import time
+from collections import OrderedDict
+from config import CACHE_CONFIG, QUESTION_CACHE_CONFIG, DEBUG_MODE
+
+# String literals and quoted identifiers are kept verbatim, comments dropped,
+# whitespace collapsed and everything else lowercased
+SQL_TOKEN_PATTERN = re.compile(
+    r"(?P<literal>'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")"
+    r"|(?P<comment>--[^\n]*|/\*.*?\*/)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>[^'\"\s-]+|-)",
+    re.DOTALL
+)
+
+# Integer literal outside identifiers, casts ($1, ::int) and decimals
+SQL_NUMBER_PATTERN = re.compile(r"(?<![\w.:$])\d+(?![\w.])")
+
+WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|upsert|create|drop|alter|truncate|grant|revoke|"
+    r"copy|call|do|vacuum|analyze|lock|into|nextval|setval|pg_sleep)\b"
+)
+
+
+def normalize_sql(sql):
+    """Return SQL text with comments, whitespace and keyword case normalized"""
+    parts = []
+    for match in SQL_TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        if kind == "literal":
+            parts.append(match.group())
+        elif kind in ("comment", "space"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(match.group().lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def strip_literals(normalized_sql):
+    """Remove string literals so keyword checks only see SQL structure"""
+    return SQL_TOKEN_PATTERN.sub(
+        lambda m: "''" if m.lastgroup == "literal" else m.group(), normalized_sql)
+
+
+def is_read_only(normalized_sql):
+    """Check if a normalized statement is a single read-only SELECT"""
+    structure = strip_literals(normalized_sql)
+    if ";" in structure:
+        return False
+    if not (structure.startswith("select") or structure.startswith("with")):
+        return False
+    return not WRITE_KEYWORDS.search(structure)
+
+
+class QueryCache:
+    """TTL + LRU cache of query results bounded by an approximate memory budget"""
+    def __init__(self, ttl=None, max_bytes=None, max_entries=None):
+        self.ttl = ttl or CACHE_CONFIG["ttl"]
+        self.max_bytes = max_bytes or CACHE_CONFIG["max_bytes"]
+        self.max_entries = max_entries or CACHE_CONFIG["max_entries"]
+
+        self.entries = OrderedDict()    # key -> (expires_at, size, value)
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, query, *extra):
+        """Return cache key for a read-only query, None if it must not be cached"""
+        normalized = normalize_sql(query)
+        if not is_read_only(normalized):
+            return None
+        return (normalized,) + extra
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def contains(self, key):
+        """Check for a live entry without touching counters or LRU order"""
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def put(self, key, value):
+        size = self._estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.total_bytes += size
+
+        while self.entries and (
+                self.total_bytes > self.max_bytes or len(self.entries) > self.max_entries):
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def flush(self):
+        """Drop all entries, returns number of entries removed"""
+        count = len(self.entries)
+        self.entries.clear()
+        self.total_bytes = 0
+        return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _estimate_size(self, value):
+        rows, header = value
+        size = sys.getsizeof(rows) + sum(sys.getsizeof(col) for col in header)
+        for row in rows:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+        return size
+
+
+QUESTION_STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "from", "by", "with", "and",
+    "or", "is", "are", "was", "were", "be", "what", "which", "who", "whom", "how",
+    "show", "list", "give", "get", "find", "tell", "please", "can", "could", "you",
+    "me", "us", "all", "that", "this", "there", "do", "does", "did", "some"
+}
+
+FIRST_PERSON_WORDS = {"i", "me", "my", "mine", "myself", "we", "our", "ours"}
+
+REQUEST_VERBS = {"show", "give", "tell", "get", "find", "list", "fetch"}
+
+# Negation, comparison and direction words flip a filter or an ORDER BY,
+# a question with other ones is never a rewording ("isn't" tokenizes to "isn", "t")
+MODIFIER_WORDS = {
+    "not", "no", "without", "never", "except", "excluding", "isn", "aren", "wasn", "weren",
+    "doesn", "didn", "don", "hasn", "haven",
+    "more", "less", "fewer", "greater", "higher", "lower", "over", "under", "above", "below",
+    "least", "most", "max", "min", "maximum", "minimum", "highest", "lowest",
+    "before", "after", "since", "until", "latest", "newest", "oldest", "earliest",
+    "first", "last", "top", "bottom", "asc", "ascending", "desc", "descending"
+}
+
+QUESTION_TOKEN_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|@?[\w.-]+")
+
+
+def tokenize_question(question):
+    """Split question into lowercase tokens, quoted names kept whole"""
+    return [token.strip("'\"").lower() for token in QUESTION_TOKEN_PATTERN.findall(question)]
+
+
+def sql_literal_values(sql_query):
+    """Lowercased string literals and integer literals of sql_query"""
+    values = set()
+    for match in SQL_TOKEN_PATTERN.finditer(sql_query):
+        if match.lastgroup == "literal" and match.group().startswith("'"):
+            values.add(match.group()[1:-1].replace("''", "'").lower())
+        elif match.lastgroup == "other":
+            values.update(SQL_NUMBER_PATTERN.findall(match.group()))
+    return values
+
+
+def _stem(token):
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+class QuestionCache:
+    """Question -> validated SQL pairs with normalized and token-set fuzzy matching"""
+    def __init__(self, similarity=None, ttl=None, max_entries=None):
+        self.similarity = similarity or QUESTION_CACHE_CONFIG["similarity"]
+        self.ttl = ttl or QUESTION_CACHE_CONFIG["ttl"]
+        self.max_entries = max_entries or QUESTION_CACHE_CONFIG["max_entries"]
+
+        # key -> (expires_at, scope, terms, entities, sql, bound)
+        # bound: question tokens the SQL has as literals, a reworded question must contain them
+        self.entries = OrderedDict()
+
+        self.exact_hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+
+    def _analyze(self, question, username):
+        tokens = tokenize_question(question)
+        # Questions about "my posts" depend on who is asking, "show me ..." does not
+        personal = [
+            t for i, t in enumerate(tokens)
+            if t in FIRST_PERSON_WORDS and not (t == "me" and i and tokens[i - 1] in REQUEST_VERBS)
+        ]
+        scope = username.lower() if personal else ""
+        terms = frozenset(_stem(t) for t in tokens if t not in QUESTION_STOPWORDS)
+        # Numbers, names and modifier words must always match exactly, never fuzzily
+        entities = frozenset(
+            t for t in terms if any(c.isdigit() for c in t) or t.startswith("@") or t in MODIFIER_WORDS)
+        key = (scope, " ".join(sorted(terms)))
+        return key, scope, terms, entities
+
+    def _values(self, question):
+        return {token.lstrip("@") for token in tokenize_question(question)}
+
+    def lookup(self, question, username):
+        """Return cached SQL for question or a close rewording, None on miss"""
+        key, scope, terms, entities = self._analyze(question, username)
+        values = self._values(question)
+        now = time.monotonic()
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] >= now:
+            self.entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry[4]
+
+        best_key, best_score = None, 0.0
+        for candidate_key, (expires_at, c_scope, c_terms, c_entities, _, bound) in self.entries.items():
+            if expires_at < now or c_scope != scope or c_entities != entities:
+                continue
+            # Names are not told apart from other words, but a name the SQL filters on is
+            if not bound <= values:
+                continue
+            union = len(terms | c_terms)
+            score = len(terms & c_terms) / union if union else 0.0
+            if score > best_score:
+                best_key, best_score = candidate_key, score
+
+        if best_key is not None and best_score >= self.similarity:
+            self.entries.move_to_end(best_key)
+            self.fuzzy_hits += 1
+            if (DEBUG_MODE):
+                print(f"Question cache fuzzy hit ({best_score:.2f}): {question}")
+            return self.entries[best_key][4]
+
+        self.misses += 1
+        return None
+
+    def store(self, question, username, sql_query):
+        """Remember SQL that executed successfully for question"""
+        key, scope, terms, entities = self._analyze(question, username)
+        if not terms:
+            return
+        bound = frozenset(self._values(question) & sql_literal_values(sql_query))
+        self.entries[key] = (time.monotonic() + self.ttl, scope, terms, entities, sql_query, bound)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, sql_query):
+        """Forget every question mapped to sql_query"""
+        stale = [key for key, entry in self.entries.items() if entry[4] == sql_query]
+        for key in stale:
+            del self.entries[key]
+
+    def flush(self):
+        count = len(self.entries)
+        self.entries.clear()
+        return count
+
+    def stats(self):
+        hits = self.exact_hits + self.fuzzy_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "exact_hits": self.exact_hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,187 @@
+import json
+import time
+import asyncio
+import difflib
+import hashlib
+import contextvars
+from langchain_core.messages import AIMessage, AIMessageChunk
+from config import LLM_CASSETTE_CONFIG, DEBUG_MODE
+
+# Question being answered, recorded with every call so replays can match changed prompts
+_current_scope = contextvars.ContextVar("cassette_scope", default=None)
+
+STREAM_CHUNK_SIZE = 16
+
+
+class CassetteMissError(Exception):
+    """Replay found no recorded response for a call"""
+
+
+def prompt_key(prompt):
+    return hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """Recorded LLM (and optionally database) calls in a JSON lines file.
+    Record appends every call, replay serves them back in recorded order"""
+    def __init__(self, path=None, mode=None, realtime=None):
+        self.path = path or LLM_CASSETTE_CONFIG["path"]
+        self.mode = mode or LLM_CASSETTE_CONFIG["mode"]
+        self.realtime = LLM_CASSETTE_CONFIG["realtime"] if realtime is None else realtime
+        self.entries = {}   # (kind, key) -> [entry]
+        self.served = {}    # (kind, key) -> responses served so far
+        self.by_scope = {}  # (kind, scope) -> [entry]
+        self.stats = {"recorded": 0, "replayed": 0, "similar": 0, "missed": 0}
+        if self.mode == "replay":
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+        print(f"Cassette: {sum(len(e) for e in self.entries.values())} calls loaded from {self.path}")
+
+    def _index(self, entry):
+        self.entries.setdefault((entry["kind"], entry["key"]), []).append(entry)
+        if entry.get("scope"):
+            self.by_scope.setdefault((entry["kind"], entry["scope"]), []).append(entry)
+
+    def scope(self, name):
+        """Tag calls with the question being answered: with cassette.scope(question): ..."""
+        return _Scope(name)
+
+    def record(self, kind, key, entry):
+        entry = dict(entry, kind=kind, key=key, scope=_current_scope.get(), recorded_at=time.time())
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+        self._index(entry)
+        self.stats["recorded"] += 1
+
+    def replay(self, kind, key, prompt=None):
+        """Next recorded entry for this call, the last one repeats once all were served"""
+        entries = self.entries.get((kind, key))
+        if entries:
+            served = self.served.get((kind, key), 0)
+            self.served[(kind, key)] = served + 1
+            self.stats["replayed"] += 1
+            return entries[min(served, len(entries) - 1)]
+
+        # Changed prompt: most similar call recorded for the same question
+        scope = _current_scope.get()
+        if prompt is not None and scope is not None:
+            candidates = self.by_scope.get((kind, scope), [])
+            if candidates:
+                best = max(
+                    candidates,
+                    key=lambda entry: difflib.SequenceMatcher(None, entry.get("prompt", ""), prompt).ratio())
+                self.stats["similar"] += 1
+                if (DEBUG_MODE):
+                    print(f"Cassette: no exact {kind} match, using most similar call of '{scope}'")
+                return best
+
+        self.stats["missed"] += 1
+        raise CassetteMissError(f"Cassette has no recorded {kind} call for this prompt ({self.path})")
+
+    async def wait(self, entry):
+        if self.realtime and entry.get("latency"):
+            await asyncio.sleep(entry["latency"])
+
+
+class _Scope:
+    def __init__(self, name):
+        self.name = name
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_scope.set(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_scope.reset(self.token)
+        return False
+
+
+def _usage(response):
+    usage = getattr(response, "usage_metadata", None)
+    return dict(usage) if usage else None
+
+
+class CassetteChatModel:
+    """Chat model wrapper: records calls of llm, or replays them without llm"""
+    def __init__(self, llm, cassette, name="llm"):
+        self.llm = llm
+        self.cassette = cassette
+        self.name = name
+
+    @property
+    def _llm_type(self):
+        # Keep the wrapped provider's concurrency limit
+        return getattr(self.llm, "_llm_type", "cassette")
+
+    @property
+    def model_name(self):
+        return getattr(self.llm, "model_name", None)
+
+    def model_copy(self, update=None, **kwargs):
+        llm = self.llm
+        if llm is not None and hasattr(llm, "model_copy"):
+            llm = llm.model_copy(update=update, **kwargs)
+        return CassetteChatModel(llm, self.cassette, self.name)
+
+    async def ainvoke(self, prompt):
+        prompt = str(prompt)
+        key = prompt_key(prompt)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.replay("llm", key, prompt)
+            await self.cassette.wait(entry)
+            return AIMessage(content=entry["response"], usage_metadata=entry.get("usage"))
+
+        start = time.perf_counter()
+        response = await self.llm.ainvoke(prompt)
+        self.cassette.record("llm", key, {
+            "model": self.name,
+            "prompt": prompt,
+            "response": response.content,
+            "usage": _usage(response),
+            "latency": time.perf_counter() - start
+        })
+        return response
+
+    async def astream(self, prompt):
+        prompt = str(prompt)
+        key = prompt_key(prompt)
+        if self.cassette.mode == "replay":
+            entry = self.cassette.replay("llm", key, prompt)
+            text = entry["response"]
+            chunks = [text[n:n + STREAM_CHUNK_SIZE] for n in range(0, len(text), STREAM_CHUNK_SIZE)] or [""]
+            first_token = entry.get("first_token", entry.get("latency")) or 0
+            rest = max(0.0, (entry.get("latency") or 0) - first_token)
+            if self.cassette.realtime:
+                await asyncio.sleep(first_token)
+            for chunk in chunks:
+                if self.cassette.realtime:
+                    await asyncio.sleep(rest / len(chunks))
+                yield AIMessageChunk(content=chunk)
+            if entry.get("usage"):
+                yield AIMessageChunk(content="", usage_metadata=entry["usage"])
+            return
+
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        usage = None
+        async for chunk in self.llm.astream(prompt):
+            if first_token is None and chunk.content:
+                first_token = time.perf_counter() - start
+            parts.append(chunk.content)
+            usage = _usage(chunk) or usage
+            yield chunk
+        self.cassette.record("llm", key, {
+            "model": self.name,
+            "prompt": prompt,
+            "response": "".join(parts),
+            "usage": usage,
+            "latency": time.perf_counter() - start,
+            "first_token": first_token
+        })
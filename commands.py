@@ -1,27 +1,93 @@
+import io
 import re
+import time
+import datetime
 import asyncio
-from config import DEBUG_MODE
+import metrics
+from sqlalchemy.exc import SQLAlchemyError
+from config import DEBUG_MODE, QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, TABLE_INDEX_CONFIG, SQL_VALIDATION_CONFIG, \
+    SPECULATIVE_CONFIG, PAGINATION_CONFIG
+from llm import LLMLimiter
+from cache import QuestionCache
+from sql_templates import TemplateCache, render_sql
+from table_index import TableIndex
+from cost_guard import CostGuard, QueryCostError
+from sql_validator import SQLValidator, SQLValidationError
+from prompt_builder import SchemaPromptBuilder
+from pagination import first_page
 from table2ascii import table2ascii as t2a, PresetStyle
 from langchain_core.prompts import PromptTemplate
 
+EXPORT_OPTIONS = {"csv", "ndjson", "json", "jsonl", "gzip", "gz"}
+
+# Targeted instructions for the SQL repair prompt, by error class
+REPAIR_HINTS = {
+    "unknown_column": "A column does not exist. Use only columns listed in the schema, check which table each column belongs to.",
+    "unknown_table": "A table does not exist. Use only tables listed in the schema.",
+    "syntax": "The query is not valid PostgreSQL. Fix the syntax, return a single SELECT statement.",
+    "timeout": "The query took too long. Filter on specific accounts, authors or a recent time range and avoid scanning whole tables.",
+    "too_expensive": "The query plan is too expensive. Filter on specific accounts, authors or a recent time range, aggregate less data and keep a LIMIT.",
+    "empty_result": "The query returned no rows. Check filters: exact username spelling, title<>'' for posts, date ranges that are too narrow.",
+    "other": "Fix the query considering the error message and tables schema."
+}
+
+
+class ResultFile(io.BytesIO):
+    """Formatted results, page is the PageState when more pages follow"""
+    page = None
+
+
+class EmptyResultError(Exception):
+    """Generated SQL ran but returned nothing"""
+
+
+class NoRelevantTablesError(Exception):
+    """Table selection returned no table present in the schema"""
+
+
+class CandidatesFailedError(Exception):
+    """No speculative SQL candidate passed, carries the one to repair"""
+    def __init__(self, sql_query, error, candidates):
+        self.sql_query = sql_query
+        self.error = error
+        super().__init__(f"All {candidates} SQL candidates failed. First error: {error}")
+
 class CommandHandler:
-    def __init__(self, db, llm_chain, query_evaluator):
+    def __init__(self, db, llm_chain, query_evaluator, llm_limiter=None):
         self.db = db
         self.llm_chain = llm_chain
         self.query_eval = query_evaluator
-
-    async def handle_hafsql(self, sql_query, user_display_name):
+        self.llm_limiter = llm_limiter or LLMLimiter()
+        self.question_cache = QuestionCache() if QUESTION_CACHE_CONFIG["enabled"] else None
+        self.template_cache = TemplateCache() if TEMPLATE_CONFIG["enabled"] else None
+        self.table_index = None
+        self._indexed_schema = None
+        self.cost_guard = CostGuard(db)
+        self.sql_validator = SQLValidator(db)
+        self.prompt_builder = SchemaPromptBuilder(db)
+        self.candidate_llms = None
+        self.candidate_guard = CostGuard(db, max_cost=SPECULATIVE_CONFIG["max_cost"])
+        self.speculative_stats = {"runs": 0, "candidates": 0, "cancelled": 0, "failed": 0, "wins": {}}
+
+    async def handle_hafsql(self, sql_query, user_display_name, on_token=None):
         """Handle !hafsql command - execute user query"""
         # sql_query = message.content.split(" ", 1)[1]
         try:
-            rows, header = await self.db.execute_query(sql_query)
+            # Next pages come from the query as written, without the LIMIT added below
+            page_query = sql_query
+            # Hand written SQL the parser does not know is left for HafSQL to judge
+            sql_query = self._validate_sql(sql_query, strict=False)
+            sql_query = await self._check_cost(sql_query)
+            rows, header = await self._execute_query(sql_query)
             # Check if the query returned empty results
             if not rows or not header:
                 return "Query executed, but no results found. Please check your query."
-            return await self._format_response(None, rows, header)
+            return await self._format_response(None, rows, header, first_page(page_query, rows, header))
+        except (SQLValidationError, QueryCostError) as e:
+            return f"{user_display_name}, query not executed.\n```\n{str(e)}\n```"
         except Exception as e:
             ai_explain = await self.handle_help(
-                "Explain and/or suggest new query for this error format:\n" + str(e), user_display_name, False)
+                "Explain and/or suggest new query for this error format:\n" + str(e), user_display_name, False, on_token)
             return f"{ai_explain}\n\n```\n{str(e)}\n```"
         
 
@@ -31,11 +97,72 @@ class CommandHandler:
         sql_query, rows, header = await self.retry_sql_generation(message, user_display_name)
         
         if sql_query:
-            return await self._format_response(sql_query, rows, header)
+            # Next pages come from the SQL without the LIMIT validation added, like !hafsql
+            page_query = getattr(sql_query, "page_query", sql_query)
+            return await self._format_response(sql_query, rows, header, first_page(page_query, rows, header))
         else:
             raise Exception("Failed to generate valid SQL query")
 
 
+    async def handle_page(self, page, user_display_name):
+        """Fetch the page a PageState points at (next/previous buttons).
+        Returns ResultFile, or a message when there are no rows; page is updated"""
+        sql_query, params = page.query()
+        # LIMIT is part of the page query, too expensive pages are rejected, not rewritten
+        sql_query = await self._check_cost(sql_query, params=params, fetch_size=page.page_size + 1)
+        rows, header = await self._execute_query(sql_query, params, fetch_size=page.page_size + 1)
+        rows = page.advance(list(rows), header)
+        if not rows:
+            return "No more rows."
+        return await self._format_response(None, rows, header, page)
+
+
+    async def handle_export(self, message, user_display_name):
+        """Handle !export [csv|ndjson] [gzip] <sql> - stream full results to a file.
+        Returns (content, file_buffer, filename), file_buffer is None on errors"""
+        fmt = "csv"
+        compress = False
+        sql_query = message.strip()
+        while True:
+            parts = sql_query.split(None, 1)
+            if not parts or parts[0].lower() not in EXPORT_OPTIONS:
+                break
+            option = parts[0].lower()
+            sql_query = parts[1] if len(parts) > 1 else ""
+            if option in ("gzip", "gz"):
+                compress = True
+            else:
+                fmt = "ndjson" if option in ("ndjson", "json", "jsonl") else "csv"
+
+        if not sql_query:
+            return "Please specify a query. Usage: !export [csv|ndjson] [gzip] <sql>", None, None
+
+        try:
+            # Exports are the full result, read-only single statement but no LIMIT
+            sql_query = self._validate_sql(sql_query, strict=False, limit=False)
+        except SQLValidationError as e:
+            return f"{user_display_name}, query not executed.\n```\n{str(e)}\n```", None, None
+
+        try:
+            # Never cached, and a LIMIT would cut the export short without saying so
+            with metrics.span("cost_guard"):
+                await self.cost_guard.check(sql_query, rewrite=False)
+            with metrics.span("db_export"):
+                buffer, row_count, truncated = await self.db.export_query(sql_query, fmt, compress)
+            metrics.count("rows_returned", row_count, command="export")
+        except QueryCostError as e:
+            return f"{user_display_name}, query not executed.\n```\n{str(e)}\n```", None, None
+        except Exception as e:
+            return f"An error occurred: ```\n{str(e)}\n```", None, None
+
+        filename = f"export.{fmt}" + (".gz" if compress else "")
+        content = f"{user_display_name}, exported {row_count} rows."
+        if truncated:
+            content += (f" Output reached the attachment size limit, rows after #{row_count} were not included."
+                        " Narrow the query (WHERE/LIMIT) to get the rest.")
+        return content, buffer, filename
+
+
     async def handle_tablelist(self, message, user_display_name):
         """Handle !tablelist command - shows all available tables"""
         try:
@@ -80,8 +207,125 @@ class CommandHandler:
             return (f"An error occurred: {str(e)}")
 
 
-    async def handle_help(self, help_text, user_display_name, include_tables=True):
-        """Handle !help command - provides conversational help about tables and queries"""
+    async def handle_cache(self, message, user_display_name):
+        """Handle !cache [flush] command - show or flush query result cache (admin)"""
+        params = message.split()
+        if len(params) > 1 and params[1].lower() == "flush":
+            removed = self.db.flush_query_cache()
+            if self.question_cache is not None:
+                removed += self.question_cache.flush()
+            if self.template_cache is not None:
+                removed += self.template_cache.flush()
+            return f"Query cache flushed, {removed} entries removed."
+
+        response = ""
+        stats = self.db.get_query_cache_stats()
+        if stats is None:
+            response += "Query cache is disabled.\n"
+        else:
+            response += (
+                "Query Cache:\n```\n"
+                f"entries:   {stats['entries']}\n"
+                f"memory:    {stats['bytes'] / 1024:.1f} KiB\n"
+                f"hits:      {stats['hits']}\n"
+                f"misses:    {stats['misses']}\n"
+                f"hit rate:  {stats['hit_rate']:.1%}\n"
+                f"evictions: {stats['evictions']}\n"
+                "```\n"
+            )
+
+        if self.question_cache is None:
+            response += "Question cache is disabled.\n"
+        else:
+            stats = self.question_cache.stats()
+            response += (
+                "Question Cache:\n```\n"
+                f"entries:    {stats['entries']}\n"
+                f"exact hits: {stats['exact_hits']}\n"
+                f"fuzzy hits: {stats['fuzzy_hits']}\n"
+                f"misses:     {stats['misses']}\n"
+                f"hit rate:   {stats['hit_rate']:.1%}\n"
+                "```\n"
+            )
+
+        if self.template_cache is not None:
+            stats = self.template_cache.stats()
+            response += (
+                "SQL Templates:\n```\n"
+                f"templates:  {stats['entries']} ({stats['learned']} learned)\n"
+                f"hits:       {stats['hits']}\n"
+                f"misses:     {stats['misses']}\n"
+                f"hit rate:   {stats['hit_rate']:.1%}\n"
+                f"failed:     {stats['failures']}\n"
+                f"no rows:    {stats['empty']}\n"
+                f"time saved: {stats['seconds_saved']:.1f}s of SQL generation\n"
+                "```\n"
+            )
+
+        stats = self.db.get_replica_stats()
+        if stats is not None:
+            as_of = (datetime.datetime.fromtimestamp(stats["oldest_as_of"], datetime.timezone.utc)
+                     .strftime("%Y-%m-%d %H:%M:%S UTC") if stats["oldest_as_of"] else "-")
+            response += (
+                "Hot Query Replica:\n```\n"
+                f"entries:    {stats['entries']}\n"
+                f"hits:       {stats['hits']}\n"
+                f"misses:     {stats['misses']}\n"
+                f"too stale:  {stats['stale']}\n"
+                f"hit rate:   {stats['hit_rate']:.1%}\n"
+                f"refreshes:  {stats['refreshes']}\n"
+                f"oldest:     {as_of}\n"
+                "```\n"
+            )
+            if stats["top_shapes"]:
+                response += "Hottest shapes:\n```\n" + "\n".join(
+                    f"{hits or 0:>6} hits {entries:>4} cached  {shape[:120]}"
+                    for shape, entries, hits in stats["top_shapes"]) + "\n```\n"
+
+        stats = self.prompt_builder.stats()
+        if stats["prompts"]:
+            response += (
+                "SQL Prompt Schemas:\n```\n"
+                f"prompts:      {stats['prompts']}\n"
+                f"avg tokens:   {stats['prompt_tokens'] / stats['prompts']:.0f}\n"
+                f"tokens saved: {stats['tokens_saved']} ({stats['tokens_saved'] / stats['full_tokens']:.1%})\n"
+                "```\n"
+            )
+
+        stats = self.speculative_stats
+        if stats["runs"]:
+            wins = ", ".join(f"t={t}: {n}" for t, n in sorted(stats["wins"].items(), key=lambda w: str(w[0])))
+            response += (
+                "Speculative SQL:\n```\n"
+                f"runs:       {stats['runs']}\n"
+                f"candidates: {stats['candidates']}\n"
+                f"cancelled:  {stats['cancelled']}\n"
+                f"all failed: {stats['failed']}\n"
+                f"wins:       {wins or '-'}\n"
+                "```\n"
+            )
+        return response
+
+
+    async def handle_reloadschema(self, message, user_display_name):
+        """Handle !reloadschema [force] command - pick up new tables and columns (admin)"""
+        force = "force" in message.lower().split()[1:]
+        changes = await self.db.refresh_schema_async(force=force)
+        if not changes:
+            return "Database schema is up to date."
+
+        response = "Database schema reloaded:\n"
+        for kind in ("added", "removed", "changed"):
+            if changes[kind]:
+                response += f"- {kind}: {', '.join(changes[kind])}\n"
+        if not any(changes.values()):
+            response += "- no table changes\n"
+        return response
+
+
+    async def handle_help(self, help_text, user_display_name, include_tables=True, on_token=None):
+        """Handle !help command - provides conversational help about tables and queries,
+        on_token is awaited with each response chunk when streaming"""
         try:
             # Create help context with available information
             help_context = self._create_help_prompt()
@@ -101,7 +345,11 @@ class CommandHandler:
                 print("Formatted Prompt:", formatted_prompt)
 
             # Get response from LLM
-            help_response = self.llm_chain.invoke(formatted_prompt)
+            with metrics.span("help_llm"):
+                if on_token is not None:
+                    return await self._stream_llm(formatted_prompt, on_token)
+
+                help_response = await self._invoke_llm(formatted_prompt)
 
             return help_response.content
                                
@@ -109,20 +357,65 @@ class CommandHandler:
             print(f"Error in !help: {str(e)}")
             return (f"An error occurred: {str(e)}")
 
-    async def _format_response(self, sql_query, rows, header):
-        """Format response data to readable table format"""
-        output = t2a(
-            header=header,
-            body=rows,
-            style=PresetStyle.thin_compact
-        )
-        
-        with open("sqlresult.txt", "w", encoding='utf-8') as f:
-            if sql_query:  # Only include query if it exists
-                f.write(f"Query: {sql_query}\n\nResults:\n{output}")
-            else:
-                f.write(str(output))
-        return "sqlresult.txt"
+    async def _invoke_llm(self, prompt, llm=None):
+        """Call the LLM asynchronously under its provider concurrency limit"""
+        response = await self.llm_limiter.ainvoke(llm or self.llm_chain, prompt)
+        metrics.count("llm_calls")
+        metrics.count_llm_tokens(response)
+        return response
+
+    async def _stream_llm(self, prompt, on_token, llm=None):
+        """Stream the LLM response to on_token, returns the whole text"""
+        parts = []
+        async for chunk in self.llm_limiter.astream(llm or self.llm_chain, prompt):
+            metrics.count_llm_tokens(chunk)
+            if chunk.content:
+                parts.append(chunk.content)
+                await on_token(chunk.content)
+        metrics.count("llm_calls")
+        return "".join(parts)
+
+    async def _check_cost(self, sql_query, guard=None, params=None, fetch_size=None):
+        """fetch_size as given to _execute_query, so cached results skip EXPLAIN"""
+        with metrics.span("cost_guard"):
+            return await (guard or self.cost_guard).check(
+                sql_query, params, fetch_size or PAGINATION_CONFIG["page_size"])
+
+    async def _execute_query(self, sql_query, params=None, fetch_size=None):
+        with metrics.span("db_query"):
+            rows, header = await self.db.execute_query(
+                sql_query, fetch_size or PAGINATION_CONFIG["page_size"], params=params)
+        metrics.count("rows_returned", len(rows) if rows else 0, command="query")
+        return rows, header
+
+    async def _format_response(self, sql_query, rows, header, page=None):
+        """Format response data to readable table format, returns in-memory text file"""
+        with metrics.span("format"):
+            output = t2a(
+                header=header,
+                body=rows,
+                style=PresetStyle.thin_compact
+            )
+
+        if sql_query:  # Only include query if it exists
+            content = f"Query: {sql_query}\n\nResults:\n{output}"
+        else:
+            content = str(output)
+
+        # Answered by the local replica, say how old the data is
+        as_of = getattr(rows, "as_of", None)
+        if as_of is not None:
+            as_of = datetime.datetime.fromtimestamp(as_of, datetime.timezone.utc)
+            content = f"Results as of {as_of:%Y-%m-%d %H:%M:%S} UTC (local replica)\n\n{content}"
+
+        if page is not None:
+            first = page.page * page.page_size + 1
+            content = f"Page {page.page + 1}, rows {first}-{first + len(rows) - 1}\n\n{content}"
+
+        # One buffer per request, concurrent queries never share results
+        response = ResultFile(content.encode("utf-8"))
+        response.page = page
+        return response
     
     def extract_JsonContent(self, text):
         # Extract SQL query block from different models response
@@ -173,32 +466,250 @@ class CommandHandler:
     
 
     async def retry_sql_generation(self, query_text, username, max_retries=3, retry_delay=2):
-        """Attempt to execute AI Query with retries"""
+        """Attempt to execute AI Query, repairing only the stage that failed"""
+        question = query_text
+
+        # A previously answered question goes straight to the database
+        sql_query = await self._lookup_cached_sql(question, username)
+        if sql_query:
+            try:
+                rows, header = await self._execute_query(sql_query)
+                return sql_query, rows, header
+            except Exception as e:
+                print(f"Cached SQL failed, regenerating: {e}")
+                self.question_cache.invalidate(sql_query)
+
+        # Same question shape with other accounts, counts or dates: fill in the template
+        result = await self._lookup_template(question, username)
+        if result:
+            template, params = result
+            try:
+                # Parameters never change the statement, only EXPLAIN with the new values
+                sql_query = await self._check_cost(template.sql_query, params=params)
+                rows, header = await self._execute_query(sql_query, params)
+                if rows:
+                    return render_sql(sql_query, params), rows, header
+                # Nothing found, more likely a wrong slot value than an empty answer
+                if (DEBUG_MODE):
+                    print(f"SQL template found no rows, regenerating: {params}")
+                self.template_cache.no_rows(template)
+            except Exception as e:
+                print(f"SQL template failed, regenerating: {e}")
+                self.template_cache.invalidate(template)
+
+        start = time.perf_counter()
+        relevant_schemas = None
+        sql_query = None
         last_error = None
+        repair = None   # (error_kind, error) the next attempt has to fix
+        checked = False # SQL already validated and EXPLAINed by a speculative candidate
+        rate_limited = 0
+        empty_repaired = False
 
         for attempt in range(max_retries):
             try:
-                # Get suggested tables
-                suggested_tables = await self._get_suggested_tables(query_text)
-                
-                # Get and validate schemas
-                relevant_schemas = await self._get_relevant_schemas(suggested_tables)
-                
-                # Generate and execute SQL query
-                sql_query = await self._generate_sql_query(query_text, relevant_schemas, username)
-                rows, header = await self.db.execute_query(sql_query)
-                
+                # Stage 1: table selection, kept across attempts unless it was the problem
+                if relevant_schemas is None:
+                    selection_text = question
+                    if repair:
+                        selection_text += f"\n\nPrevious attempt failed with error: {repair[1]}"
+                    with metrics.span("table_selection"):
+                        suggested_tables = await self._get_suggested_tables(
+                            selection_text, allow_local=(repair is None))
+                        relevant_schemas = await self._get_relevant_schemas(suggested_tables)
+
+                # Stage 2: generate once, afterwards ask for a targeted fix of the previous SQL
+                if sql_query is None and SPECULATIVE_CONFIG["enabled"]:
+                    with metrics.span("speculative_sql"):
+                        sql_query = await self._speculative_sql_query(question, relevant_schemas, username)
+                    checked = True
+                elif sql_query is None:
+                    sql_query = await self._generate_sql_query(question, relevant_schemas, username)
+                elif repair:
+                    sql_query = await self._repair_sql_query(
+                        question, relevant_schemas, username, sql_query, repair[1], repair[0])
+                repair = None
+
+                # Stage 3: local checks, then HafSQL
+                if not checked:
+                    sql_query = self._validate_sql(sql_query)
+                    sql_query = await self._check_cost(sql_query)
+                checked = False
+                generation_seconds = time.perf_counter() - start
+                rows, header = await self._execute_query(sql_query)
+
+                # Empty results get one repair attempt, then are accepted as the answer
+                if not rows and not empty_repaired and attempt < max_retries - 1:
+                    empty_repaired = True
+                    raise EmptyResultError("Query executed but returned no rows.")
+
+                if self.question_cache is not None:
+                    self.question_cache.store(question, username, sql_query)
+                if self.template_cache is not None and rows:
+                    self.template_cache.learn(question, username, sql_query, generation_seconds)
+
                 return sql_query, rows, header
 
             except Exception as e:
+                if isinstance(e, CandidatesFailedError):
+                    # Repair the best failed candidate like a single generated query
+                    sql_query, e = e.sql_query, e.error
                 last_error = str(e)
-                query_text = await self._handle_retry_error(query_text, last_error, attempt, max_retries)
-                await asyncio.sleep(retry_delay)
-
-        return None, None, None
-
-    async def _get_suggested_tables(self, query_text):
+                error_kind = self._classify_error(e)
+                metrics.count("retries", kind=error_kind)
+                self._log_retry_error(error_kind, last_error, attempt, max_retries)
+
+                if error_kind == "rate_limit":
+                    # Only provider throttling is worth waiting for, the failed stage runs again as is
+                    await asyncio.sleep(retry_delay * (2 ** rate_limited))
+                    rate_limited += 1
+                    continue
+
+                repair = (error_kind, last_error)
+                if error_kind in ("unknown_table", "no_tables"):
+                    relevant_schemas = None
+                elif error_kind == "generation":
+                    sql_query = None
+                    repair = None
+
+        raise Exception(f"Failed after {max_retries} attempts. Last error: {last_error}")
+
+    def _get_candidate_llms(self):
+        """SQL generation model copies, one per speculative candidate temperature"""
+        if self.candidate_llms is None:
+            temperatures = SPECULATIVE_CONFIG["temperatures"] or [None]
+            self.candidate_llms = []
+            for n in range(SPECULATIVE_CONFIG["candidates"]):
+                temperature = temperatures[n % len(temperatures)]
+                llm = self.llm_chain
+                if temperature is not None and hasattr(llm, "model_copy"):
+                    llm = llm.model_copy(update={"temperature": temperature})
+                self.candidate_llms.append((temperature, llm))
+        return self.candidate_llms
+
+    async def _speculative_sql_query(self, question, relevant_schemas, username):
+        """Generate candidates concurrently, return the first one that passes
+        validation and EXPLAIN, cancelling the others"""
+        async def candidate(llm):
+            sql_query = None
+            try:
+                sql_query = await self._generate_sql_query(question, relevant_schemas, username, llm)
+                sql_query = self._validate_sql(sql_query)
+                return await self._check_cost(sql_query, self.candidate_guard)
+            except Exception as e:
+                raise CandidatesFailedError(sql_query, e, 1) from e
+
+        candidate_llms = self._get_candidate_llms()
+        tasks = {asyncio.create_task(candidate(llm)): temperature for temperature, llm in candidate_llms}
+        self.speculative_stats["runs"] += 1
+        self.speculative_stats["candidates"] += len(tasks)
+        start = asyncio.get_running_loop().time()
+        failures = []
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        failures.append(task.exception())
+                        continue
+                    temperature = tasks[task]
+                    wins = self.speculative_stats["wins"]
+                    wins[temperature] = wins.get(temperature, 0) + 1
+                    self.speculative_stats["cancelled"] += len(pending)
+                    print(f"Speculative SQL: candidate t={temperature} won after "
+                          f"{asyncio.get_running_loop().time() - start:.2f}s, "
+                          f"{len(failures)} failed, {len(pending)} cancelled")
+                    return task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+        self.speculative_stats["failed"] += 1
+        # Prefer a failure with SQL to repair over a failed generation
+        failure = next((f for f in failures if f.sql_query), failures[0])
+        raise CandidatesFailedError(failure.sql_query, failure.error, len(tasks))
+
+    def _classify_error(self, error):
+        """Map an exception to the pipeline stage that has to be re-run"""
+        message = str(error).lower()
+        if isinstance(error, EmptyResultError):
+            return "empty_result"
+        if isinstance(error, QueryCostError):
+            return "too_expensive"
+        if isinstance(error, NoRelevantTablesError):
+            return "no_tables"
+        if "rate limit" in message or "ratelimit" in type(error).__name__.lower() \
+                or "429" in message or "too many requests" in message:
+            return "rate_limit"
+        if isinstance(error, SQLValidationError):
+            if message.startswith("unknown table"):
+                return "unknown_table"
+            if message.startswith("column"):
+                return "unknown_column"
+            return "syntax"
+        if "undefinedtable" in message or ("relation" in message and "does not exist" in message):
+            return "unknown_table"
+        if "undefinedcolumn" in message or ("column" in message and "does not exist" in message):
+            return "unknown_column"
+        if "syntax error" in message or "syntaxerror" in message:
+            return "syntax"
+        if "timeout" in message or "canceling statement" in message or isinstance(error, asyncio.TimeoutError):
+            return "timeout"
+        if not isinstance(error, SQLAlchemyError):
+            return "generation"
+        return "other"
+
+    def _validate_sql(self, sql_query, strict=True, limit=True):
+        """Check SQL against the cached schema, returns SQL with LIMIT enforced unless limit=False"""
+        if not SQL_VALIDATION_CONFIG["enabled"]:
+            return sql_query
+        with metrics.span("sql_validation"):
+            return self.sql_validator.validate(sql_query, strict=strict, limit=limit)
+
+    async def _lookup_cached_sql(self, question, username):
+        """Return validated SQL from a previous answer to the same question"""
+        if self.question_cache is None:
+            return None
+        with metrics.span("question_cache"):
+            sql_query = self.question_cache.lookup(question, username)
+        metrics.count("question_cache", result="hit" if sql_query else "miss")
+        if sql_query and DEBUG_MODE:
+            print(f"Question cache hit:\n{sql_query}")
+        return sql_query
+
+    async def _lookup_template(self, question, username):
+        """Return (template, params) when question has the shape of an answered one"""
+        if self.template_cache is None:
+            return None
+        with metrics.span("sql_template"):
+            result = self.template_cache.lookup(question, username)
+        metrics.count("sql_template", result="hit" if result else "miss")
+        if result:
+            metrics.count("sql_template_seconds_saved", result[0].generation_seconds)
+        return result
+
+    def _get_table_index(self):
+        """Return table index, rebuilt whenever the database schema object changes"""
+        schema = self.db.get_database_schema()
+        if self.table_index is None or schema is not self._indexed_schema:
+            self.table_index = TableIndex(schema)
+            self._indexed_schema = schema
+        return self.table_index
+
+    async def _get_suggested_tables(self, query_text, allow_local=True):
         """Get relevant tables based on user input"""
+        # Retries ask for a wider selection, leave those to the LLM evaluator
+        if allow_local and TABLE_INDEX_CONFIG["enabled"]:
+            tables, confident = self._get_table_index().suggest(query_text)
+            if confident:
+                if DEBUG_MODE:
+                    print(f"Suggested tables (local index): {tables}")
+                return tables
+
         evaluator_prompt = self._create_evaluator_prompt(query_text)
         formatted_prompt = evaluator_prompt.format(
             input=query_text,
@@ -208,7 +719,7 @@ class CommandHandler:
         if DEBUG_MODE:
             print("Formatted Prompt:", formatted_prompt)
 
-        llm_response = self.llm_chain.invoke(formatted_prompt)
+        llm_response = await self._invoke_llm(formatted_prompt)
         
         if DEBUG_MODE:
             print(f"Raw evaluator response: {llm_response.content}")
@@ -247,7 +758,7 @@ class CommandHandler:
                 continue
 
         if not relevant_schemas:
-            raise Exception(f"No valid tables found among suggestions: {suggested_tables}")
+            raise NoRelevantTablesError(f"No valid tables found among suggestions: {suggested_tables}")
 
         if DEBUG_MODE:
             print("-"*30)
@@ -255,12 +766,10 @@ class CommandHandler:
 
         return relevant_schemas
 
-    async def _generate_sql_query(self, query_text, relevant_schemas, username):
+    async def _generate_sql_query(self, query_text, relevant_schemas, username, llm=None):
         """Generate SQL query using LLM"""
-        schemas_info = "\n".join([
-            f"{schema}"
-            for table, schema in relevant_schemas.items()
-        ])
+        model = getattr(self.llm_chain, "model_name", None)
+        schemas_info = self.prompt_builder.build(query_text, relevant_schemas, model)
 
         if DEBUG_MODE:
             print("-"*30)
@@ -276,7 +785,8 @@ class CommandHandler:
                 username=username
             )
             
-            llm_response = self.llm_chain.invoke(formatted_prompt)
+            with metrics.span("sql_generation"):
+                llm_response = await self._invoke_llm(formatted_prompt, llm)
             sql_query = self.extract_sql(llm_response.content)
             
             print("--"*30)
@@ -289,21 +799,36 @@ class CommandHandler:
             print(f"Error generating SQL query: {e}")
             raise
 
-    async def _handle_retry_error(self, query_text, error, attempt, max_retries):
-        """Handle retry error and format error context"""
-        error_context = f"""
-Attempt failed with error: {error}
-Please fix the SQL query considering the error message and tables schema.
-Try Select more Tables or Views or columns.
-"""
-        print("=="*30)
-        print(f"ERROR: ATTEMPT {attempt + 1} FAILED:\n{error}")
+    async def _repair_sql_query(self, query_text, relevant_schemas, username, sql_query, error, error_kind):
+        """Ask the LLM for a targeted fix of the failed SQL query"""
+        # Full table schemas: a pruned column may be the one the query needs
+        schemas_info = "\n".join(relevant_schemas.values())
+
+        repair_prompt = self._create_repair_prompt()
+        formatted_prompt = repair_prompt.format(
+            input=query_text,
+            dialect="PostgreSQL",
+            table_info=schemas_info,
+            username=username,
+            sql_query=sql_query,
+            error=error,
+            hint=REPAIR_HINTS.get(error_kind, REPAIR_HINTS["other"])
+        )
+
+        with metrics.span("sql_repair"):
+            llm_response = await self._invoke_llm(formatted_prompt)
+        sql_query = self.extract_sql(llm_response.content)
+
+        print("--"*30)
+        print(f"Repaired SQL ({error_kind}):\n{sql_query}")
         print("")
 
-        if attempt == max_retries - 1:
-            raise Exception(f"Failed after {max_retries} attempts. Last error: {error}")
+        return sql_query
 
-        return f"{query_text}\n\n{error_context}"
+    def _log_retry_error(self, error_kind, error, attempt, max_retries):
+        print("=="*30)
+        print(f"ERROR: ATTEMPT {attempt + 1}/{max_retries} FAILED ({error_kind}):\n{error}")
+        print("")
     
 
     def _create_sql_prompt(self):
@@ -345,6 +870,45 @@ RESPOND ONLY THE SQL Query:
         )
     
 
+    def _create_repair_prompt(self):
+        """
+        Create a prompt template to fix a SQL query that failed.
+        Returns: PromptTemplate: A prompt template for SQL query repair
+        """
+        REPAIR_PROMPT = """
+You are an expert in {dialect}. The SQL query below was generated to answer a question but it failed.
+Fix the query. Keep everything that is correct and change only what the error requires.
+
+# **Key SQL Guidelines:**
+- **IMPORTANT: DO NOT create DELETE, UPDATE, or INSERT statements.**
+- Use table and columns names exactly as specified in the schema.
+- Keep a `LIMIT`.
+
+# **Failed SQL Query:**
+```sql
+{sql_query}
+```
+
+# **Error:**
+{error}
+
+# **How to fix it:**
+{hint}
+
+# **Tables Schema:**
+{table_info}
+
+{username} Question: {input}
+
+RESPOND ONLY THE SQL Query:
+"""
+
+        return PromptTemplate(
+            input_variables=['input', 'dialect', 'table_info', 'username', 'sql_query', 'error', 'hint'],
+            template=REPAIR_PROMPT,
+        )
+
+
     def _create_evaluator_prompt(self, input):
         """
         Create a custom SQL query prompt template for SQL query generation.
@@ -410,6 +974,7 @@ Provide a helpful response with examples if applicable in Discord Markdown text.
 - !hafsql: Execute direct SQL queries
 - !tablelist: Show all available tables
 - !tableinfo: Show specific table schema
+- !export: Export full query results as CSV or NDJSON file (optionally gzip)
 - !help: Ask question so I can help
 
 # Available Tables and Their Purpose:
@@ -420,7 +985,8 @@ Provide a helpful response with examples if applicable in Discord Markdown text.
 'hafsql': ['!hafsql', '!sql', '!query'],
 'tablelist': ['!tablelist', '!tables', '!tl'],
 'tableinfo': ['!tableinfo', '!info', '!ti'],
-'help': ['!help', '!h', '!?']
+'help': ['!help', '!h', '!?'],
+'export': ['!export']
 """
         return PromptTemplate(
             input_variables=['tables_list', 'help_text', 'dialect', 'username'],
@@ -13,12 +13,175 @@ DISCORD_CONFIG = {
     "max_daily_queries": 25
 }
 
+# Rate limit store: "memory" for a single process, "sqlite" to share limits
+# between bot processes and keep them across restarts
+RATE_LIMIT_CONFIG = {
+    "backend": os.environ.get("RATE_LIMIT_BACKEND", "memory"),
+    "sqlite_path": os.environ.get("RATE_LIMIT_SQLITE_PATH", "rate_limits.db"),
+    # Buckets unused this long are full again and can be dropped
+    "idle_ttl": int(os.environ.get("RATE_LIMIT_IDLE_TTL", 86400)),
+    "max_entries": int(os.environ.get("RATE_LIMIT_MAX_ENTRIES", 100000)),
+    "evict_every": 1000
+}
+
+# Command scheduler: bounded queue and worker pools per command class
+SCHEDULER_CONFIG = {
+    # Waiting commands per class, and per user within a class
+    "max_queued": int(os.environ.get("SCHEDULER_MAX_QUEUED", 50)),
+    "max_queued_per_user": int(os.environ.get("SCHEDULER_MAX_QUEUED_PER_USER", 3)),
+    "llm_workers": int(os.environ.get("SCHEDULER_LLM_WORKERS", 4)),
+    "db_workers": int(os.environ.get("SCHEDULER_DB_WORKERS", 6)),
+    "meta_workers": int(os.environ.get("SCHEDULER_META_WORKERS", 2))
+}
+
+# Deployment mode: "inline" runs commands in the Discord process,
+# "process" only parses commands there and runs them on worker processes.
+# Every worker has its own HafSQL pool, HafSQL sees up to
+# processes x (HAFSQL_POOL_SIZE + HAFSQL_MAX_OVERFLOW) connections
+WORKER_CONFIG = {
+    "mode": os.environ.get("WORKER_MODE", "inline"),
+    "processes": int(os.environ.get("WORKER_PROCESSES", os.cpu_count() or 2)),
+    # Commands each worker process runs concurrently
+    "concurrency": int(os.environ.get("WORKER_CONCURRENCY", 8)),
+    "job_timeout": int(os.environ.get("WORKER_JOB_TIMEOUT", 300))
+}
+
+# Prometheus metrics endpoint (METRICS_PORT=0 disables it) and per command trace log
+METRICS_CONFIG = {
+    "host": os.environ.get("METRICS_HOST", "127.0.0.1"),
+    "port": int(os.environ.get("METRICS_PORT", 0)),
+    # JSON lines file with the stage timings of every command, empty to disable
+    "trace_log": os.environ.get("METRICS_TRACE_LOG", "")
+}
+
+# Streaming LLM responses (!help, !hafsql error explanations) into Discord
+STREAM_CONFIG = {
+    "enabled": os.environ.get("STREAM_RESPONSES", "true").lower() == "true",
+    # Seconds between message edits, Discord rate limits edits per channel
+    "edit_interval": float(os.environ.get("STREAM_EDIT_INTERVAL", 1.0))
+}
+
 # Database Configuration
 DB_CONFIG = {
     "server": os.environ.get("HAFSQL_SERVER"),
     "database": os.environ.get("HAFSQL_DATABASE"),
     "user": os.environ.get("HAFSQL_USER"),
-    "password": os.environ.get("HAFSQL_PWD")
+    "password": os.environ.get("HAFSQL_PWD"),
+    # Connection pool shared by all concurrent !hafsql/!aiquery requests
+    "pool_size": int(os.environ.get("HAFSQL_POOL_SIZE", 5)),
+    "max_overflow": int(os.environ.get("HAFSQL_MAX_OVERFLOW", 5)),
+    "pool_timeout": int(os.environ.get("HAFSQL_POOL_TIMEOUT", 30)),
+    "pool_recycle": int(os.environ.get("HAFSQL_POOL_RECYCLE", 1800)),
+    "pool_pre_ping": os.environ.get("HAFSQL_POOL_PRE_PING", "true").lower() == "true"
+}
+
+# Schema snapshot, loaded on startup and validated in the background
+SCHEMA_CONFIG = {
+    "snapshot_path": os.environ.get("SCHEMA_SNAPSHOT_PATH", "schema_snapshot.json"),
+    # Seconds between catalog fingerprint checks, 0 only checks on startup
+    "refresh_interval": int(os.environ.get("SCHEMA_REFRESH_INTERVAL", 3600))
+}
+
+# Query Result Cache
+CACHE_CONFIG = {
+    "enabled": os.environ.get("QUERY_CACHE_ENABLED", "true").lower() == "true",
+    "ttl": int(os.environ.get("QUERY_CACHE_TTL", 300)),
+    "max_bytes": int(os.environ.get("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    "max_entries": int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", 1000))
+}
+
+# Local SQLite replica of hot queries: a query run hot_query_count times, or any query
+# of a shape (same SQL, other literals) run hot_shape_count times, within window seconds
+# is kept locally, refreshed every refresh_interval and served up to max_staleness old
+REPLICA_CONFIG = {
+    "enabled": os.environ.get("REPLICA_ENABLED", "false").lower() == "true",
+    "path": os.environ.get("REPLICA_PATH", "hot_queries.db"),
+    "hot_query_count": int(os.environ.get("REPLICA_HOT_QUERY_COUNT", 3)),
+    "hot_shape_count": int(os.environ.get("REPLICA_HOT_SHAPE_COUNT", 10)),
+    "window": int(os.environ.get("REPLICA_WINDOW", 3600)),
+    "refresh_interval": int(os.environ.get("REPLICA_REFRESH_INTERVAL", 300)),
+    "max_staleness": int(os.environ.get("REPLICA_MAX_STALENESS", 900)),
+    "check_interval": int(os.environ.get("REPLICA_CHECK_INTERVAL", 30)),
+    "refresh_batch": int(os.environ.get("REPLICA_REFRESH_BATCH", 20)),
+    "idle_ttl": int(os.environ.get("REPLICA_IDLE_TTL", 6 * 3600)),
+    "max_entries": int(os.environ.get("REPLICA_MAX_ENTRIES", 500)),
+    "max_result_bytes": int(os.environ.get("REPLICA_MAX_RESULT_BYTES", 1024 * 1024)),
+    "max_history": int(os.environ.get("REPLICA_MAX_HISTORY", 10000))
+}
+
+# Question -> SQL Cache (skips both LLM stages of !aiquery)
+QUESTION_CACHE_CONFIG = {
+    "enabled": os.environ.get("QUESTION_CACHE_ENABLED", "true").lower() == "true",
+    "similarity": float(os.environ.get("QUESTION_CACHE_SIMILARITY", 0.85)),
+    "ttl": int(os.environ.get("QUESTION_CACHE_TTL", 24 * 3600)),
+    "max_entries": int(os.environ.get("QUESTION_CACHE_MAX_ENTRIES", 500))
+}
+
+# Parameterized SQL templates: questions of a known shape with other
+# accounts, counts or dates skip the LLM
+TEMPLATE_CONFIG = {
+    "enabled": os.environ.get("SQL_TEMPLATES_ENABLED", "true").lower() == "true",
+    "ttl": int(os.environ.get("SQL_TEMPLATES_TTL", 24 * 3600)),
+    "max_entries": int(os.environ.get("SQL_TEMPLATES_MAX_ENTRIES", 300))
+}
+
+# Local table selection index (LLM evaluator only used below min_score)
+TABLE_INDEX_CONFIG = {
+    "enabled": os.environ.get("TABLE_INDEX_ENABLED", "true").lower() == "true",
+    "min_score": float(os.environ.get("TABLE_INDEX_MIN_SCORE", 4.0)),
+    "max_tables": int(os.environ.get("TABLE_INDEX_MAX_TABLES", 3)),
+    "relative_cutoff": float(os.environ.get("TABLE_INDEX_RELATIVE_CUTOFF", 0.6)),
+    "name_weight": 3
+}
+
+# Local SQL parse + schema validation before any database round-trip
+SQL_VALIDATION_CONFIG = {
+    "enabled": os.environ.get("SQL_VALIDATION_ENABLED", "true").lower() == "true",
+    # LIMIT added to queries that have none
+    "default_limit": int(os.environ.get("SQL_VALIDATION_DEFAULT_LIMIT", 100))
+}
+
+# EXPLAIN based cost guard for !hafsql and !aiquery
+COST_GUARD_CONFIG = {
+    "enabled": os.environ.get("COST_GUARD_ENABLED", "true").lower() == "true",
+    "max_cost": float(os.environ.get("COST_GUARD_MAX_COST", 1000000)),
+    "max_rows": int(os.environ.get("COST_GUARD_MAX_ROWS", 1000000)),
+    # LIMIT added to over-threshold queries that have none
+    "rewrite_limit": int(os.environ.get("COST_GUARD_REWRITE_LIMIT", 100))
+}
+
+# Speculative !aiquery: K SQL candidates generated concurrently, first one that
+# passes validation and EXPLAIN under max_cost runs, the others are cancelled
+SPECULATIVE_CONFIG = {
+    "enabled": os.environ.get("SPECULATIVE_SQL", "false").lower() == "true",
+    "candidates": int(os.environ.get("SPECULATIVE_CANDIDATES", 3)),
+    # One temperature per candidate, cycled when there are more candidates
+    "temperatures": [
+        float(t) for t in os.environ.get("SPECULATIVE_TEMPERATURES", "0.1,0.5,0.9").split(",") if t.strip()
+    ],
+    # EXPLAIN cost ceiling for candidates, 0 uses COST_GUARD_MAX_COST
+    "max_cost": float(os.environ.get("SPECULATIVE_MAX_COST", 0))
+}
+
+# !export streaming mode
+EXPORT_CONFIG = {
+    # Discord attachment size limit for the bot's server
+    "max_bytes": int(os.environ.get("EXPORT_MAX_BYTES", 8 * 1024 * 1024)),
+    "chunk_size": int(os.environ.get("EXPORT_CHUNK_SIZE", 1000)),
+    # Room for gzip sync flush markers and trailer
+    "gzip_overhead": 1024
+}
+
+# Result pages with next/previous buttons for !hafsql and !aiquery
+PAGINATION_CONFIG = {
+    "enabled": os.environ.get("PAGINATION_ENABLED", "true").lower() == "true",
+    "page_size": int(os.environ.get("PAGINATION_PAGE_SIZE", 100)),
+    # Buttons stop working after this long without a click
+    "session_ttl": int(os.environ.get("PAGINATION_SESSION_TTL", 900)),
+    "max_sessions": int(os.environ.get("PAGINATION_MAX_SESSIONS", 500)),
+    "max_sessions_per_user": int(os.environ.get("PAGINATION_MAX_SESSIONS_PER_USER", 3)),
+    # Queries without a usable ORDER BY page with OFFSET, up to this many rows
+    "max_offset": int(os.environ.get("PAGINATION_MAX_OFFSET", 5000))
 }
 
 # LLM Configuration
@@ -29,61 +192,82 @@ LLM_CONFIG = {
     "openai_model": os.environ.get("OPENAI_LLM_MODEL", "gpt-4o-mini"),
     "eval_temp": float(os.environ.get("EVAL_TEMPERATURE", 0.7)),
     "query_temp": float(os.environ.get("QUERY_TEMPERATURE", 0.1)),
-    "max_tokens": int(os.environ.get("LLM_MAX_TOKENS", 1024))
+    "max_tokens": int(os.environ.get("LLM_MAX_TOKENS", 1024)),
+    # Maximum concurrent requests in flight per provider
+    "max_inflight": int(os.environ.get("LLM_MAX_INFLIGHT", 8)),
+    "groq_max_inflight": int(os.environ.get("GROQ_MAX_INFLIGHT", os.environ.get("LLM_MAX_INFLIGHT", 8))),
+    "openai_max_inflight": int(os.environ.get("OPENAI_MAX_INFLIGHT", os.environ.get("LLM_MAX_INFLIGHT", 8)))
+}
+
+# Routing between providers when both GROQ_API_KEY and OPENAI_API_KEY are set
+LLM_ROUTER_CONFIG = {
+    "enabled": os.environ.get("LLM_ROUTER_ENABLED", "true").lower() == "true",
+    # Hedge a request to the next provider after this percentile of the provider latency
+    "hedge": os.environ.get("LLM_HEDGE_ENABLED", "true").lower() == "true",
+    "hedge_percentile": float(os.environ.get("LLM_HEDGE_PERCENTILE", 95)),
+    # Hedge delay until a provider has min_samples requests, and lower bound
+    "hedge_delay": float(os.environ.get("LLM_HEDGE_DELAY", 5.0)),
+    "min_hedge_delay": float(os.environ.get("LLM_MIN_HEDGE_DELAY", 0.5)),
+    "window": int(os.environ.get("LLM_ROUTER_WINDOW", 50)),
+    "min_samples": int(os.environ.get("LLM_ROUTER_MIN_SAMPLES", 10)),
+    # Circuit breaker: open after consecutive failures or error rate, retry after open_seconds
+    "failure_threshold": int(os.environ.get("LLM_BREAKER_FAILURES", 3)),
+    "max_error_rate": float(os.environ.get("LLM_BREAKER_ERROR_RATE", 0.5)),
+    "open_seconds": float(os.environ.get("LLM_BREAKER_OPEN_SECONDS", 30))
+}
+
+# Record LLM calls to a cassette file, or replay them offline (off, record, replay)
+LLM_CASSETTE_CONFIG = {
+    "mode": os.environ.get("LLM_CASSETTE_MODE", "off"),
+    "path": os.environ.get("LLM_CASSETTE_PATH", "llm_cassette.jsonl"),
+    # Replay with the recorded latencies, false answers instantly
+    "realtime": os.environ.get("LLM_CASSETTE_REALTIME", "true").lower() == "true"
+}
+
+# SQL generation prompt: token budget for the tables schema section,
+# per model overrides as "model=tokens,model=tokens"
+PROMPT_CONFIG = {
+    "schema_token_budget": int(os.environ.get("SCHEMA_TOKEN_BUDGET", 1500)),
+    "model_budgets": {
+        model.strip(): int(tokens)
+        for model, tokens in (
+            item.split("=", 1) for item in os.environ.get("SCHEMA_TOKEN_BUDGETS", "").split(",") if "=" in item
+        )
+    }
 }
 
 # SQL Queries
 SQL_QUERIES = {
-    "select_tables": """
-    SELECT table_name
-    FROM information_schema.tables
-    WHERE table_schema = 'hafsql'
-    AND table_type = 'BASE TABLE';
+    # Tables, views and their columns in one scan, DDL is built in database.py
+    "catalog": """
+    SELECT
+        t.table_name,
+        t.table_type,
+        c.column_name,
+        CASE
+            WHEN c.data_type IN ('character varying', 'char') AND c.character_maximum_length IS NOT NULL THEN
+                c.data_type || '(' || c.character_maximum_length || ')'
+            ELSE
+                COALESCE(c.data_type, 'UNKNOWN')
+        END AS column_type
+    FROM information_schema.tables t
+    LEFT JOIN information_schema.columns c
+        ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+    WHERE t.table_schema = 'hafsql'
+    AND t.table_type IN ('BASE TABLE', 'VIEW')
+    ORDER BY t.table_name, c.ordinal_position;
     """,
 
-    "select_views": """
-    SELECT table_name
-    FROM information_schema.views
-    WHERE table_schema = 'hafsql';
-    """,
-    
-    "create_tables_schema": """
-    SELECT 
-        'CREATE TABLE ' || table_name || ' (' ||
-        COALESCE(STRING_AGG(
-            column_name || ' ' || 
-            CASE 
-                WHEN data_type IN ('character varying', 'char') AND character_maximum_length IS NOT NULL THEN 
-                    data_type || '(' || character_maximum_length || ')'
-                ELSE 
-                    COALESCE(data_type, 'UNKNOWN')
-            END, ', '), 'NO COLUMNS'
-        ) 
-        || ');' AS create_table_ddl
+    # Cheap fingerprint to tell whether the cached catalog is still current
+    "catalog_fingerprint": """
+    SELECT
+        COUNT(*) AS column_count,
+        MD5(COALESCE(STRING_AGG(
+            table_name || '.' || column_name || ':' || COALESCE(data_type, ''), ','
+            ORDER BY table_name, ordinal_position
+        ), '')) AS catalog_hash
     FROM information_schema.columns
-    WHERE table_schema = 'hafsql' 
-    GROUP BY table_name;
-    """,
-
-    "create_views_schema": """
-    SELECT 
-        'CREATE VIEW ' || table_name || ' (' || 
-        STRING_AGG(
-            column_name || ' ' || 
-            CASE 
-                WHEN data_type IN ('character varying', 'char') THEN 
-                    data_type || '(' || character_maximum_length || ')'
-                ELSE 
-                    data_type
-            END, ', '
-        ) 
-        || ');' AS create_table_ddl
-    FROM information_schema.columns
-    WHERE table_schema = 'hafsql' 
-    AND table_name IN (
-        SELECT table_name FROM information_schema.views WHERE table_schema = 'hafsql'
-    )
-    GROUP BY table_name;
+    WHERE table_schema = 'hafsql';
     """
 }
 # SQL_QUERIES = {
@@ -0,0 +1,74 @@
+import re
+from config import COST_GUARD_CONFIG, DEBUG_MODE
+from cache import normalize_sql, strip_literals
+
+# LIMIT at the end of the outer statement, optionally followed by OFFSET
+TRAILING_LIMIT_PATTERN = re.compile(r"\blimit\s+\d+(\s+offset\s+\d+)?\s*$|\boffset\s+\d+\s+limit\s+\d+\s*$")
+
+
+class QueryCostError(Exception):
+    """Query plan estimate is above the configured thresholds"""
+    def __init__(self, total_cost, plan_rows, max_cost, max_rows):
+        self.total_cost = total_cost
+        self.plan_rows = plan_rows
+        super().__init__(
+            f"Query too expensive: estimated cost {total_cost:,.0f} (max {max_cost:,.0f}), "
+            f"estimated rows {plan_rows:,} (max {max_rows:,}). "
+            "Make it cheaper: filter on specific accounts, authors or recent time ranges, "
+            "avoid scanning whole large tables, aggregate less data and keep a LIMIT."
+        )
+
+
+def has_limit(sql_query):
+    """Check if the outer statement already ends with a LIMIT"""
+    return bool(TRAILING_LIMIT_PATTERN.search(strip_literals(normalize_sql(sql_query))))
+
+
+def add_limit(sql_query, limit):
+    """Wrap query so Postgres can stop after limit rows"""
+    sql_query = sql_query.strip().rstrip(";")
+    return f"SELECT * FROM (\n{sql_query}\n) AS limited_query LIMIT {limit}"
+
+
+class CostGuard:
+    """EXPLAIN based pre-flight check, rejects or limits queries over cost/row thresholds"""
+    def __init__(self, db, max_cost=None, max_rows=None, rewrite_limit=None):
+        self.db = db
+        self.max_cost = max_cost or COST_GUARD_CONFIG["max_cost"]
+        self.max_rows = max_rows or COST_GUARD_CONFIG["max_rows"]
+        self.rewrite_limit = rewrite_limit or COST_GUARD_CONFIG["rewrite_limit"]
+
+    def _within_limits(self, plan):
+        return plan["Total Cost"] <= self.max_cost and plan["Plan Rows"] <= self.max_rows
+
+    def _log(self, decision, plan, sql_query):
+        # Always printed, these lines are what thresholds get tuned from
+        query_line = " ".join(sql_query.split())
+        print(f"Cost guard: {decision} cost={plan['Total Cost']:.0f} rows={plan['Plan Rows']} "
+              f"(max cost={self.max_cost:.0f} rows={self.max_rows}) :: {query_line[:200]}")
+
+    async def check(self, sql_query, params=None, fetch_size=None, rewrite=True):
+        """Return SQL safe to execute (possibly with a LIMIT added), raise QueryCostError.
+        fetch_size is the one execute_query will get, None when the result is not read
+        through the cache; rewrite=False rejects over-threshold queries instead of limiting them"""
+        if not COST_GUARD_CONFIG["enabled"]:
+            return sql_query
+        if fetch_size is not None and self.db.has_cached_result(sql_query, fetch_size, params):
+            return sql_query
+
+        plan = await self.db.explain_query(sql_query, params)
+        if self._within_limits(plan):
+            if (DEBUG_MODE):
+                self._log("accept", plan, sql_query)
+            return sql_query
+
+        if rewrite and not has_limit(sql_query):
+            limited_query = add_limit(sql_query, self.rewrite_limit)
+            limited_plan = await self.db.explain_query(limited_query, params)
+            if self._within_limits(limited_plan):
+                self._log(f"rewrite LIMIT {self.rewrite_limit}", plan, sql_query)
+                return limited_query
+            plan = limited_plan
+
+        self._log("reject", plan, sql_query)
+        raise QueryCostError(plan["Total Cost"], plan["Plan Rows"], self.max_cost, self.max_rows)
@@ -1,7 +1,18 @@
-import re
+import io
+import os
+import csv
+import gzip
+import zlib
+import json
+import time
+import asyncio
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import URL
-from config import SQL_QUERIES, SKIP_TABLES, DEBUG_MODE, DB_CONFIG
+from config import SQL_QUERIES, SKIP_TABLES, DEBUG_MODE, DB_CONFIG, CACHE_CONFIG, SCHEMA_CONFIG, EXPORT_CONFIG, REPLICA_CONFIG
+from cache import QueryCache
+from replica import HotQueryReplica, ReplicaRows
 
 class Database:
     def __init__(self, config):
@@ -13,125 +24,364 @@ class Database:
             database=DB_CONFIG['database']
         )
 
-        self.db = create_engine(self.connection_string)
+        self.db = create_engine(
+            self.connection_string,
+            pool_size=DB_CONFIG["pool_size"],
+            max_overflow=DB_CONFIG["max_overflow"],
+            pool_timeout=DB_CONFIG["pool_timeout"],
+            pool_recycle=DB_CONFIG["pool_recycle"],
+            pool_pre_ping=DB_CONFIG["pool_pre_ping"]
+        )
+
+        # One worker per pooled connection, so queries never block the event loop
+        # and never wait on each other for a thread, only for a free connection
+        self.executor = ThreadPoolExecutor(
+            max_workers=DB_CONFIG["pool_size"] + DB_CONFIG["max_overflow"],
+            thread_name_prefix="hafsql"
+        )
+
+        # Results of read-only queries, shared by !hafsql and !aiquery
+        self.query_cache = QueryCache() if CACHE_CONFIG["enabled"] else None
+        self.inflight_queries = {}
+
+        # Hot queries answered locally, refreshed from HafSQL in the background
+        self.replica = HotQueryReplica() if REPLICA_CONFIG["enabled"] else None
 
         self.tables_list = []
         self.views_list = []
         self.database_list = []
 
-        self.tables_schema = {}
-        self.views_schema = {}
+        self.catalog = {}
         self.database_schema = {}
+        self.schema_fingerprint = None
 
         self._initialize_tables()
 
     def _initialize_tables(self):
-        """Initialize tables list and schema"""
+        """Initialize tables list and schema, from the local snapshot when available"""
+        snapshot = self._load_snapshot()
+        if snapshot:
+            self.schema_fingerprint = snapshot["fingerprint"]
+            self._apply_catalog(snapshot["catalog"])
+            if (DEBUG_MODE):
+                print(f"Database Schema loaded from {SCHEMA_CONFIG['snapshot_path']}.")
+            return
+
         if (DEBUG_MODE):
             print(f"connecting to", DB_CONFIG["server"])
         with self.db.connect() as connection:
             if (DEBUG_MODE):
                 print(f"Done.")
                 print(f"Geting database Schema")
+            fingerprint = self._fetch_fingerprint(connection)
+            catalog = self._fetch_catalog(connection)
 
-            # Get table names
-            result = connection.execute(text(SQL_QUERIES["select_tables"]))
-            rows = result.fetchall()
-            n = 0
-            for row in rows:
-                if self._is_table_available(row[0]):
-                    self.tables_list.append(row[0])
-                    if (DEBUG_MODE):
-                        n = n + 1
-                        print(f"{n:>3} {row[0]}")
-            if (DEBUG_MODE):
-                print("")
-
-            # Get views names
-            result = connection.execute(text(SQL_QUERIES["select_views"]))
-            rows = result.fetchall()
-            n = 0
-            for row in rows:
-                if self._is_table_available(row[0]):
-                    self.views_list.append(row[0])
-                    if (DEBUG_MODE):
-                        n = n + 1
-                        print(f"{n:>3} {row[0]}")
-            if (DEBUG_MODE):
-                print("")
-
-            # Get table schemas
-            result = connection.execute(text(SQL_QUERIES["create_tables_schema"]))
-            rows = result.fetchall()
-            n = 0
-            for row in rows:
-                create_statement = row[0]
-                # Extract table name from CREATE TABLE statement
-                match = re.search(r'CREATE TABLE (\w+)', create_statement)
-                if match:
-                    table_name = match.group(1)
-                    if self._is_table_available(table_name):
-                        # Extract columns part from the CREATE TABLE statement
-                        columns_match = re.search(r'\((.*?)\)', create_statement)
-                        if columns_match:
-                            self.database_schema[table_name] = create_statement
-                            if (DEBUG_MODE):
-                                n = n + 1
-                                print(f"{n:>3} {create_statement}")
-            # result = connection.execute(text(SQL_QUERIES["create_tables_schema"]))
-            # rows = result.fetchall()
-            # n = 0
-            # for row in rows:
-            #     if self._is_table_available(row[0]):
-            #         self.tables_schema.append(row[0])
-            #         if (DEBUG_MODE):
-            #             n = n + 1
-            #             print(f"{n:>3} {row[0]}")
-            if (DEBUG_MODE):
-                print("")
-
-            # Get views schemas
-            result = connection.execute(text(SQL_QUERIES["create_views_schema"]))
-            rows = result.fetchall()
-            n = 0
-            for row in rows:
-                create_statement = row[0]
-                # Extract table name from CREATE TABLE statement
-                match = re.search(r'CREATE VIEW (\w+)', create_statement)
-                if match:
-                    table_name = match.group(1)
-                    if self._is_table_available(table_name):
-                        # Extract columns part from the CREATE TABLE statement
-                        columns_match = re.search(r'\((.*?)\)', create_statement)
-                        if columns_match:
-                            self.database_schema[table_name] = create_statement
-                            if (DEBUG_MODE):
-                                n = n + 1
-                                print(f"{n:>3} {create_statement}")
+        self.schema_fingerprint = fingerprint
+        self._apply_catalog(catalog)
+        self._save_snapshot(fingerprint, catalog)
 
+        if (DEBUG_MODE):
+            print("")
+            print(f"Database Schema created.")
+
+    def _fetch_fingerprint(self, connection):
+        """Cheap column count + hash of the catalog, changes whenever the schema does"""
+        row = connection.execute(text(SQL_QUERIES["catalog_fingerprint"])).fetchone()
+        return f"{row[0]}:{row[1]}"
+
+    def _fetch_catalog(self, connection):
+        """Read tables, views and their columns in a single catalog scan"""
+        catalog = {}
+        result = connection.execute(text(SQL_QUERIES["catalog"]))
+        for table_name, table_type, column_name, column_type in result.fetchall():
+            if not self._is_table_available(table_name):
+                continue
+            entry = catalog.setdefault(table_name, {"type": table_type, "columns": []})
+            if column_name:
+                entry["columns"].append([column_name, column_type])
+        return catalog
+
+    def _apply_catalog(self, catalog, changed_tables=None):
+        """Build lists, DDL and prompt strings from catalog and swap them in"""
+        tables_list = []
+        views_list = []
+        database_schema = {}
+
+        for table_name in sorted(catalog):
+            entry = catalog[table_name]
+            if entry["type"] == "VIEW":
+                views_list.append(table_name)
+            else:
+                tables_list.append(table_name)
+            if not entry["columns"]:
+                continue
+            # Only tables that changed get their DDL rebuilt
+            if changed_tables is not None and table_name not in changed_tables \
+                    and table_name in self.database_schema:
+                database_schema[table_name] = self.database_schema[table_name]
+            else:
+                database_schema[table_name] = self._create_ddl(table_name, entry)
 
         # Join lists with newlines for prompt usage
-        self.database_list = (
-            "TABLES:\n```sql\n" + "\n".join(self.tables_list) + 
-            "\n```\nVIEWS:\n```sql\n" + "\n".join(self.views_list) + "\n```"
-        )
-        # self.database_schema = "\n".join(self.tables_schema).join(self.views_schema)
+        if tables_list == self.tables_list and views_list == self.views_list:
+            database_list = self.database_list
+        else:
+            database_list = (
+                "TABLES:\n```sql\n" + "\n".join(tables_list) +
+                "\n```\nVIEWS:\n```sql\n" + "\n".join(views_list) + "\n```"
+            )
 
-        # self.tables_list = "\n".join(self.tables_list)
-        # self.tables_schema = "\n".join(self.tables_schema)
-        
         if (DEBUG_MODE):
+            for n, create_statement in enumerate(database_schema.values(), 1):
+                print(f"{n:>3} {create_statement}")
             print("")
-            print(f"Database Schema created.")
+
+        # New objects are swapped in with no await in between, so coroutines
+        # reading the schema never see a mix of old and new structures
+        self.catalog = catalog
+        self.tables_list = tables_list
+        self.views_list = views_list
+        self.database_schema = database_schema
+        self.database_list = database_list
+
+    def _diff_catalog(self, old_catalog, new_catalog):
+        """Return (added, removed, changed) table names between two catalogs"""
+        added = sorted(set(new_catalog) - set(old_catalog))
+        removed = sorted(set(old_catalog) - set(new_catalog))
+        changed = sorted(
+            table_name for table_name in set(new_catalog) & set(old_catalog)
+            if new_catalog[table_name] != old_catalog[table_name]
+        )
+        return added, removed, changed
+
+    def _create_ddl(self, table_name, entry):
+        kind = "VIEW" if entry["type"] == "VIEW" else "TABLE"
+        columns = ", ".join(f"{name} {column_type}" for name, column_type in entry["columns"])
+        return f"CREATE {kind} {table_name} ({columns});"
+
+    def _load_snapshot(self):
+        path = SCHEMA_CONFIG["snapshot_path"]
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            if snapshot.get("server") != DB_CONFIG["server"] or "catalog" not in snapshot:
+                return None
+            # The fingerprint covers the live catalog only, a snapshot filtered
+            # with other SKIP_TABLES would never be refreshed
+            if snapshot.get("skip_tables") != sorted(SKIP_TABLES):
+                return None
+            return snapshot
+        except (OSError, ValueError) as e:
+            print(f"Ignoring schema snapshot {path}: {e}")
+            return None
+
+    def _save_snapshot(self, fingerprint, catalog):
+        path = SCHEMA_CONFIG["snapshot_path"]
+        if not path:
+            return
+        snapshot = {
+            "server": DB_CONFIG["server"],
+            "fingerprint": fingerprint,
+            "skip_tables": sorted(SKIP_TABLES),
+            "saved_at": time.time(),
+            "catalog": catalog
+        }
+        try:
+            # Write then rename, a crash never leaves a half written snapshot
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not save schema snapshot {path}: {e}")
+
+    def _fetch_schema_changes(self, force=False):
+        """Return (fingerprint, catalog) when the live catalog differs, else None"""
+        with self.db.connect() as connection:
+            fingerprint = self._fetch_fingerprint(connection)
+            if fingerprint == self.schema_fingerprint and not force:
+                return None
+            return fingerprint, self._fetch_catalog(connection)
+
+    async def refresh_schema_async(self, force=False):
+        """Incrementally reload the schema if HafSQL changed, without blocking the bot.
+        Returns dict with added/removed/changed tables, None when nothing changed"""
+        try:
+            changes = await self._run_in_executor(self._fetch_schema_changes, force)
+        except Exception as e:
+            print(f"Schema refresh failed: {str(e)}")
+            return None
+
+        if changes is None:
+            if (DEBUG_MODE):
+                print("Database Schema is up to date.")
+            return None
+
+        fingerprint, catalog = changes
+        added, removed, changed = self._diff_catalog(self.catalog, catalog)
+
+        # Applied on the event loop thread, queries in flight keep their references
+        self._apply_catalog(catalog, changed_tables=set(added) | set(changed))
+        self.schema_fingerprint = fingerprint
+        await self._run_in_executor(self._save_snapshot, fingerprint, catalog)
+
+        print(f"Database Schema refreshed: {len(added)} added, "
+              f"{len(removed)} removed, {len(changed)} changed.")
+        return {"added": added, "removed": removed, "changed": changed}
+
+    def start_schema_refresh(self):
+        """Validate the schema now and, if configured, keep checking it in the background"""
+        if SCHEMA_CONFIG["refresh_interval"] > 0:
+            return asyncio.create_task(self.refresh_schema_periodically(SCHEMA_CONFIG["refresh_interval"]))
+        return asyncio.create_task(self.refresh_schema_async())
+
+    async def refresh_schema_periodically(self, interval):
+        """Check the catalog fingerprint every interval seconds"""
+        while True:
+            await self.refresh_schema_async()
+            await asyncio.sleep(interval)
 
     def _is_table_available(self, table_name):
         """Check if table should be included"""
         return table_name not in SKIP_TABLES
 
-    async def execute_query(self, query, fetch_size=100):
+    async def execute_query(self, query, fetch_size=100, params=None):
+        """Run query on the pool executor without blocking the event loop,
+        params are bound to :name placeholders of query"""
+        cache_key = self._cache_key(query, fetch_size, params)
+
+        if cache_key is None:
+            return await self._execute_query_remote(query, fetch_size, params)
+
+        cached = self.query_cache.get(cache_key)
+        if cached is not None:
+            metrics.count("query_cache", result="hit")
+            if (DEBUG_MODE):
+                print(f"Query cache hit: {cache_key[0]}")
+            return cached
+
+        # Identical queries already running share the same round-trip
+        if cache_key in self.inflight_queries:
+            metrics.count("query_cache", result="coalesced")
+            return await asyncio.shield(self.inflight_queries[cache_key])
+
+        metrics.count("query_cache", result="miss")
+        future = asyncio.ensure_future(self._execute_query_remote(query, fetch_size, params))
+        self.inflight_queries[cache_key] = future
+        try:
+            result = await asyncio.shield(future)
+            # Replica rows are already old, cached they could outlive the staleness bound
+            if not isinstance(result[0], ReplicaRows):
+                self.query_cache.put(cache_key, result)
+            return result
+        finally:
+            self.inflight_queries.pop(cache_key, None)
+
+    def _cache_key(self, query, fetch_size, params):
+        if self.query_cache is None:
+            return None
+        if params:
+            return self.query_cache.make_key(query, fetch_size, tuple(sorted(params.items())))
+        return self.query_cache.make_key(query, fetch_size)
+
+    async def _execute_query_remote(self, query, fetch_size, params=None):
+        """Answer from the local replica when it has a fresh result, else HafSQL.
+        The replica only keeps queries without parameters"""
+        # The replica is a SQLite file with JSON rows, read and written on the executor too
+        if self.replica is not None and not params:
+            result = await self._run_in_executor(self.replica.lookup, query, fetch_size)
+            if result is not None:
+                metrics.count("replica", result="hit")
+                return result
+
+        rows, header = await self._run_in_executor(self._execute_query_sync, query, fetch_size, params)
+        if self.replica is not None and not params and \
+                await self._run_in_executor(self.replica.observe, query, fetch_size, rows, header):
+            metrics.count("replica", result="stored")
+        return rows, header
+
+    def start_replica_refresh(self):
+        """Keep hot query results in the local replica fresh"""
+        if self.replica is None:
+            return None
+        return asyncio.create_task(self.refresh_replica_periodically(REPLICA_CONFIG["check_interval"]))
+
+    async def refresh_replica_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_replica()
+            except Exception as e:
+                print(f"Replica refresh failed: {e}")
+
+    async def refresh_replica(self):
+        """Re-run replica queries older than the refresh interval, returns count refreshed"""
+        refreshed = 0
+        for query, fetch_size in await self._run_in_executor(self.replica.claim_refresh):
+            try:
+                rows, header = await self._run_in_executor(self._execute_query_sync, query, fetch_size)
+            except Exception as e:
+                # Claim expires, the next round tries again; the stale result stops being served
+                print(f"Replica refresh failed for query: {e}")
+                continue
+            await self._run_in_executor(self.replica.store, query, fetch_size, rows, header)
+            refreshed += 1
+        removed = await self._run_in_executor(self.replica.evict)
+        if (DEBUG_MODE) and (refreshed or removed):
+            print(f"Replica: {refreshed} refreshed, {removed} evicted")
+        return refreshed
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def has_cached_result(self, query, fetch_size=100, params=None):
+        """Check if execute_query would be answered from the result cache or the replica"""
+        if self.replica is not None and not params and self.replica.contains(query, fetch_size):
+            return True
+        cache_key = self._cache_key(query, fetch_size, params)
+        return cache_key is not None and self.query_cache.contains(cache_key)
+
+    async def explain_query(self, query, params=None):
+        """Return the planner's top plan node (Total Cost, Plan Rows, ...) for query"""
+        return await self._run_in_executor(self._explain_query_sync, query, params)
+
+    def _explain_query_sync(self, query, params=None):
+        query = query.strip().rstrip(";")
+        with self.db.connect() as connection:
+            result = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params or {})
+            plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    def flush_query_cache(self):
+        """Drop cached query results and the replica, returns number of entries removed"""
+        removed = 0
+        if self.replica is not None:
+            removed += self.replica.flush()
+        if self.query_cache is not None:
+            removed += self.query_cache.flush()
+        return removed
+
+    def get_query_cache_stats(self):
+        """Return query cache counters, None when caching is disabled"""
+        if self.query_cache is None:
+            return None
+        return self.query_cache.stats()
+
+    def get_replica_stats(self):
+        """Return hot query replica counters, None when the replica is disabled"""
+        if self.replica is None:
+            return None
+        return self.replica.stats()
+
+    def _execute_query_sync(self, query, fetch_size=100, params=None):
         try:
             with self.db.connect() as connection:
-                result = connection.execute(text(query))
+                result = connection.execute(text(query), params or {})
 
                 header = [col[0] for col in result.cursor.description]
 
@@ -147,6 +397,79 @@ class Database:
             print(f"Error: {str(e)}")
             raise
 
+    async def export_query(self, query, fmt="csv", compress=False):
+        """Stream full query results into a file buffer capped at the attachment limit.
+        Returns (buffer, row_count, truncated)"""
+        return await self._run_in_executor(self._export_query_sync, query, fmt, compress)
+
+    def _export_query_sync(self, query, fmt="csv", compress=False):
+        max_bytes = EXPORT_CONFIG["max_bytes"]
+        chunk_size = EXPORT_CONFIG["chunk_size"]
+
+        buffer = io.BytesIO()
+        output = gzip.GzipFile(fileobj=buffer, mode="wb") if compress else buffer
+        overhead = EXPORT_CONFIG["gzip_overhead"] if compress else 0
+
+        line = io.StringIO()
+        csv_writer = csv.writer(line)
+        row_count = 0
+        truncated = False
+
+        def encode(values):
+            line.seek(0)
+            line.truncate()
+            csv_writer.writerow(values)
+            return line.getvalue().encode("utf-8")
+
+        with self.db.connect() as connection:
+            # Server side cursor, only chunk_size rows are held in memory at once
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=chunk_size).execute(text(query))
+            header = list(result.keys())
+
+            # Uncompressed bytes not yet flushed to buffer, an upper bound on
+            # their compressed size so the limit is never exceeded
+            pending = 0
+            if fmt == "csv":
+                data = encode(header)
+                output.write(data)
+                pending += len(data) if compress else 0
+
+            for partition in result.partitions(chunk_size):
+                for row in partition:
+                    if fmt == "csv":
+                        data = encode(row)
+                    else:
+                        data = (json.dumps(dict(zip(header, row)), default=str) + "\n").encode("utf-8")
+
+                    if buffer.tell() + pending + len(data) + overhead > max_bytes:
+                        truncated = True
+                        break
+                    output.write(data)
+                    pending += len(data) if compress else 0
+                    row_count += 1
+                if truncated:
+                    break
+                if compress:
+                    output.flush(zlib.Z_SYNC_FLUSH)
+                    pending = 0
+            result.close()
+
+        if compress:
+            output.close()
+        buffer.seek(0)
+
+        if (DEBUG_MODE):
+            print(f"Export: {row_count} rows, {buffer.getbuffer().nbytes} bytes, truncated={truncated}")
+        return buffer, row_count, truncated
+
+    def close(self):
+        """Release executor threads and pooled connections"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.db.dispose()
+        if self.replica is not None:
+            self.replica.close()
+
 
     def get_tables_list(self):
         """Return formatted table list"""
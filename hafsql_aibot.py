@@ -1,9 +1,53 @@
+import io
+import time
 import discord
-from config import DISCORD_CONFIG, DB_CONFIG, LLM_CONFIG, DEBUG_MODE
-from database import Database
-from commands import CommandHandler
-from collections import defaultdict
-from datetime import datetime, timedelta
+import metrics
+from config import DISCORD_CONFIG, WORKER_CONFIG, STREAM_CONFIG, METRICS_CONFIG, PAGINATION_CONFIG, DEBUG_MODE
+from llm import create_chat_model
+from scheduler import CommandScheduler, QueueFullError
+from ratelimit import RateLimiter, create_rate_limit_store
+from workers import create_command_handler, execute_command, send_result, ProcessJobQueue
+from streaming import DiscordStreamWriter
+from pagination import PageSessions
+
+
+class ResultPageView(discord.ui.View):
+    """Previous/next buttons under a paginated result, only its owner can turn pages"""
+    def __init__(self, bot, session):
+        # The timeout restarts on every click, like the session TTL
+        super().__init__(timeout=PAGINATION_CONFIG["session_ttl"])
+        self.bot = bot
+        self.session = session
+        self.message = None
+        self.update_buttons()
+
+    def update_buttons(self):
+        self.previous_page.disabled = self.session.state.page == 0
+        self.next_page.disabled = not self.session.state.has_next
+
+    async def interaction_check(self, interaction):
+        if str(interaction.user.id) != self.session.user_id:
+            await interaction.response.send_message(
+                "Only the user who ran this query can turn its pages.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self.bot.turn_page(interaction, self, -1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        await self.bot.turn_page(interaction, self, 1)
+
+    async def on_timeout(self):
+        self.bot.page_sessions.close(self.session.session_id)
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
 
 class HafSQLBot(discord.Client):
     def __init__(self):
@@ -12,7 +56,15 @@ class HafSQLBot(discord.Client):
         intents.messages = True
         super().__init__(command_prefix='!', intents=intents)
         
-        self.db = Database(DB_CONFIG)
+        # Gateway only mode keeps HafSQL and the LLMs out of the Discord process
+        if WORKER_CONFIG["mode"] == "process":
+            self.job_queue = ProcessJobQueue()
+            self.command_handler = None
+            self.db = None
+        else:
+            self.job_queue = None
+            self.command_handler = create_command_handler()
+            self.db = self.command_handler.db
         
         # Add command aliases
         self.command_aliases = {
@@ -20,8 +72,30 @@ class HafSQLBot(discord.Client):
             'hafsql': ['!hafsql', '!sql', '!query'],
             'tablelist': ['!tablelist', '!tables', '!tl'],
             'tableinfo': ['!tableinfo', '!info', '!ti'],
-            'help': ['!help', '!h', '!?']
+            'help': ['!help', '!h', '!?'],
+            'export': ['!export'],
+            'cache': ['!cache'],
+            'reloadschema': ['!reloadschema', '!reload']
+        }
+
+        # Commands restricted to DISCORD_ADMIN_ID
+        self.admin_commands = {'cache', 'reloadschema'}
+
+        # Scheduler worker pool each command runs on
+        self.command_classes = {
+            'aiquery': 'llm',
+            'help': 'llm',
+            'hafsql': 'db',
+            'export': 'db',
+            'tablelist': 'meta',
+            'tableinfo': 'meta',
+            'cache': 'meta',
+            'reloadschema': 'meta'
         }
+        self.scheduler = CommandScheduler()
+
+        # Commands whose LLM text is streamed into Discord as it is generated
+        self.streaming_commands = {'help', 'hafsql'}
 
         # Create reverse lookup for faster command matching
         self.alias_to_command = {
@@ -29,149 +103,222 @@ class HafSQLBot(discord.Client):
             for alias in aliases
         }
 
-        # Create evaluator LLM
-        self.eval_llm = self._setup_llm(
-            temperature=LLM_CONFIG["eval_temp"], 
-            name="Tables-Evaluator")
-
-        # Create SQL generation LLM
-        self.sql_llm = self._setup_llm(
-            temperature=LLM_CONFIG["query_temp"], 
-            name="SQL-Generator")
-        
-        # Could not make create_sql_prompt work 100%
-        #self.query_evaluator = self.eval_llm
-        # sql_prompt = self._create_sql_prompt()
-        # self.llm_chain = create_sql_query_chain(
-        #     self.sql_llm,
-        #     self.db.db,
-        #     prompt=sql_prompt
-        # )
-        
-        self.command_handler = CommandHandler(self.db, self.sql_llm, self.eval_llm)
-        
         # Add cooldown tracking
         self.COOLDOWN_DURATION = DISCORD_CONFIG["cool_down_duration"]
         self.MAX_DAILY_QUERIES = DISCORD_CONFIG["max_daily_queries"]
 
-        self.cooldowns = defaultdict(lambda: datetime.now() - timedelta(seconds=self.COOLDOWN_DURATION+1))
-        self.daily_queries = defaultdict(int)
-        self.last_reset = datetime.now()
+        self.rate_limiter = RateLimiter(
+            create_rate_limit_store(), self.COOLDOWN_DURATION, self.MAX_DAILY_QUERIES)
+
+        self.metrics_server = metrics.MetricsServer() if METRICS_CONFIG["port"] else None
+
+        # Open paginated results, pages are fetched on the 'db' pool
+        self.page_sessions = PageSessions() if PAGINATION_CONFIG["enabled"] else None
+
+    async def setup_hook(self):
+        self.scheduler.start()
+        if self.metrics_server:
+            await self.metrics_server.start()
+
+        if self.job_queue:
+            self.job_queue.start()
+        else:
+            # Schema may come from the local snapshot, check it against HafSQL
+            # and keep checking for new tables and columns
+            self.db.start_schema_refresh()
+            self.db.start_replica_refresh()
 
     async def on_ready(self):
         print(f'Logged in Discord as {self.user}')
         print(f'Ready!')
 
+    async def close(self):
+        await self.scheduler.stop()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await super().close()
+        self.rate_limiter.close()
+        if self.job_queue:
+            self.job_queue.stop()
+        else:
+            self.db.close()
+        metrics.flush_trace_log()
+
     async def on_message(self, message):
         if message.author.bot:
             return
 
-        # Check and reset daily limits
-        now = datetime.now()
-        if (now - self.last_reset) > timedelta(days=1):
-            self.daily_queries.clear()
-            self.last_reset = now
+        # Process the command, other messages never count against rate limits
+        words = message.content.split()
+        command = words[0].lower() if words else ""
+        if command not in self.alias_to_command:
+            return
 
         # Check rate limits
         user_id = str(message.author.id)
         user_display_name = message.author.display_name
 
         if user_id not in DISCORD_CONFIG["admin_id"]:
-            time_since_last = now - self.cooldowns[user_id]
+            with metrics.span("rate_limit"):
+                limited = await self.rate_limiter.acheck(user_id)
+            if limited:
+                metrics.count("rate_limited", reason=limited[0])
+                reason, wait = limited
+                if reason == "cooldown":
+                    await message.channel.send(
+                        f"Please wait {max(1, round(wait))} "
+                        "seconds before using another command."
+                    )
+                else:
+                    await message.channel.send(
+                        f"You've reached your daily limit of {self.MAX_DAILY_QUERIES} queries. "
+                        f"Please try again in {wait / 3600:.1f} hours."
+                    )
+                return
         
-            if time_since_last.total_seconds() < self.COOLDOWN_DURATION:
+        if (self.alias_to_command[command] in self.admin_commands
+                and user_id not in DISCORD_CONFIG["admin_id"]):
+            await message.channel.send("This command is restricted to bot admins.")
+            return
+
+        # Queue the command, workers run it as soon as a slot for its class is free
+        command_class = self.command_classes[self.alias_to_command[command]]
+        queued_at = time.perf_counter()
+        try:
+            position = self.scheduler.submit(
+                command_class, user_id,
+                lambda: self._run_command(message, command, user_display_name, queued_at),
+                is_admin=user_id in DISCORD_CONFIG["admin_id"])
+        except QueueFullError as e:
+            if e.user_limit:
                 await message.channel.send(
-                    f"Please wait {self.COOLDOWN_DURATION - int(time_since_last.total_seconds())} "
-                    "seconds before using another command."
+                    f"{user_display_name}, you already have {e.queued} requests waiting. "
+                    "Please wait for them to finish."
                 )
-                return
-
-            # Update cooldown only for non-admin users
-            self.cooldowns[user_id] = now
-
-            # Check daily limit
-            if self.daily_queries[user_id] >= self.MAX_DAILY_QUERIES:
+            else:
                 await message.channel.send(
-                    f"You've reached your daily limit of {self.MAX_DAILY_QUERIES} queries. "
-                    "Please try again tomorrow."
+                    f"{user_display_name}, the bot is busy right now ({e.queued} requests waiting). "
+                    "Please try again in a moment."
                 )
-                return
+            metrics.count("queue_full", command_class=command_class)
+            return
 
-        # Update cooldown and query count
-        self.cooldowns[user_id] = now
-        self.daily_queries[user_id] += 1
+        if position:
+            await message.channel.send(f"{user_display_name}, your request is queued at position {position}.")
 
-        # Process the command
-        command = message.content.split()[0].lower()
-        if command not in self.alias_to_command:
+    async def _run_command(self, message, command, user_display_name, queued_at=None):
+        command_name = self.alias_to_command[command]
+        writer = None
+        if STREAM_CONFIG["enabled"] and command_name in self.streaming_commands:
+            writer = DiscordStreamWriter(message.channel)
+        on_token = writer.write if writer is not None else None
+        with metrics.trace(command_name) as trace:
+            if queued_at is not None:
+                metrics.record_span("queue_wait", queued_at, trace.started - queued_at)
+            try:
+                # Show typing indicator while processing
+                async with message.channel.typing():
+                    with metrics.span("command"):
+                        if self.job_queue and command_name in self.admin_commands:
+                            # Every worker has its own caches and schema
+                            result = await self.job_queue.broadcast(
+                                command_name, message.content, command, user_display_name)
+                            if result["trace"] is not None:
+                                trace.merge(result["trace"])
+                        elif self.job_queue:
+                            result = await self.job_queue.submit(
+                                command_name, message.content, command, user_display_name, on_token)
+                            trace.merge(result.pop("trace"))
+                        else:
+                            result = await execute_command(
+                                self.command_handler, command_name, message.content, command, user_display_name, on_token)
+                    with metrics.span("discord_send"):
+                        if writer is not None and writer.messages:
+                            await writer.finish(result["content"])
+                        else:
+                            view = self._page_view(result, str(message.author.id))
+                            sent = await send_result(message.channel, result, view)
+                            if view is not None:
+                                view.message = sent
+
+            except Exception as e:
+                print(f"Error: {str(e)}")
+                trace.status = "error"
+                await message.channel.send(f"An error occurred: {str(e)}")
+
+    def _page_view(self, result, user_id):
+        """Buttons for a result with more pages, None when it has only one"""
+        if self.page_sessions is None or result.get("page") is None or result["file"] is None:
+            return None
+        # Over the per user cap the oldest session closes, its buttons answer "expired"
+        session = self.page_sessions.open(user_id, result["page"])
+        return ResultPageView(self, session)
+
+    async def turn_page(self, interaction, view, step):
+        """Button click: queue the page fetch, the message is edited when it is ready"""
+        session = self.page_sessions.get(view.session.session_id)
+        if session is None:
+            view.stop()
+            await interaction.response.edit_message(view=None)
+            await interaction.followup.send("These results expired, please run the query again.", ephemeral=True)
             return
-        
+
+        await interaction.response.defer()
+        if session.busy:
+            return
+        user_id = str(interaction.user.id)
         try:
-            # Show typing indicator while processing
-            async with message.channel.typing():
-                # if message.content.startswith('!aiquery'):
-                if any(alias == command for alias in self.command_aliases['aiquery']):
-                    query = message.content[len(command):].strip()    # Remove the actual command used from message
-                    response = await self.command_handler.handle_aiquery(query, user_display_name)
-                    await message.channel.send(
-                        content=f"{user_display_name}, here is your query results:", 
-                        file=discord.File(response))
-
-                elif any(alias == command for alias in self.command_aliases['hafsql']):
-                    query = message.content[len(command):].strip()
-                    response = await self.command_handler.handle_hafsql(query, user_display_name)
-                    if (response == "sqlresult.txt"):
-                        await message.channel.send(
-                            content=f"{user_display_name}, here is your query results:", 
-                            file=discord.File(response))
-                    else:
-                        await message.channel.send(response)
+            session.busy = True
+            self.scheduler.submit(
+                'db', user_id,
+                lambda: self._fetch_page(interaction, view, session, step),
+                is_admin=user_id in DISCORD_CONFIG["admin_id"])
+        except QueueFullError:
+            session.busy = False
+            metrics.count("queue_full", command_class="db")
+            await interaction.followup.send("The bot is busy right now, please try again in a moment.", ephemeral=True)
 
-                elif any(alias == command for alias in self.command_aliases['tablelist']):
-                    query = message.content[len(command):].strip()
-                    response = await self.command_handler.handle_tablelist(query, user_display_name)
-                    await message.channel.send(response)
+    async def _fetch_page(self, interaction, view, session, step):
+        state = session.state.turn(step)
+        user_display_name = interaction.user.display_name
+        with metrics.trace("page") as trace:
+            try:
+                with metrics.span("command"):
+                    if self.job_queue:
+                        result = await self.job_queue.submit("page", "", "", user_display_name, page=state)
+                        trace.merge(result.pop("trace"))
+                    else:
+                        result = await execute_command(
+                            self.command_handler, "page", "", "", user_display_name, page=state)
 
-                elif any(alias == command for alias in self.command_aliases['tableinfo']):
-                    response = await self.command_handler.handle_tableinfo(message.content, user_display_name)
-                    await message.channel.send(response)
+                with metrics.span("discord_send"):
+                    if result["file"] is not None:
+                        session.state = result["page"]
+                        view.update_buttons()
+                        await interaction.edit_original_response(
+                            content=result["content"],
+                            attachments=[discord.File(io.BytesIO(result["file"]), filename=result["filename"])],
+                            view=view)
+                        return
 
-                elif any(alias == command for alias in self.command_aliases['help']):
-                    response = await self.command_handler.handle_help(message.content, user_display_name)
-                    await message.channel.send(response)
+                    if result["page"] is not None:
+                        # Past the last row, stay on the page shown
+                        session.state.has_next = False
+                        view.update_buttons()
+                        await interaction.edit_original_response(view=view)
+                    else:
+                        trace.status = "error"
+                    await interaction.followup.send(result["content"], ephemeral=True)
 
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            await message.channel.send(f"An error occurred: {str(e)}")
+            except Exception as e:
+                print(f"Error: {str(e)}")
+                trace.status = "error"
+                await interaction.followup.send(f"An error occurred: {str(e)}", ephemeral=True)
+            finally:
+                session.busy = False
 
     def _setup_llm(self, temperature, name, model=""):
-        if not LLM_CONFIG["groq_api_key"] and not LLM_CONFIG["openai_api_key"]:
-            raise ValueError("No API keys found. At least one of GROQ_API_KEY or OPENAI_API_KEY must be configured")
-
-        # Initialize LLM based on available API key
-        if LLM_CONFIG["groq_api_key"]:
-            from langchain_groq import ChatGroq
-            selected_model = model or LLM_CONFIG["groq_model"]
-            llm = ChatGroq(
-                model=selected_model,
-                temperature=temperature,
-                max_tokens=LLM_CONFIG["max_tokens"],
-                api_key=LLM_CONFIG["groq_api_key"]
-            )
-            print(f"Groq Model: {selected_model} {temperature} for {name}")
-        
-        elif LLM_CONFIG["openai_api_key"]:
-            from langchain_openai import ChatOpenAI
-            selected_model = model or LLM_CONFIG["openai_model"]
-            llm = ChatOpenAI(
-                model=selected_model,
-                temperature=temperature,
-                max_tokens=LLM_CONFIG["max_tokens"],
-                api_key=LLM_CONFIG["openai_api_key"]
-            )
-            print(f"OpenAI Model: {selected_model} {temperature} for {name}")
-        
-        return llm
+        return create_chat_model(temperature, name, model)
 
 
 
@@ -0,0 +1,296 @@
+import time
+import asyncio
+from collections import deque
+from config import LLM_CONFIG, LLM_ROUTER_CONFIG, DEBUG_MODE
+
+
+def configured_providers():
+    """Providers with an API key, in order of preference"""
+    return [
+        provider for provider in ("groq", "openai")
+        if LLM_CONFIG[f"{provider}_api_key"]
+    ]
+
+
+def _create_provider_model(provider, temperature, name, model=""):
+    if provider == "groq":
+        from langchain_groq import ChatGroq
+        selected_model = model or LLM_CONFIG["groq_model"]
+        llm = ChatGroq(
+            model=selected_model,
+            temperature=temperature,
+            max_tokens=LLM_CONFIG["max_tokens"],
+            api_key=LLM_CONFIG["groq_api_key"]
+        )
+        print(f"Groq Model: {selected_model} {temperature} for {name}")
+
+    elif provider == "openai":
+        from langchain_openai import ChatOpenAI
+        selected_model = model or LLM_CONFIG["openai_model"]
+        llm = ChatOpenAI(
+            model=selected_model,
+            temperature=temperature,
+            max_tokens=LLM_CONFIG["max_tokens"],
+            api_key=LLM_CONFIG["openai_api_key"]
+        )
+        print(f"OpenAI Model: {selected_model} {temperature} for {name}")
+
+    return llm
+
+
+def create_chat_model(temperature, name, model=""):
+    """Create chat model for the configured provider, Groq preferred.
+    With several providers configured returns an LLMRouter over all of them"""
+    providers = configured_providers()
+    if not providers:
+        raise ValueError("No API keys found. At least one of GROQ_API_KEY or OPENAI_API_KEY must be configured")
+
+    if len(providers) == 1 or model or not LLM_ROUTER_CONFIG["enabled"]:
+        return _create_provider_model(providers[0], temperature, name, model)
+
+    print(f"LLM router for {name}: {', '.join(providers)}")
+    return LLMRouter([
+        (provider, _create_provider_model(provider, temperature, name))
+        for provider in providers
+    ])
+
+
+class LLMLimiter:
+    """Async LLM calls with a concurrency limit per provider"""
+    def __init__(self, provider_limits=None, default_limit=None):
+        self.provider_limits = provider_limits or {
+            "groq": LLM_CONFIG["groq_max_inflight"],
+            "openai": LLM_CONFIG["openai_max_inflight"]
+        }
+        self.default_limit = default_limit or LLM_CONFIG["max_inflight"]
+        self.semaphores = {}
+
+    def provider_of(self, llm):
+        """Return provider name for a LangChain chat model"""
+        llm_type = getattr(llm, "_llm_type", "") or type(llm).__name__
+        llm_type = llm_type.lower()
+        for provider in self.provider_limits:
+            if provider in llm_type:
+                return provider
+        return llm_type
+
+    def _get_semaphore(self, provider):
+        if provider not in self.semaphores:
+            limit = self.provider_limits.get(provider) or self.default_limit
+            self.semaphores[provider] = asyncio.Semaphore(limit)
+            if (DEBUG_MODE):
+                print(f"LLM limiter: {provider} max {limit} in-flight requests")
+        return self.semaphores[provider]
+
+    async def ainvoke(self, llm, prompt):
+        """Invoke llm without blocking the event loop, waiting for a provider slot"""
+        if isinstance(llm, LLMRouter):
+            # The router takes a slot for each provider it calls
+            return await llm.ainvoke(prompt, self)
+        async with self._get_semaphore(self.provider_of(llm)):
+            return await llm.ainvoke(prompt)
+
+    async def astream(self, llm, prompt):
+        """Stream llm response chunks, holding the provider slot until the stream ends"""
+        if isinstance(llm, LLMRouter):
+            async for chunk in llm.astream(prompt, self):
+                yield chunk
+            return
+        async with self._get_semaphore(self.provider_of(llm)):
+            async for chunk in llm.astream(prompt):
+                yield chunk
+
+
+class ProviderHealth:
+    """Rolling latency and error rate of one provider, with a circuit breaker"""
+    def __init__(self, name, window=None):
+        self.name = name
+        window = window or LLM_ROUTER_CONFIG["window"]
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def latency_percentile(self, percentile):
+        if len(self.latencies) < LLM_ROUTER_CONFIG["min_samples"]:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < LLM_ROUTER_CONFIG["open_seconds"]:
+            return "open"
+        return "half-open"
+
+    def available(self):
+        state = self.state()
+        # Half-open lets a single trial request through
+        return state == "closed" or (state == "half-open" and not self.trial)
+
+    def begin(self):
+        if self.state() == "half-open":
+            self.trial = True
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        if self.opened_at is not None:
+            print(f"LLM router: {self.name} circuit closed")
+        self.opened_at = None
+        self.trial = False
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        tripped = (
+            self.consecutive_failures >= LLM_ROUTER_CONFIG["failure_threshold"]
+            or (len(self.outcomes) >= LLM_ROUTER_CONFIG["min_samples"]
+                and self.error_rate() >= LLM_ROUTER_CONFIG["max_error_rate"])
+        )
+        if self.trial or tripped:
+            if self.opened_at is None or self.trial:
+                print(f"LLM router: {self.name} circuit open for {LLM_ROUTER_CONFIG['open_seconds']}s "
+                      f"({self.consecutive_failures} consecutive failures, error rate {self.error_rate():.0%})")
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+    def stats(self):
+        return {
+            "state": self.state(),
+            "requests": len(self.outcomes),
+            "error_rate": self.error_rate(),
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95)
+        }
+
+
+class LLMRouter:
+    """Chat model over several providers: fails over, hedges slow requests
+    to the next provider and skips providers whose circuit is open"""
+    _llm_type = "router"
+
+    def __init__(self, providers, health=None):
+        """providers is a list of (provider name, chat model), in order of preference"""
+        self.providers = providers
+        self.health = health or {name: ProviderHealth(name) for name, _ in providers}
+
+    @property
+    def model_name(self):
+        return getattr(self._ordered()[0][1], "model_name", None)
+
+    def model_copy(self, update=None, **kwargs):
+        """Same providers with changed settings (e.g. temperature), sharing provider health"""
+        return LLMRouter(
+            [(name, llm.model_copy(update=update, **kwargs)) for name, llm in self.providers],
+            self.health)
+
+    def _ordered(self):
+        """Available providers first, every provider when all circuits are open"""
+        available = [(name, llm) for name, llm in self.providers if self.health[name].available()]
+        return available or list(self.providers)
+
+    def _hedge_delay(self, name):
+        delay = self.health[name].latency_percentile(LLM_ROUTER_CONFIG["hedge_percentile"])
+        if delay is None:
+            delay = LLM_ROUTER_CONFIG["hedge_delay"]
+        return max(delay, LLM_ROUTER_CONFIG["min_hedge_delay"])
+
+    async def _call(self, name, llm, prompt, limiter):
+        health = self.health[name]
+        health.begin()
+        start = time.monotonic()
+        try:
+            if limiter is not None:
+                response = await limiter.ainvoke(llm, prompt)
+            else:
+                response = await llm.ainvoke(prompt)
+        except asyncio.CancelledError:
+            # Losing hedge, says nothing about the provider
+            health.trial = False
+            raise
+        except Exception as e:
+            health.record_failure()
+            print(f"LLM router: {name} failed: {e}")
+            raise
+        health.record_success(time.monotonic() - start)
+        return response
+
+    async def ainvoke(self, prompt, limiter=None):
+        """First successful response wins, a slow provider is hedged after its
+        latency percentile, a failed one is replaced by the next provider"""
+        waiting = list(self._ordered())
+        running = {}
+        last_error = None
+
+        def launch():
+            name, llm = waiting.pop(0)
+            running[asyncio.create_task(self._call(name, llm, prompt, limiter))] = name
+            return name
+
+        try:
+            current = launch()
+            while running:
+                timeout = None
+                if waiting and LLM_ROUTER_CONFIG["hedge"]:
+                    timeout = self._hedge_delay(current)
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if (DEBUG_MODE):
+                        print(f"LLM router: {current} slower than {timeout:.2f}s, hedging")
+                    current = launch()
+                    continue
+
+                for task in done:
+                    running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+
+                if not running and waiting:
+                    current = launch()
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise last_error
+
+    async def astream(self, prompt, limiter=None):
+        """Stream from the first provider that produces output, no hedging"""
+        last_error = None
+        for name, llm in self._ordered():
+            health = self.health[name]
+            health.begin()
+            start = time.monotonic()
+            started = False
+            try:
+                chunks = limiter.astream(llm, prompt) if limiter is not None else llm.astream(prompt)
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+            except asyncio.CancelledError:
+                health.trial = False
+                raise
+            except Exception as e:
+                health.record_failure()
+                print(f"LLM router: {name} stream failed: {e}")
+                if started:
+                    # Part of the answer is already out, can't switch provider
+                    raise
+                last_error = e
+                continue
+            health.record_success(time.monotonic() - start)
+            return
+        raise last_error
+
+    def stats(self):
+        return {name: health.stats() for name, health in self.health.items()}
@@ -0,0 +1,260 @@
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import METRICS_CONFIG, DEBUG_MODE
+
+PREFIX = "hafsql"
+# Seconds, from cache hits up to slow LLM retries
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_current_trace = contextvars.ContextVar("hafsql_trace", default=None)
+
+# Trace log lines are appended here, in order, never on the event loop thread
+_trace_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-log")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        n = 0
+        while n < len(BUCKETS) and value > BUCKETS[n]:
+            n += 1
+        self.counts[n] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Counters and histograms by name and labels, rendered in Prometheus text format"""
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, labels=()):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def render(self):
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {PREFIX}_{name} histogram")
+            for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda h: h[0]):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Trace:
+    """Spans and counters of one bot command, recorded when the command ends"""
+    def __init__(self, command):
+        self.command = command
+        self.status = "ok"
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+
+    def add_span(self, stage, start, duration):
+        self.spans.append((stage, round(start - self.started, 6), round(duration, 6)))
+
+    def add_count(self, name, amount, labels):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def export(self):
+        """Picklable copy, for traces coming back from worker processes"""
+        return {"status": self.status, "spans": self.spans, "counters": list(self.counters.items())}
+
+    def merge(self, exported):
+        """Add spans and counters of a worker process trace"""
+        if exported["status"] != "ok":
+            self.status = exported["status"]
+        offset = time.perf_counter() - self.started
+        for stage, start, duration in exported["spans"]:
+            # Worker clocks differ, place worker spans relative to the end of the command
+            self.spans.append((stage, round(offset - duration, 6), duration))
+        for (name, labels), amount in exported["counters"]:
+            self.add_count(name, amount, labels)
+
+
+class trace:
+    """Context manager tracing one bot command: with metrics.trace("aiquery") as t: ..."""
+    def __init__(self, command, record=True):
+        self.trace = Trace(command)
+        self.record = record
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self.token)
+        if exc_type is not None:
+            self.trace.status = "error"
+        if self.record:
+            _record_trace(self.trace)
+        return False
+
+
+def _record_trace(trace):
+    total = time.perf_counter() - trace.started
+    for stage, _, duration in trace.spans:
+        REGISTRY.observe("stage_seconds", duration, (("stage", stage),))
+    for (name, labels), amount in trace.counters.items():
+        REGISTRY.inc(name, amount, labels)
+    REGISTRY.observe("command_seconds", total, (("command", trace.command), ("status", trace.status)))
+
+    if METRICS_CONFIG["trace_log"]:
+        entry = {
+            "time": time.time(),
+            "command": trace.command,
+            "status": trace.status,
+            "total": round(total, 6),
+            "spans": trace.spans,
+            "counters": {
+                name + _labels(labels): amount for (name, labels), amount in trace.counters.items()
+            }
+        }
+        _trace_writer.submit(_append_trace_log, METRICS_CONFIG["trace_log"], json.dumps(entry) + "\n")
+
+    if (DEBUG_MODE):
+        stages = ", ".join(f"{stage}={duration * 1000:.0f}ms" for stage, _, duration in trace.spans)
+        print(f"Trace {trace.command} {trace.status} {total * 1000:.0f}ms: {stages}")
+
+
+def _append_trace_log(path, line):
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Could not write trace log {path}: {e}")
+
+
+def flush_trace_log():
+    """Wait until every recorded trace is written to the trace log"""
+    _trace_writer.submit(lambda: None).result()
+
+
+class span:
+    """Time a stage of the current command: with metrics.span("db_query"): ..."""
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_span(self.stage, self.start, time.perf_counter() - self.start)
+        return False
+
+
+def record_span(stage, start, duration):
+    """Add a span measured elsewhere (start from time.perf_counter)"""
+    current = _current_trace.get()
+    if current is not None:
+        current.add_span(stage, start, duration)
+    else:
+        REGISTRY.observe("stage_seconds", duration, (("stage", stage),))
+
+
+def count(name, amount=1, **labels):
+    """Increment a counter, part of the current command trace when there is one"""
+    labels = tuple(sorted(labels.items()))
+    current = _current_trace.get()
+    if current is not None:
+        current.add_count(name, amount, labels)
+    else:
+        REGISTRY.inc(name, amount, labels)
+
+
+def set_status(status):
+    current = _current_trace.get()
+    if current is not None:
+        current.status = status
+
+
+def count_llm_tokens(response):
+    """Count tokens from a LangChain message usage_metadata, when the provider sends it"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        count("llm_tokens", usage.get("input_tokens", 0), kind="input")
+        count("llm_tokens", usage.get("output_tokens", 0), kind="output")
+
+
+class MetricsServer:
+    """Minimal HTTP server for Prometheus scrapes of GET /metrics"""
+    def __init__(self, host=None, port=None, registry=REGISTRY):
+        self.host = host or METRICS_CONFIG["host"]
+        self.port = port if port is not None else METRICS_CONFIG["port"]
+        self.registry = registry
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"Metrics on http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Skip headers
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.registry.render()
+            else:
+                status, body = "404 Not Found", "Not found\n"
+            body = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
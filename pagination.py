@@ -0,0 +1,283 @@
+import copy
+import time
+import uuid
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from collections import OrderedDict
+from config import PAGINATION_CONFIG, DEBUG_MODE
+
+
+def _output_name(identifier):
+    """Column name as Postgres reports it, unquoted identifiers fold to lowercase"""
+    return identifier.this if identifier.quoted else identifier.this.lower()
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def keyset_plan(sql_query):
+    """Return (inner_sql, keys) to page sql_query by its ORDER BY, keys are
+    [(output column, desc, nulls_first)]; keys is None when the ORDER BY is not
+    made of output columns and pages need OFFSET"""
+    sql_query = sql_query.strip().rstrip(";")
+    try:
+        statement = sqlglot.parse_one(sql_query, read="postgres")
+    except SqlglotError:
+        return sql_query, None
+    order = statement.args.get("order") if isinstance(statement, exp.Select) else None
+    if order is None:
+        return sql_query, None
+
+    outputs = []
+    star = False
+    for projection in statement.expressions:
+        if isinstance(projection, exp.Star) or (isinstance(projection, exp.Column) and projection.is_star):
+            star = True
+        elif isinstance(projection, exp.Alias):
+            outputs.append(_output_name(projection.args["alias"]))
+        elif isinstance(projection, exp.Column):
+            outputs.append(_output_name(projection.this))
+        else:
+            outputs.append(None)
+
+    keys = []
+    for ordered in order.expressions:
+        key = ordered.this
+        if isinstance(key, exp.Literal) and key.is_int and not star and 0 < int(key.this) <= len(outputs):
+            name = outputs[int(key.this) - 1]
+        elif isinstance(key, exp.Column) and isinstance(key.this, exp.Identifier):
+            name = _output_name(key.this)
+            if name not in outputs and not star:
+                name = None
+        else:
+            name = None
+        # Keys must be unique output columns, the outer query refers to them by name
+        if name is None or outputs.count(name) > 1:
+            return sql_query, None
+        keys.append((name, bool(ordered.args.get("desc")), bool(ordered.args.get("nulls_first"))))
+
+    distinct = statement.args.get("distinct")
+    if statement.args.get("limit") is not None or statement.args.get("offset") is not None \
+            or (distinct is not None and distinct.args.get("on") is not None):
+        # LIMIT caps the whole result and DISTINCT ON keeps the first row by the
+        # ORDER BY, both stay in the inner query with their ORDER BY
+        return sql_query, keys
+    # Without ORDER BY the inner query can be merged into the outer one,
+    # the keyset condition then reaches the index the ORDER BY uses
+    inner = statement.copy()
+    inner.set("order", None)
+    return inner.sql(dialect="postgres"), keys
+
+
+def row_limit(sql_query):
+    """Integer LIMIT of the outer query, None when it has none"""
+    try:
+        statement = sqlglot.parse_one(sql_query.strip().rstrip(";"), read="postgres")
+    except SqlglotError:
+        return None
+    limit = statement.args.get("limit") if isinstance(statement, exp.Query) else None
+    expression = limit.expression if limit is not None else None
+    if isinstance(expression, exp.Literal) and expression.is_int:
+        return int(expression.this)
+    return None
+
+
+class PageState:
+    """Where a paginated result is: picklable, the gateway keeps it between button clicks
+    and whichever worker fetches the next page gets a copy"""
+    def __init__(self, sql_query, page_size=None):
+        self.sql_query = sql_query.strip().rstrip(";")
+        self.page_size = page_size or PAGINATION_CONFIG["page_size"]
+        self.inner, self.keys = keyset_plan(sql_query)
+        self.page = 0
+        # Start of each visited page: (key values, rows to skip) or a row offset
+        self.starts = [None]
+        self.has_next = False
+
+    @property
+    def keyset(self):
+        return self.keys is not None
+
+    def turn(self, step):
+        """Copy of this state positioned step pages further"""
+        state = copy.copy(self)
+        state.starts = list(self.starts)
+        state.page = self.page + step
+        return state
+
+    def query(self):
+        """Return (sql, params) fetching the current page plus one row to see if more follow"""
+        start = self.starts[self.page]
+        limit = self.page_size + 1
+        if not self.keyset:
+            return (f"SELECT * FROM (\n{self.inner}\n) AS page_query\n"
+                    f"LIMIT {limit} OFFSET {start or 0}"), {}
+
+        order = ", ".join(
+            f"page_query.{_quote(name)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nulls_first else 'LAST'}"
+            for name, desc, nulls_first in self.keys)
+        if start is None:
+            return f"SELECT * FROM (\n{self.inner}\n) AS page_query\nORDER BY {order}\nLIMIT {limit}", {}
+
+        where, params = self._after(*start)
+        sql_query = (f"SELECT * FROM (\n{self.inner}\n) AS page_query\nWHERE {where}\n"
+                     f"ORDER BY {order}\nLIMIT {limit}")
+        if start[1]:
+            sql_query += f" OFFSET {start[1]}"
+        return sql_query, params
+
+    def _after(self, values, ties):
+        """WHERE for rows from values on in ORDER BY order, the rows with exactly these
+        values already shown are skipped by OFFSET (they come in the same order as
+        long as the plan does not change)"""
+        params = {}
+        greater, equal, from_value = [], [], []
+        for n, ((name, desc, nulls_first), value) in enumerate(zip(self.keys, values)):
+            column = f"page_query.{_quote(name)}"
+            if value is None:
+                # NULL sorts as the largest value (NULLS LAST) or smallest (NULLS FIRST),
+                # None: no row is greater / every row qualifies
+                greater.append(f"{column} IS NOT NULL" if nulls_first else None)
+                from_value.append(None if nulls_first else f"{column} IS NULL")
+                equal.append(f"{column} IS NULL")
+                continue
+            params[f"k{n}"] = value
+            op = "<" if desc else ">"
+            nulls = "" if nulls_first else f" OR {column} IS NULL"
+            greater.append(f"({column} {op} :k{n}{nulls})")
+            from_value.append(f"({column} {op}= :k{n}{nulls})")
+            equal.append(f"{column} = :k{n}")
+
+        last = len(self.keys) - 1
+        terms = [
+            " AND ".join(equal[:n] + [greater[n]]) for n in range(last) if greater[n] is not None
+        ]
+        terms.append(" AND ".join(equal[:last] + [c for c in from_value[last:] if c is not None]) or "TRUE")
+        where = "\n   OR ".join(f"({term})" for term in terms)
+        if last and from_value[0] is not None:
+            # Range on the first key alone, lets its index skip the pages before
+            where = f"{from_value[0]}\n  AND ({where})"
+        return where, params
+
+    def advance(self, rows, header):
+        """Record the fetched page, returns its rows without the look-ahead row"""
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.starts = self.starts[:self.page + 1]
+        if not self.has_next:
+            return rows
+
+        if self.keyset:
+            indexes = [header.index(name) if list(header).count(name) == 1 else None for name, _, _ in self.keys]
+            if None in indexes:
+                # Result columns are not what the ORDER BY said, page on with OFFSET
+                if (DEBUG_MODE):
+                    print(f"Pagination: keys {self.keys} not in result columns, using OFFSET")
+                self.keys = None
+                self.inner = self.sql_query
+                self.starts = [n * self.page_size for n in range(self.page + 1)]
+            else:
+                values = tuple(rows[-1][index] for index in indexes)
+                ties = 0
+                for row in reversed(rows):
+                    if tuple(row[index] for index in indexes) != values:
+                        break
+                    ties += 1
+                start = self.starts[self.page]
+                if ties == len(rows) and isinstance(start, tuple) and start[0] == values:
+                    # The whole page has the same keys as the rows skipped before it
+                    ties += start[1]
+                self.starts.append((values, ties))
+                return rows
+
+        offset = (self.page + 1) * self.page_size
+        if offset >= PAGINATION_CONFIG["max_offset"]:
+            # Every OFFSET page reads all rows before it
+            self.has_next = False
+        self.starts.append(offset)
+        return rows
+
+
+def first_page(sql_query, rows, header, page_size=None):
+    """PageState for a result whose first page is rows, None when everything fit on it"""
+    if not PAGINATION_CONFIG["enabled"]:
+        return None
+    state = PageState(sql_query, page_size)
+    if len(rows) < state.page_size:
+        return None
+    limit = row_limit(sql_query)
+    if limit is not None and limit <= len(rows):
+        # The query's own LIMIT, all it returns is already shown
+        return None
+    # One row more was never fetched, a full first page may be all there is
+    state.advance(list(rows) + [None], header)
+    return state
+
+
+class PageSession:
+    def __init__(self, session_id, user_id, state):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.state = state
+        self.last_used = time.monotonic()
+        self.busy = False
+
+
+class PageSessions:
+    """Open paginated results: TTL since last use, LRU eviction, a cap per user"""
+    def __init__(self, ttl=None, max_sessions=None, max_per_user=None):
+        self.ttl = ttl or PAGINATION_CONFIG["session_ttl"]
+        self.max_sessions = max_sessions or PAGINATION_CONFIG["max_sessions"]
+        self.max_per_user = max_per_user or PAGINATION_CONFIG["max_sessions_per_user"]
+        self.sessions = OrderedDict()  # session_id -> PageSession
+        self.opened = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def open(self, user_id, state):
+        """Start a session, closing the user's oldest one over the per user cap"""
+        self.expire()
+        user_sessions = [s for s in self.sessions.values() if s.user_id == user_id]
+        for session in user_sessions[:max(0, len(user_sessions) - self.max_per_user + 1)]:
+            del self.sessions[session.session_id]
+            self.evicted += 1
+
+        session = PageSession(uuid.uuid4().hex, user_id, state)
+        self.sessions[session.session_id] = session
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+        self.opened += 1
+        return session
+
+    def get(self, session_id):
+        """Return a live session, None when it expired or was evicted"""
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if session.last_used + self.ttl < time.monotonic():
+            del self.sessions[session_id]
+            self.expired += 1
+            return None
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return session
+
+    def close(self, session_id):
+        self.sessions.pop(session_id, None)
+
+    def expire(self):
+        cutoff = time.monotonic() - self.ttl
+        for session_id in [s.session_id for s in self.sessions.values() if s.last_used < cutoff]:
+            del self.sessions[session_id]
+            self.expired += 1
+
+    def stats(self):
+        return {
+            "open": len(self.sessions),
+            "opened": self.opened,
+            "evicted": self.evicted,
+            "expired": self.expired
+        }
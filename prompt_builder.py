@@ -0,0 +1,129 @@
+import re
+from config import PROMPT_CONFIG, DEBUG_MODE
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Always kept: columns that identify rows or join tables, and time columns.
+# Not "id", the SQL prompt tells the model to ignore it
+KEY_COLUMNS = {
+    "name", "author", "permlink", "account", "account_name", "from", "to",
+    "follower", "following", "delegator", "delegatee", "parent_author", "parent_permlink"
+}
+TIME_COLUMNS = {"created", "timestamp", "block_num", "updated", "last_update", "time"}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _terms(text):
+    terms = set()
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        terms.add(token)
+        if len(token) > 3 and token.endswith("s"):
+            terms.add(token[:-1])
+    return terms
+
+
+class SchemaPromptBuilder:
+    """Build the {table_info} prompt section within a per-model token budget"""
+    def __init__(self, db):
+        self.db = db
+        self.encodings = {}
+        self.prompts = 0
+        self.full_tokens = 0
+        self.prompt_tokens = 0
+
+    def count_tokens(self, text, model=None):
+        encoding = self._encoding(model)
+        if encoding is None:
+            return -(-len(text) // 4)
+        return len(encoding.encode(text))
+
+    def _encoding(self, model):
+        if tiktoken is None:
+            return None
+        if model not in self.encodings:
+            try:
+                try:
+                    self.encodings[model] = tiktoken.encoding_for_model(model or "")
+                except (KeyError, ValueError):
+                    # Groq and other non OpenAI models: close enough for budgeting
+                    self.encodings[model] = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # Encoding files are downloaded on first use
+                print(f"tiktoken unavailable, estimating tokens from length: {e}")
+                self.encodings[model] = None
+        return self.encodings[model]
+
+    def budget_for(self, model):
+        return PROMPT_CONFIG["model_budgets"].get(model, PROMPT_CONFIG["schema_token_budget"])
+
+    def _is_required(self, column_name, column_type):
+        column_type = column_type.lower()
+        return (column_name in KEY_COLUMNS or column_name.endswith("_id")
+                or column_name in TIME_COLUMNS or "timestamp" in column_type or column_type == "date")
+
+    def build(self, question, relevant_schemas, model=None):
+        """Return table_info for relevant tables, pruning least relevant columns over budget"""
+        full_info = "\n".join(relevant_schemas.values())
+        full_tokens = self.count_tokens(full_info, model)
+        budget = self.budget_for(model)
+
+        table_info = full_info
+        if full_tokens > budget:
+            table_info = self._prune(question, relevant_schemas, model, budget)
+
+        tokens = self.count_tokens(table_info, model) if table_info is not full_info else full_tokens
+        self.prompts += 1
+        self.full_tokens += full_tokens
+        self.prompt_tokens += tokens
+        if (DEBUG_MODE) or tokens < full_tokens:
+            print(f"Schema prompt: {tokens} tokens (full schema {full_tokens}, budget {budget})")
+        return table_info
+
+    def _prune(self, question, relevant_schemas, model, budget):
+        question_terms = _terms(question)
+        kept = {}
+        candidates = []
+
+        for table_name in relevant_schemas:
+            entry = self.db.catalog.get(table_name)
+            if entry is None:
+                continue
+            kept[table_name] = set()
+            for position, (column_name, column_type) in enumerate(entry["columns"]):
+                if self._is_required(column_name, column_type):
+                    kept[table_name].add(position)
+                    continue
+                overlap = len(_terms(column_name) & question_terms)
+                candidates.append((-overlap, column_name == "id", position, table_name, column_name, column_type))
+
+        # Most question overlap first, then schema order, internal ids last
+        candidates.sort()
+        used = sum(
+            self.count_tokens(self._ddl(table_name, positions), model)
+            for table_name, positions in kept.items()
+        )
+        for _, _, position, table_name, column_name, column_type in candidates:
+            cost = self.count_tokens(f", {column_name} {column_type}", model)
+            if used + cost > budget:
+                continue
+            kept[table_name].add(position)
+            used += cost
+
+        return "\n".join(self._ddl(table_name, positions) for table_name, positions in kept.items())
+
+    def _ddl(self, table_name, positions):
+        entry = self.db.catalog[table_name]
+        columns = [column for position, column in enumerate(entry["columns"]) if position in positions]
+        return self.db._create_ddl(table_name, {"type": entry["type"], "columns": columns})
+
+    def stats(self):
+        return {
+            "prompts": self.prompts,
+            "full_tokens": self.full_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "tokens_saved": self.full_tokens - self.prompt_tokens
+        }
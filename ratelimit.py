@@ -0,0 +1,147 @@
+import abc
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from config import RATE_LIMIT_CONFIG
+
+
+def refill(tokens, updated, now, capacity, refill_rate):
+    """Token bucket state after refilling from updated to now"""
+    return min(capacity, tokens + (now - updated) * refill_rate)
+
+
+class RateLimitStore(abc.ABC):
+    """Token bucket store interface, take() must be atomic per key"""
+    # True when take() waits on I/O or on other processes, RateLimiter then calls it in a thread
+    blocking = False
+
+    @abc.abstractmethod
+    def take(self, key, capacity, refill_rate, now=None):
+        """Take one token, returns (allowed, seconds until a token is available)"""
+
+    def close(self):
+        pass
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Buckets in process memory, least recently used first so idle users are evicted in O(1)"""
+    def __init__(self, idle_ttl=None, max_entries=None):
+        self.idle_ttl = idle_ttl or RATE_LIMIT_CONFIG["idle_ttl"]
+        self.max_entries = max_entries or RATE_LIMIT_CONFIG["max_entries"]
+        self.buckets = OrderedDict()    # key -> (tokens, updated)
+
+    def take(self, key, capacity, refill_rate, now=None):
+        now = now or time.time()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = refill(tokens, updated, now, capacity, refill_rate)
+
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (tokens, now)
+        self._evict(now)
+
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+    def _evict(self, now):
+        # Oldest first: stop at the first bucket still in use
+        while self.buckets:
+            key, (_, updated) = next(iter(self.buckets.items()))
+            if now - updated < self.idle_ttl and len(self.buckets) <= self.max_entries:
+                break
+            del self.buckets[key]
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """Buckets in a local SQLite file, shared by every bot process using the same path"""
+    blocking = True
+
+    def __init__(self, path=None, idle_ttl=None):
+        self.path = path or RATE_LIMIT_CONFIG["sqlite_path"]
+        self.idle_ttl = idle_ttl or RATE_LIMIT_CONFIG["idle_ttl"]
+        self.lock = threading.Lock()
+        self.calls = 0
+
+        self.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def take(self, key, capacity, refill_rate, now=None):
+        now = now or time.time()
+        with self.lock:
+            cursor = self.connection.cursor()
+            # IMMEDIATE takes the write lock up front, other processes wait for it
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = refill(tokens, updated, now, capacity, refill_rate)
+
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                cursor.execute(
+                    "INSERT INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now))
+
+                self.calls += 1
+                if self.calls % RATE_LIMIT_CONFIG["evict_every"] == 0:
+                    cursor.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - self.idle_ttl,))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+        return allowed, 0 if allowed else (1 - tokens) / refill_rate
+
+    def close(self):
+        self.connection.close()
+
+
+def create_rate_limit_store(backend=None):
+    backend = backend or RATE_LIMIT_CONFIG["backend"]
+    if backend == "sqlite":
+        return SQLiteRateLimitStore()
+    if backend == "memory":
+        return MemoryRateLimitStore()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND '{backend}', use 'memory' or 'sqlite'")
+
+
+class RateLimiter:
+    """Per user command cooldown and rolling daily quota on top of a token bucket store"""
+    def __init__(self, store, cooldown, max_daily):
+        self.store = store
+        self.cooldown = cooldown
+        self.max_daily = max_daily
+
+    def check(self, user_id):
+        """Consume one command for user_id.
+        Returns None when allowed, else ("cooldown" | "daily", seconds to wait)"""
+        # Cooldown: one token, refilled after cooldown seconds
+        allowed, wait = self.store.take(f"cooldown:{user_id}", 1, 1 / self.cooldown)
+        if not allowed:
+            return "cooldown", wait
+
+        # Daily quota: refills continuously over 24h instead of a global reset
+        allowed, wait = self.store.take(f"daily:{user_id}", self.max_daily, self.max_daily / 86400)
+        if not allowed:
+            return "daily", wait
+
+        return None
+
+    async def acheck(self, user_id):
+        """check() for the event loop, blocking stores run it in a thread"""
+        if not self.store.blocking:
+            return self.check(user_id)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.check, user_id)
+
+    def close(self):
+        self.store.close()
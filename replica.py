@@ -0,0 +1,223 @@
+import re
+import json
+import time
+import sqlite3
+import datetime
+import threading
+from decimal import Decimal
+from collections import deque
+from config import REPLICA_CONFIG, DEBUG_MODE
+from cache import normalize_sql, strip_literals, is_read_only
+
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?\b")
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+
+
+class ReplicaRows(list):
+    """Rows answered by the local replica, as_of is when HafSQL produced them"""
+    def __init__(self, rows, as_of):
+        super().__init__(rows)
+        self.as_of = as_of
+
+
+def query_shape(normalized_sql):
+    """Query with string and number literals replaced by ?, e.g. recent posts of any author"""
+    shape = STRING_LITERAL_PATTERN.sub("?", strip_literals(normalized_sql))
+    return NUMBER_PATTERN.sub("?", shape)
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    return str(value)
+
+
+def _decode(value):
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, text), = value.items()
+        if tag == "$datetime":
+            return datetime.datetime.fromisoformat(text)
+        if tag == "$date":
+            return datetime.date.fromisoformat(text)
+        if tag == "$decimal":
+            return Decimal(text)
+    return value
+
+
+class HotQueryReplica:
+    """Results of hot read-only queries in a local SQLite file, refreshed from HafSQL
+    in the background and served while younger than the staleness bound"""
+    def __init__(self, path=None):
+        self.path = path or REPLICA_CONFIG["path"]
+        self.lock = threading.Lock()
+        self.history = {}   # key or shape -> deque of execution times
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.refreshes = 0
+
+        self.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hot_queries ("
+            "key TEXT PRIMARY KEY, query TEXT NOT NULL, fetch_size INTEGER NOT NULL, shape TEXT NOT NULL, "
+            "header TEXT NOT NULL, rows TEXT NOT NULL, as_of REAL NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0, last_hit REAL NOT NULL, refreshing_until REAL NOT NULL DEFAULT 0)"
+        )
+
+    def _key(self, query, fetch_size):
+        normalized = normalize_sql(query)
+        if not is_read_only(normalized):
+            return None, None
+        return f"{fetch_size}:{normalized}", normalized
+
+    def lookup(self, query, fetch_size=100, now=None):
+        """Return (rows, header) from the replica, None when absent or too stale"""
+        key, _ = self._key(query, fetch_size)
+        if key is None:
+            return None
+        now = now or time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT header, rows, as_of FROM hot_queries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            header, rows, as_of = row
+            if now - as_of > REPLICA_CONFIG["max_staleness"]:
+                self.stale += 1
+                return None
+            self.connection.execute(
+                "UPDATE hot_queries SET hits = hits + 1, last_hit = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        rows = [tuple(_decode(value) for value in row) for row in json.loads(rows)]
+        return ReplicaRows(rows, as_of), json.loads(header)
+
+    def contains(self, query, fetch_size=100, now=None):
+        key, _ = self._key(query, fetch_size)
+        if key is None:
+            return False
+        now = now or time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT as_of FROM hot_queries WHERE key = ?", (key,)).fetchone()
+        return row is not None and now - row[0] <= REPLICA_CONFIG["max_staleness"]
+
+    def _count(self, name, now):
+        executions = self.history.get(name)
+        if executions is None:
+            executions = self.history[name] = deque()
+        executions.append(now)
+        while executions and executions[0] < now - REPLICA_CONFIG["window"]:
+            executions.popleft()
+        return len(executions)
+
+    def observe(self, query, fetch_size, rows, header, now=None):
+        """Record a HafSQL execution, keep its result when the query or its shape is hot"""
+        key, normalized = self._key(query, fetch_size)
+        if key is None:
+            return False
+        now = now or time.time()
+        shape = query_shape(normalized)
+        with self.lock:
+            query_count = self._count(key, now)
+            shape_count = self._count(shape, now)
+            if len(self.history) > REPLICA_CONFIG["max_history"]:
+                self._prune_history(now)
+        hot = (query_count >= REPLICA_CONFIG["hot_query_count"]
+               or shape_count >= REPLICA_CONFIG["hot_shape_count"])
+        if hot:
+            self.store(query, fetch_size, rows, header, now)
+        return hot
+
+    def _prune_history(self, now):
+        cutoff = now - REPLICA_CONFIG["window"]
+        for name in [name for name, executions in self.history.items() if not executions or executions[-1] < cutoff]:
+            del self.history[name]
+
+    def store(self, query, fetch_size, rows, header, now=None):
+        key, normalized = self._key(query, fetch_size)
+        if key is None:
+            return False
+        now = now or time.time()
+        encoded_rows = json.dumps([list(row) for row in rows], default=_encode)
+        if len(encoded_rows) > REPLICA_CONFIG["max_result_bytes"]:
+            return False
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO hot_queries (key, query, fetch_size, shape, header, rows, as_of, last_hit) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET header = excluded.header, rows = excluded.rows, "
+                "as_of = excluded.as_of, refreshing_until = 0",
+                (key, query, fetch_size, query_shape(normalized), json.dumps(list(header)), encoded_rows, now, now))
+        if (DEBUG_MODE):
+            print(f"Replica stored: {normalized[:120]}")
+        return True
+
+    def claim_refresh(self, limit=None, now=None):
+        """Entries older than refresh_interval that no other process is refreshing,
+        returns [(query, fetch_size)]"""
+        limit = limit or REPLICA_CONFIG["refresh_batch"]
+        now = now or time.time()
+        claimed = []
+        with self.lock:
+            cursor = self.connection.cursor()
+            # IMMEDIATE takes the write lock up front, other bot processes skip claimed rows
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                rows = cursor.execute(
+                    "SELECT key, query, fetch_size FROM hot_queries "
+                    "WHERE as_of < ? AND refreshing_until < ? ORDER BY hits DESC LIMIT ?",
+                    (now - REPLICA_CONFIG["refresh_interval"], now, limit)).fetchall()
+                for key, query, fetch_size in rows:
+                    cursor.execute(
+                        "UPDATE hot_queries SET refreshing_until = ? WHERE key = ?",
+                        (now + REPLICA_CONFIG["refresh_interval"], key))
+                    claimed.append((query, fetch_size))
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        self.refreshes += len(claimed)
+        return claimed
+
+    def evict(self, now=None):
+        """Drop entries nobody asked for within idle_ttl, then the least used over max_entries"""
+        now = now or time.time()
+        with self.lock:
+            removed = self.connection.execute(
+                "DELETE FROM hot_queries WHERE last_hit < ?", (now - REPLICA_CONFIG["idle_ttl"],)).rowcount
+            removed += self.connection.execute(
+                "DELETE FROM hot_queries WHERE key NOT IN ("
+                "SELECT key FROM hot_queries ORDER BY hits DESC, last_hit DESC LIMIT ?)",
+                (REPLICA_CONFIG["max_entries"],)).rowcount
+        return removed
+
+    def flush(self):
+        with self.lock:
+            return self.connection.execute("DELETE FROM hot_queries").rowcount
+
+    def stats(self):
+        with self.lock:
+            entries, oldest = self.connection.execute(
+                "SELECT COUNT(*), MIN(as_of) FROM hot_queries").fetchone()
+            shapes = self.connection.execute(
+                "SELECT shape, COUNT(*), SUM(hits) FROM hot_queries GROUP BY shape "
+                "ORDER BY SUM(hits) DESC LIMIT 5").fetchall()
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "entries": entries,
+            "oldest_as_of": oldest,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "refreshes": self.refreshes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "top_shapes": shapes
+        }
+
+    def close(self):
+        self.connection.close()
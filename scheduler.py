@@ -0,0 +1,111 @@
+import asyncio
+from collections import deque, OrderedDict
+from config import SCHEDULER_CONFIG
+
+
+class QueueFullError(Exception):
+    """Scheduler queue, or the user's share of it, is at capacity"""
+    def __init__(self, queued, user_limit=False):
+        self.queued = queued
+        self.user_limit = user_limit
+        super().__init__(f"Queue is full ({queued} requests waiting)")
+
+
+class CommandLane:
+    """Waiting jobs of one command class: admin lane first, then round robin across users"""
+    def __init__(self):
+        self.admin_jobs = deque()
+        self.user_jobs = OrderedDict()    # user_id -> deque of jobs, in serving order
+        self.ready = asyncio.Semaphore(0)
+
+    def __len__(self):
+        return len(self.admin_jobs) + sum(len(jobs) for jobs in self.user_jobs.values())
+
+    def push(self, user_id, job, is_admin):
+        """Add job, returns how many queued jobs are served before it"""
+        if is_admin:
+            self.admin_jobs.append(job)
+            position = len(self.admin_jobs)
+        else:
+            jobs = self.user_jobs.setdefault(user_id, deque())
+            jobs.append(job)
+            # Round robin: every other user gets at most as many turns as this user waits
+            position = len(self.admin_jobs) + sum(
+                min(len(other_jobs), len(jobs)) for other_jobs in self.user_jobs.values())
+        self.ready.release()
+        return position
+
+    def queued_for(self, user_id):
+        return len(self.user_jobs.get(user_id, ()))
+
+    def pop(self):
+        if self.admin_jobs:
+            return self.admin_jobs.popleft()
+        user_id, jobs = self.user_jobs.popitem(last=False)
+        job = jobs.popleft()
+        if jobs:
+            # Back of the line until every other waiting user had a turn
+            self.user_jobs[user_id] = jobs
+        return job
+
+
+class CommandScheduler:
+    """Bounded queues with a worker pool per command class (llm, db, meta)"""
+    def __init__(self, max_queued=None, max_queued_per_user=None, workers=None):
+        self.max_queued = max_queued or SCHEDULER_CONFIG["max_queued"]
+        self.max_queued_per_user = max_queued_per_user or SCHEDULER_CONFIG["max_queued_per_user"]
+        self.workers = workers or {
+            "llm": SCHEDULER_CONFIG["llm_workers"],
+            "db": SCHEDULER_CONFIG["db_workers"],
+            "meta": SCHEDULER_CONFIG["meta_workers"]
+        }
+        self.lanes = {command_class: CommandLane() for command_class in self.workers}
+        self.busy = {command_class: 0 for command_class in self.workers}
+        self.tasks = []
+
+    def start(self):
+        for command_class, count in self.workers.items():
+            for n in range(count):
+                self.tasks.append(asyncio.create_task(
+                    self._worker(command_class), name=f"{command_class}-worker-{n}"))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def queued(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def submit(self, command_class, user_id, job, is_admin=False):
+        """Queue job (a coroutine function), returns its position, 0 when it starts right away.
+        Admin jobs are never rejected"""
+        lane = self.lanes[command_class]
+        if not is_admin:
+            # A full LLM lane never blocks quick SQL or metadata commands
+            if len(lane) >= self.max_queued:
+                raise QueueFullError(len(lane))
+            # Nor can a few users flooding the bot take every slot
+            if lane.queued_for(user_id) >= self.max_queued_per_user:
+                raise QueueFullError(lane.queued_for(user_id), user_limit=True)
+
+        position = lane.push(user_id, job, is_admin)
+        # Idle workers pick it up immediately
+        idle = self.workers[command_class] - self.busy[command_class]
+        return max(0, position - idle)
+
+    async def _worker(self, command_class):
+        lane = self.lanes[command_class]
+        while True:
+            await lane.ready.acquire()
+            job = lane.pop()
+            self.busy[command_class] += 1
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in {command_class} job: {str(e)}")
+            finally:
+                self.busy[command_class] -= 1
@@ -0,0 +1,212 @@
+import re
+import time
+from collections import OrderedDict
+from config import TEMPLATE_CONFIG, DEBUG_MODE
+from cache import SQL_TOKEN_PATTERN, SQL_NUMBER_PATTERN, QUESTION_STOPWORDS, FIRST_PERSON_WORDS, tokenize_question
+
+# Question token patterns per slot type. Names are Hive account names written as
+# @name, or with a digit, dot or dash no English word has ("everyone" is no slot)
+SLOT_PATTERNS = {
+    "number": r"\d+",
+    "date": r"\d{4}-\d{2}-\d{2}",
+    "name": r"@[a-z][a-z0-9.-]{2,15}|(?=[a-z.-]*[0-9.-])[a-z][a-z0-9.-]{2,15}",
+}
+
+NOT_NAMES = QUESTION_STOPWORDS | FIRST_PERSON_WORDS
+
+
+def _slot_type(token):
+    if re.fullmatch(SLOT_PATTERNS["number"], token):
+        return "number"
+    if re.fullmatch(SLOT_PATTERNS["date"], token):
+        return "date"
+    if re.fullmatch(SLOT_PATTERNS["name"], token) and token.lstrip("@") not in NOT_NAMES:
+        return "name"
+    return None
+
+
+def _sql_literals(sql_query):
+    """Yield (start, end, value, quoted) for string and integer literals of sql_query"""
+    for match in SQL_TOKEN_PATTERN.finditer(sql_query):
+        kind = match.lastgroup
+        if kind == "literal" and match.group().startswith("'"):
+            yield match.start(), match.end(), match.group()[1:-1].replace("''", "'"), True
+        elif kind == "other":
+            for number in SQL_NUMBER_PATTERN.finditer(match.group()):
+                yield match.start() + number.start(), match.start() + number.end(), number.group(), False
+
+
+class SQLTemplate:
+    """SQL of an answered question with the literals taken from the question as bind parameters"""
+    def __init__(self, shape, pattern, slots, sql_query, generation_seconds, expires_at):
+        self.shape = shape
+        self.pattern = pattern
+        self.slots = slots              # [(param name, slot type, quoted)] in question order
+        self.sql_query = sql_query
+        self.generation_seconds = generation_seconds
+        self.expires_at = expires_at
+        self.hits = 0
+
+    def fill(self, question, username):
+        """Return bind parameters for question, None when it does not have this shape"""
+        match = self.pattern.fullmatch(" ".join(tokenize_question(question)))
+        if match is None:
+            return None
+        params = {}
+        values = iter(match.groups())
+        for name, slot_type, quoted in self.slots:
+            if slot_type == "user":
+                value = username.lower()
+            else:
+                value = next(values).lstrip("@")
+                if slot_type == "name" and value in NOT_NAMES:
+                    return None
+            params[name] = value if quoted else int(value)
+        return params
+
+
+class TemplateCache:
+    """Question shapes -> parameterized SQL, answers new questions of a known shape
+    (other accounts, counts or dates) without the LLM"""
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl or TEMPLATE_CONFIG["ttl"]
+        self.max_entries = max_entries or TEMPLATE_CONFIG["max_entries"]
+
+        self.templates = OrderedDict()  # shape -> SQLTemplate
+
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.failures = 0
+        self.empty = 0
+        self.seconds_saved = 0.0
+
+    def learn(self, question, username, sql_query, generation_seconds=0.0):
+        """Turn SQL that answered question into a template, returns it or None when
+        no literal of sql_query maps to exactly one question token"""
+        tokens = tokenize_question(question)
+        personal = any(token in FIRST_PERSON_WORDS for token in tokens)
+
+        positions = {}  # literal value -> question token index
+        for index, token in enumerate(tokens):
+            value = token.lstrip("@")
+            if _slot_type(token) is None:
+                continue
+            if value in positions:
+                # Same value twice in the question, no way to tell the slots apart
+                positions[value] = None
+            else:
+                positions[value] = index
+
+        slots = {}      # question token index or "user" -> (param name, slot type, quoted)
+        parts = []
+        last = 0
+        for start, end, value, quoted in _sql_literals(sql_query):
+            if value in positions and positions[value] is None:
+                return None
+            key = positions.get(value)
+            if key is None and personal and quoted and value == username.lower():
+                key = "user"
+            if key is None:
+                # Not from the question, stays part of the SQL
+                continue
+            if key not in slots:
+                slot_type = "user" if key == "user" else _slot_type(tokens[key])
+                slots[key] = (f"p{len(slots)}", slot_type, quoted)
+            parts.append(sql_query[last:start] + ":" + slots[key][0])
+            last = end
+        if not slots:
+            return None
+        parts.append(sql_query[last:])
+
+        shape_tokens = []
+        pattern_parts = []
+        for index, token in enumerate(tokens):
+            if index in slots:
+                slot_type = slots[index][1]
+                shape_tokens.append("{" + slot_type + "}")
+                pattern_parts.append(f"({SLOT_PATTERNS[slot_type]})")
+            else:
+                shape_tokens.append(token)
+                pattern_parts.append(re.escape(token))
+        shape = " ".join(shape_tokens)
+        ordered = [slots[index] for index in sorted(key for key in slots if key != "user")]
+        if "user" in slots:
+            ordered.append(slots["user"])
+
+        template = SQLTemplate(
+            shape, re.compile(" ".join(pattern_parts)), ordered, "".join(parts), generation_seconds,
+            time.monotonic() + self.ttl)
+        self.templates[shape] = template
+        self.templates.move_to_end(shape)
+        while len(self.templates) > self.max_entries:
+            self.templates.popitem(last=False)
+        self.learned += 1
+        if (DEBUG_MODE):
+            print(f"SQL template learned for '{shape}':\n{template.sql_query}")
+        return template
+
+    def lookup(self, question, username):
+        """Return (template, params) for a question of a known shape, None on miss"""
+        now = time.monotonic()
+        best = None
+        for shape, template in list(self.templates.items()):
+            if template.expires_at < now:
+                del self.templates[shape]
+                continue
+            params = template.fill(question, username)
+            # Prefer the most specific shape, the one with fewest parameters
+            if params is not None and (best is None or len(params) < len(best[1])):
+                best = (template, params)
+
+        if best is None:
+            self.misses += 1
+            return None
+        template, params = best
+        self.templates.move_to_end(template.shape)
+        template.hits += 1
+        self.hits += 1
+        self.seconds_saved += template.generation_seconds
+        if (DEBUG_MODE):
+            print(f"SQL template hit '{template.shape}': {params}")
+        return best
+
+    def no_rows(self, template):
+        """A filled template found nothing, count the lookup as a miss. The values
+        may not be what the question meant, the LLM gets to answer it"""
+        template.hits -= 1
+        self.hits -= 1
+        self.misses += 1
+        self.empty += 1
+        self.seconds_saved -= template.generation_seconds
+
+    def invalidate(self, template):
+        """Forget a template whose SQL failed"""
+        self.failures += 1
+        self.templates.pop(template.shape, None)
+
+    def flush(self):
+        count = len(self.templates)
+        self.templates.clear()
+        return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.templates),
+            "learned": self.learned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "empty": self.empty,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "seconds_saved": self.seconds_saved
+        }
+
+
+def render_sql(sql_query, params):
+    """SQL with parameters written in as literals, for showing to users only"""
+    def literal(match):
+        value = params[match.group(1)]
+        return str(value) if isinstance(value, int) else "'" + str(value).replace("'", "''") + "'"
+    return re.sub(r"(?<!:):(p\d+)\b", literal, sql_query)
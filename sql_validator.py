@@ -0,0 +1,186 @@
+import difflib
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
+from sqlglot.optimizer.scope import traverse_scope
+from cache import normalize_sql, is_read_only
+from config import SQL_VALIDATION_CONFIG, DEBUG_MODE
+
+WRITE_EXPRESSIONS = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop,
+    exp.Alter, exp.TruncateTable, exp.Command, exp.Into, exp.Lock
+)
+
+
+
+class SQLValidationError(Exception):
+    """SQL rejected locally, before any database round-trip"""
+
+
+class ValidatedSQL(str):
+    """SQL returned by validate(), page_query is the SQL before validate() added its LIMIT"""
+    def __new__(cls, sql_query, page_query):
+        validated = super().__new__(cls, sql_query)
+        validated.page_query = page_query
+        return validated
+
+
+class SQLValidator:
+    """Parse SQL and check it against the cached schema: SELECT only, known tables and columns, LIMIT"""
+    def __init__(self, db, default_limit=None):
+        self.db = db
+        self.default_limit = default_limit or SQL_VALIDATION_CONFIG["default_limit"]
+        self._columns = {}
+        self._indexed_catalog = None
+
+        # Each rejection is a database round-trip that did not happen
+        self.validated = 0
+        self.rejected = 0
+        self.limits_added = 0
+
+    def _get_columns(self):
+        """Return {table: set(columns)}, rebuilt whenever the catalog object changes"""
+        catalog = self.db.catalog
+        if catalog is not self._indexed_catalog:
+            self._columns = {
+                table_name: {column[0].lower() for column in entry["columns"]}
+                for table_name, entry in catalog.items()
+            }
+            self._indexed_catalog = catalog
+        return self._columns
+
+    def validate(self, sql_query, strict=True, limit=True):
+        """Return sql_query ready to run (LIMIT added if missing) or raise SQLValidationError.
+        With strict=False SQL the parser does not understand is passed through unchanged
+        when it looks like a single SELECT, limit=False leaves queries without LIMIT as they are"""
+        self.validated += 1
+        try:
+            sql_query = self._validate(sql_query, strict, limit)
+        except SQLValidationError as e:
+            self.rejected += 1
+            if (DEBUG_MODE):
+                print(f"SQL validation failed: {e}")
+            raise
+        return sql_query
+
+    def _validate(self, sql_query, strict, limit):
+        try:
+            statements = [
+                s for s in sqlglot.parse(sql_query, read="postgres")
+                if s is not None and not isinstance(s, exp.Semicolon)
+            ]
+        except SqlglotError as e:
+            if not strict and is_read_only(normalize_sql(sql_query)):
+                return sql_query
+            raise SQLValidationError(f"Syntax error: {str(e).splitlines()[0]}")
+
+        if len(statements) != 1:
+            raise SQLValidationError("Exactly one SQL statement is allowed.")
+        statement = statements[0]
+
+        if not isinstance(statement, exp.Query) or statement.find(*WRITE_EXPRESSIONS):
+            raise SQLValidationError("Only read-only SELECT queries are allowed.")
+
+        columns = self._get_columns()
+        self._check_tables(statement, columns)
+        try:
+            scopes = traverse_scope(statement)
+        except SqlglotError:
+            scopes = []
+        for scope in scopes:
+            self._check_columns(scope, columns, statement)
+
+        if limit and statement.args.get("limit") is None:
+            self.limits_added += 1
+            return ValidatedSQL(self._add_limit(sql_query), sql_query)
+        return ValidatedSQL(sql_query, sql_query)
+
+    def _add_limit(self, sql_query):
+        # Cut at the closing semicolon token, a new line keeps LIMIT out of any trailing comment
+        tokens = sqlglot.tokenize(sql_query, read="postgres")
+        if tokens and tokens[-1].token_type == TokenType.SEMICOLON:
+            sql_query = sql_query[:tokens[-1].start]
+        return f"{sql_query.rstrip()}\nLIMIT {self.default_limit}"
+
+    def _is_schema_table(self, table):
+        return isinstance(table.this, exp.Identifier) and table.db.lower() in ("", "hafsql") \
+            and not table.catalog
+
+    def _check_tables(self, statement, columns):
+        cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        for table in statement.find_all(exp.Table):
+            name = table.name.lower()
+            if not self._is_schema_table(table) or (not table.db and name in cte_names):
+                continue
+            if name not in columns:
+                suggestions = difflib.get_close_matches(name, columns.keys(), n=3)
+                hint = f" Did you mean: {', '.join(suggestions)}?" if suggestions else ""
+                raise SQLValidationError(f"Unknown table '{table.name}'.{hint}")
+
+    def _real_table(self, source, columns):
+        """Return table name if source is a known HafSQL table, else None"""
+        if isinstance(source, exp.Table) and self._is_schema_table(source) \
+                and source.name.lower() in columns:
+            return source.name.lower()
+        return None
+
+    def _check_columns(self, scope, columns, statement):
+        for column in scope.columns:
+            if not isinstance(column.this, exp.Identifier):
+                continue
+            # Columns of subqueries are listed in the outer scope too, their own scope checks them
+            if column.find_ancestor(exp.Select) is not scope.expression:
+                continue
+            column_name = column.name.lower()
+            qualifier = column.table.lower()
+
+            if qualifier:
+                source = scope.sources.get(column.table) or scope.sources.get(qualifier)
+                table_name = self._real_table(source, columns)
+                # Aliases of subqueries, CTEs or outer scopes are not checked
+                if table_name and column_name not in columns[table_name]:
+                    raise SQLValidationError(self._unknown_column(column, [table_name], columns))
+                continue
+
+            # Unqualified: may come from any source of this scope or an outer one
+            candidate_tables = []
+            derived = False
+            current = scope
+            while current is not None:
+                for source_name, (_, source) in current.selected_sources.items():
+                    table_name = self._real_table(source, columns)
+                    if table_name is not None:
+                        candidate_tables.append(table_name)
+                    elif self._may_have_column(source, column_name):
+                        derived = True
+                current = current.parent
+
+            if derived or not candidate_tables or column_name in self._output_aliases(statement):
+                continue
+            if not any(column_name in columns[t] for t in candidate_tables):
+                raise SQLValidationError(self._unknown_column(column, candidate_tables, columns))
+
+    def _may_have_column(self, source, column_name):
+        """Whether a source that is not a HafSQL table (subquery, CTE, other schema) can have column_name"""
+        query = getattr(source, "expression", None)
+        if not isinstance(query, exp.Query) or query.is_star:
+            return True
+        return column_name in {name.lower() for name in query.named_selects}
+
+    def _output_aliases(self, statement):
+        return {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+
+    def _unknown_column(self, column, table_names, columns):
+        known = sorted(set().union(*(columns[t] for t in table_names)))
+        suggestions = difflib.get_close_matches(column.name.lower(), known, n=3)
+        hint = f" Did you mean: {', '.join(suggestions)}?" if suggestions else ""
+        return (f"Column '{column.sql()}' does not exist in {', '.join(table_names)}.{hint} "
+                f"Available columns: {', '.join(known)}")
+
+    def stats(self):
+        return {
+            "validated": self.validated,
+            "rejected": self.rejected,
+            "limits_added": self.limits_added
+        }
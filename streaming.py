@@ -0,0 +1,85 @@
+import time
+import asyncio
+from config import STREAM_CONFIG, DEBUG_MODE
+
+MESSAGE_LIMIT = 2000
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """Split text in Discord sized chunks, preferring line breaks"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class DiscordStreamWriter:
+    """Show a streamed LLM response with throttled message edits,
+    continuing in new messages past the Discord length limit"""
+    def __init__(self, channel, edit_interval=None, limit=MESSAGE_LIMIT):
+        self.channel = channel
+        self.edit_interval = edit_interval if edit_interval is not None else STREAM_CONFIG["edit_interval"]
+        self.limit = limit
+        self.text = ""
+        self.messages = []
+        self.shown = []
+        self.edits = 0
+        self.started = time.monotonic()
+        self.first_token = None
+        self.last_render = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def ttfb(self):
+        """Seconds from command start to the first streamed token"""
+        if self.first_token is None:
+            return None
+        return self.first_token - self.started
+
+    async def write(self, token):
+        if not token:
+            return
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+            print(f"Streaming: first token after {self.ttfb:.2f}s")
+        self.text += token
+        if time.monotonic() - self.last_render >= self.edit_interval:
+            await self._render()
+
+    async def finish(self, text=None):
+        """Render the final text, replacing what was streamed when given"""
+        if text is not None:
+            self.text = text
+        await self._render()
+        print(
+            f"Streaming: done after {time.monotonic() - self.started:.2f}s, "
+            f"ttfb {self.ttfb or 0:.2f}s, {len(self.messages)} messages, {self.edits} edits"
+        )
+
+    async def _render(self):
+        async with self.lock:
+            self.last_render = time.monotonic()
+            chunks = split_message(self.text, self.limit)
+            for n, chunk in enumerate(chunks):
+                if n < len(self.messages):
+                    if self.shown[n] != chunk:
+                        await self.messages[n].edit(content=chunk)
+                        self.shown[n] = chunk
+                        self.edits += 1
+                else:
+                    self.messages.append(await self.channel.send(chunk))
+                    self.shown.append(chunk)
+
+            # Final text may be shorter than the streamed one
+            while len(self.messages) > max(len(chunks), 1):
+                await self.messages.pop().delete()
+                self.shown.pop()
+
+            if (DEBUG_MODE):
+                print(f"Streaming: rendered {len(self.text)} chars in {len(self.messages)} messages")
@@ -0,0 +1,144 @@
+import re
+import math
+from collections import Counter, defaultdict
+from config import TABLE_INDEX_CONFIG, DEBUG_MODE
+
+# Words users say -> words found in HafSQL table names
+TABLE_SYNONYMS = {
+    "post": ["comments"],
+    "article": ["comments"],
+    "blog": ["comments"],
+    "reply": ["comments"],
+    "comment": ["comments"],
+    "author": ["comments"],
+    "user": ["accounts"],
+    "username": ["accounts"],
+    "account": ["accounts"],
+    "profile": ["accounts"],
+    "send": ["transfer"],
+    "sent": ["transfer"],
+    "sender": ["transfer"],
+    "receive": ["transfer"],
+    "received": ["transfer"],
+    "payment": ["transfer"],
+    "follower": ["follows"],
+    "following": ["follows"],
+    "follow": ["follows"],
+    "wallet": ["balances"],
+    "balance": ["balances"],
+    "hbd": ["balances"],
+    "hive": ["balances"],
+    "delegate": ["delegations"],
+    "delegation": ["delegations"],
+    "reblog": ["reblogs"],
+    "resteem": ["reblogs"],
+    "reputation": ["reputations"],
+    "rep": ["reputations"],
+    "community": ["community"],
+    "subscriber": ["subs"],
+    "proposal": ["proposal"],
+    "saving": ["savings"],
+    "power": ["vesting"],
+    "powerup": ["vesting"],
+    "stake": ["vesting"],
+}
+
+# Name parts that say nothing about the table's content
+NAME_NOISE = {"table", "operation", "view"}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with a naive plural strip"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            tokens.append(token[:-1])
+    return tokens
+
+
+def parse_ddl_columns(create_statement):
+    """Return column names from a generated CREATE TABLE/VIEW statement"""
+    match = re.search(r'\((.*)\)', create_statement, re.DOTALL)
+    if not match:
+        return []
+    return [column.strip().split(" ")[0] for column in match.group(1).split(",") if column.strip()]
+
+
+class TableIndex:
+    """BM25 index over table names and column names for local table selection"""
+    def __init__(self, database_schema, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = {}
+        self.doc_length = {}
+        self.doc_freq = Counter()
+
+        for table_name, create_statement in database_schema.items():
+            terms = Counter()
+            name_tokens = [t for t in tokenize(table_name) if t not in NAME_NOISE]
+            # Table name carries more signal than any one of its columns
+            for token in name_tokens:
+                terms[token] += TABLE_INDEX_CONFIG["name_weight"]
+            for column in parse_ddl_columns(create_statement):
+                for token in tokenize(column):
+                    terms[token] += 1
+
+            self.doc_terms[table_name] = terms
+            self.doc_length[table_name] = sum(terms.values())
+            self.doc_freq.update(terms.keys())
+
+        self.avg_length = (
+            sum(self.doc_length.values()) / len(self.doc_length) if self.doc_length else 0.0
+        )
+        self.postings = defaultdict(list)
+        for table_name, terms in self.doc_terms.items():
+            for term in terms:
+                self.postings[term].append(table_name)
+
+    def _expand(self, question):
+        terms = tokenize(question)
+        expanded = list(terms)
+        for term in terms:
+            for synonym in TABLE_SYNONYMS.get(term, []):
+                expanded.extend(tokenize(synonym))
+        return expanded
+
+    def _idf(self, term):
+        n = len(self.doc_terms)
+        df = self.doc_freq.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def rank(self, question, limit=None):
+        """Return [(table_name, score)] sorted by BM25 score"""
+        scores = defaultdict(float)
+        for term in set(self._expand(question)):
+            if term not in self.postings:
+                continue
+            idf = self._idf(term)
+            for table_name in self.postings[term]:
+                tf = self.doc_terms[table_name][term]
+                norm = 1 - self.b + self.b * self.doc_length[table_name] / self.avg_length
+                scores[table_name] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def suggest(self, question):
+        """Return (tables, confident) for question"""
+        ranked = self.rank(question, TABLE_INDEX_CONFIG["max_tables"])
+        if not ranked:
+            return [], False
+
+        top_score = ranked[0][1]
+        tables = [
+            table_name for table_name, score in ranked
+            if score >= top_score * TABLE_INDEX_CONFIG["relative_cutoff"]
+        ]
+        confident = top_score >= TABLE_INDEX_CONFIG["min_score"]
+
+        if (DEBUG_MODE):
+            print(f"Table index ranking: {ranked}")
+        return tables, confident
@@ -0,0 +1,25 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def pg_url():
+    """Local Postgres of the offline benchmarks (BENCH_PG_URL), skips the test when unreachable"""
+    from sqlalchemy import create_engine, text
+    from benchmarks.pg_fixture import DEFAULT_URL
+    url = os.environ.get("BENCH_PG_URL", DEFAULT_URL)
+    try:
+        engine = create_engine(url)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        finally:
+            engine.dispose()
+    except Exception as e:
+        pytest.skip(f"no local Postgres at {url}: {str(e).splitlines()[0]}")
+    return url
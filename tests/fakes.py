@@ -0,0 +1,103 @@
+"""In-process stand-ins for HafSQL and Discord used by the tests"""
+import io
+import asyncio
+from database import Database
+
+# Catalog shaped like Database._fetch_catalog, tables of benchmarks.pg_fixture
+FIXTURE_CATALOG = {
+    "accounts_table": {"type": "BASE TABLE", "columns": [
+        ["id", "bigint"], ["name", "character varying"], ["created", "timestamp without time zone"],
+        ["reputation", "bigint"], ["post_count", "integer"], ["json_metadata", "text"]]},
+    "comments": {"type": "BASE TABLE", "columns": [
+        ["id", "bigint"], ["author", "character varying"], ["permlink", "character varying"],
+        ["parent_author", "character varying"], ["parent_permlink", "character varying"],
+        ["title", "text"], ["body", "text"], ["category", "character varying"],
+        ["created", "timestamp without time zone"], ["net_votes", "integer"],
+        ["pending_payout_value", "numeric"]]},
+    "operation_transfer_table": {"type": "BASE TABLE", "columns": [
+        ["id", "bigint"], ["block_num", "integer"], ["trx_id", "character varying"],
+        ["timestamp", "timestamp without time zone"], ["from", "character varying"],
+        ["to", "character varying"], ["amount", "numeric"], ["symbol", "character varying"],
+        ["memo", "text"]]},
+}
+
+
+class FakeDatabase(Database):
+    """Database without a connection: fixture catalog, every query answers after latency
+    with rows naming the query, so callers can tell whose result they got"""
+    def __init__(self, latency=0.0, catalog=None):
+        self.latency = latency
+        self.query_cache = None
+        self.replica = None
+        self.inflight_queries = {}
+        self.tables_list = []
+        self.views_list = []
+        self.database_list = []
+        self.catalog = {}
+        self.database_schema = {}
+        self.schema_fingerprint = "fake"
+        self.queries = []
+        self._apply_catalog(catalog or FIXTURE_CATALOG)
+
+    async def execute_query(self, query, fetch_size=100, params=None):
+        self.queries.append((query, params))
+        await asyncio.sleep(self.latency)
+        return [(n, query, str(params)) for n in range(3)], ["n", "query", "params"]
+
+    async def export_query(self, query, fmt="csv", compress=False):
+        self.queries.append((query, None))
+        return io.BytesIO(query.encode("utf-8")), 1, False
+
+    async def explain_query(self, query, params=None):
+        return {"Total Cost": 1.0, "Plan Rows": 1}
+
+    def has_cached_result(self, query, fetch_size=100, params=None):
+        return False
+
+    async def refresh_schema_async(self, force=False):
+        return None
+
+    def close(self):
+        pass
+
+
+class FakeChannel:
+    """Discord channel keeping sent messages as text, send() and edit() take latency"""
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content, kwargs)
+        self.messages.append(message)
+        return message
+
+    @property
+    def texts(self):
+        return [message.content for message in self.messages]
+
+
+class FakeMessage:
+    def __init__(self, channel, content, kwargs):
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+
+    async def edit(self, content=None, **kwargs):
+        await asyncio.sleep(self.channel.latency)
+        if content is not None:
+            self.content = content
+        self.kwargs.update(kwargs)
+        return self
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency)
+        self.channel.messages.remove(self)
+
+
+def create_fake_command_handler():
+    """handler_factory for worker processes: fake database and fake LLM"""
+    from commands import CommandHandler
+    from benchmarks.fake_llm import FakeChatModel
+    return CommandHandler(FakeDatabase(), FakeChatModel(jitter=0), FakeChatModel(jitter=0))
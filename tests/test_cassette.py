@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from cassette import Cassette, CassetteChatModel, CassetteMissError, prompt_key
+from commands import CommandHandler
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+QUESTIONS = ["last 5 posts by user1", "top accounts by reputation", "last 10 transfers from user3"]
+
+
+def run_questions(cassette, eval_llm, sql_llm):
+    handler = CommandHandler(FakeDatabase(), CassetteChatModel(sql_llm, cassette, "SQL-Generator"),
+                             CassetteChatModel(eval_llm, cassette, "Tables-Evaluator"))
+
+    async def run():
+        outputs = []
+        for question in QUESTIONS:
+            with cassette.scope(question):
+                sql_query, rows, header = await handler.retry_sql_generation(question, "tester")
+                outputs.append((str(sql_query), rows))
+        with cassette.scope("help"):
+            tokens = []
+
+            async def on_token(token):
+                tokens.append(token)
+
+            outputs.append(await handler.handle_help("how do I find transfers", "tester", False, on_token))
+            outputs.append("".join(tokens))
+        return outputs
+
+    return asyncio.run(run())
+
+
+def test_record_then_replay_without_provider(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorder = Cassette(path, mode="record")
+    llm = FakeChatModel(latency=0, jitter=0)
+    recorded = run_questions(recorder, llm, llm)
+    assert recorder.stats["recorded"] == llm.calls > len(QUESTIONS)
+
+    player = Cassette(path, mode="replay", realtime=False)
+    replayed = run_questions(player, None, None)
+    assert replayed == recorded
+    assert player.stats == {"recorded": 0, "replayed": recorder.stats["recorded"], "similar": 0, "missed": 0}
+
+
+@pytest.fixture
+def player(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorder = Cassette(path, mode="record")
+    for scope, prompt, response in [
+        ("top accounts", "Question: top accounts\nSchema: accounts_table", "SELECT 1"),
+        ("top accounts", "Question: top accounts\nSchema: comments", "SELECT 2"),
+        ("top posts", "Question: top accounts\nSchema: accounts_table v2", "SELECT 3"),
+    ]:
+        with recorder.scope(scope):
+            recorder.record("llm", prompt_key(prompt), {"prompt": prompt, "response": response})
+    return Cassette(path, mode="replay", realtime=False)
+
+
+def test_similar_prompt_fallback_stays_in_scope(player):
+    llm = CassetteChatModel(None, player)
+    changed = "Question: top accounts\nSchema: accounts_table v2!"
+
+    async def ask(scope, prompt):
+        with player.scope(scope):
+            return (await llm.ainvoke(prompt)).content
+
+    # Closest recording of the same question, not the even closer one of another question
+    assert asyncio.run(ask("top accounts", changed)) == "SELECT 1"
+    assert asyncio.run(ask("top posts", changed)) == "SELECT 3"
+    assert player.stats["similar"] == 2
+
+    with pytest.raises(CassetteMissError):
+        asyncio.run(ask("newest accounts", changed))
+    with pytest.raises(CassetteMissError):
+        asyncio.run(llm.ainvoke(changed))
+    assert player.stats["missed"] == 2
+
+
+def test_repeated_calls_replayed_in_order(tmp_path):
+    path = str(tmp_path / "cassette.jsonl")
+    recorder = Cassette(path, mode="record")
+    for response in ("first", "second"):
+        recorder.record("llm", prompt_key("same prompt"), {"prompt": "same prompt", "response": response})
+
+    player = Cassette(path, mode="replay", realtime=False)
+    llm = CassetteChatModel(None, player)
+    answers = [asyncio.run(llm.ainvoke("same prompt")).content for _ in range(3)]
+    assert answers == ["first", "second", "second"]
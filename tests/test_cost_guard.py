@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from config import COST_GUARD_CONFIG, PAGINATION_CONFIG
+from commands import CommandHandler
+from cost_guard import CostGuard, QueryCostError, has_limit, add_limit
+from pagination import PageState
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+CHEAP = {"Total Cost": 10.0, "Plan Rows": 5}
+HUGE = {"Total Cost": 5e7, "Plan Rows": 10 ** 8}
+
+
+class PlanDatabase(FakeDatabase):
+    """Fake EXPLAIN: queries wrapped in a LIMIT get limited_plan, the others plan"""
+    def __init__(self, plan, limited_plan=CHEAP, cached=()):
+        super().__init__()
+        self.plan = plan
+        self.limited_plan = limited_plan
+        self.cached = set(cached)
+        self.explained = []
+        self.cache_lookups = []
+
+    async def explain_query(self, query, params=None):
+        self.explained.append(query)
+        return self.limited_plan if "limited_query" in query else self.plan
+
+    def has_cached_result(self, query, fetch_size=100, params=None):
+        self.cache_lookups.append((query, fetch_size))
+        return (query, fetch_size) in self.cached
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setitem(COST_GUARD_CONFIG, "enabled", True)
+
+
+def guard(db):
+    return CostGuard(db, max_cost=1e6, max_rows=10 ** 6, rewrite_limit=100)
+
+
+def test_accept_cheap_query():
+    db = PlanDatabase(CHEAP)
+    sql_query = "SELECT name FROM hafsql.accounts_table WHERE name = 'user1'"
+    assert asyncio.run(guard(db).check(sql_query)) == sql_query
+    assert db.explained == [sql_query]
+
+
+def test_rewrite_with_limit():
+    db = PlanDatabase(HUGE)
+    sql_query = "SELECT * FROM hafsql.comments ORDER BY created DESC;"
+    limited = asyncio.run(guard(db).check(sql_query))
+    assert limited == add_limit(sql_query, 100)
+    assert has_limit(limited)
+    assert db.explained == [sql_query, limited]
+
+
+@pytest.mark.parametrize("sql_query, limited_plan", [
+    # Still too expensive with a LIMIT (e.g. a sort over the whole table)
+    ("SELECT * FROM hafsql.comments ORDER BY created DESC", HUGE),
+    # Has a LIMIT already, nothing to rewrite
+    ("SELECT * FROM hafsql.comments ORDER BY created DESC LIMIT 50", CHEAP),
+])
+def test_reject(sql_query, limited_plan):
+    db = PlanDatabase(HUGE, limited_plan)
+    with pytest.raises(QueryCostError) as e:
+        asyncio.run(guard(db).check(sql_query))
+    assert e.value.total_cost == HUGE["Total Cost"]
+    assert "Query too expensive" in str(e.value)
+
+
+def test_reject_instead_of_rewrite():
+    db = PlanDatabase(HUGE)
+    with pytest.raises(QueryCostError):
+        asyncio.run(guard(db).check("SELECT * FROM hafsql.comments", rewrite=False))
+    assert len(db.explained) == 1
+
+
+def test_cached_result_looked_up_with_the_fetch_size_of_the_query():
+    page = PageState("SELECT name FROM hafsql.accounts_table ORDER BY name", page_size=10)
+    page_query, _ = page.query()
+    db = PlanDatabase(CHEAP, cached=[(page_query, 11)])
+    handler = CommandHandler(db, FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+
+    # Pages are fetched with page_size + 1 rows, a cached page needs no EXPLAIN
+    asyncio.run(handler.handle_page(page, "tester"))
+    assert db.cache_lookups == [(page_query, 11)]
+    assert db.explained == []
+
+    db.cache_lookups.clear()
+    sql_query = "SELECT name FROM hafsql.accounts_table LIMIT 10"
+    asyncio.run(handler.handle_hafsql(sql_query, "tester"))
+    assert db.cache_lookups == [(sql_query, PAGINATION_CONFIG["page_size"])]
+
+
+def test_export_is_cost_checked_and_never_limited():
+    db = PlanDatabase(HUGE)
+    handler = CommandHandler(db, FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+    content, buffer, filename = asyncio.run(handler.handle_export("csv SELECT * FROM hafsql.comments", "tester"))
+    assert buffer is None
+    assert "query not executed" in content and "Query too expensive" in content
+    assert db.queries == []
+    assert db.cache_lookups == []
+
+    db.plan = CHEAP
+    content, buffer, filename = asyncio.run(handler.handle_export("csv SELECT * FROM hafsql.comments", "tester"))
+    assert buffer.getvalue() == b"SELECT * FROM hafsql.comments"
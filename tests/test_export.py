@@ -0,0 +1,104 @@
+import io
+import csv
+import gzip
+import json
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import StaticPool
+from config import EXPORT_CONFIG
+from database import Database
+from tests.fakes import FakeDatabase
+
+QUERY = "SELECT id, author, title FROM comments ORDER BY id"
+ROWS = 500
+
+
+class SQLiteDatabase(FakeDatabase):
+    """Real export code over an in-memory SQLite comments table"""
+    export_query = Database.export_query
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.db = create_engine("sqlite://", poolclass=StaticPool,
+                                connect_args={"check_same_thread": False})
+        with self.db.begin() as connection:
+            connection.execute(text("CREATE TABLE comments (id INTEGER, author TEXT, title TEXT)"))
+            connection.execute(
+                text("INSERT INTO comments VALUES (:id, :author, :title)"),
+                [{"id": n, "author": f"user{n % 7}", "title": f"post, \"{n}\""} for n in range(ROWS)])
+
+        self.streamed = []
+
+        @event.listens_for(self.db, "before_cursor_execute")
+        def record(connection, cursor, statement, parameters, context, executemany):
+            self.streamed.append(context.execution_options.get("stream_results", False))
+
+    def close(self):
+        self.executor.shutdown()
+        self.db.dispose()
+
+
+@pytest.fixture
+def db():
+    db = SQLiteDatabase()
+    db.streamed.clear()
+    yield db
+    db.close()
+
+
+def read_csv(data):
+    return list(csv.reader(io.StringIO(data.decode("utf-8"))))
+
+
+def test_csv_export_streams_every_row(db, monkeypatch):
+    monkeypatch.setitem(EXPORT_CONFIG, "chunk_size", 64)
+    buffer, row_count, truncated = asyncio.run(db.export_query(QUERY, "csv"))
+    assert db.streamed == [True]
+    assert (row_count, truncated) == (ROWS, False)
+    lines = read_csv(buffer.getvalue())
+    assert lines[0] == ["id", "author", "title"]
+    assert lines[1:] == [[str(n), f"user{n % 7}", f"post, \"{n}\""] for n in range(ROWS)]
+
+
+def test_ndjson_export(db):
+    buffer, row_count, truncated = asyncio.run(db.export_query(QUERY, "ndjson"))
+    lines = buffer.getvalue().decode("utf-8").splitlines()
+    assert row_count == len(lines) == ROWS
+    assert json.loads(lines[3]) == {"id": 3, "author": "user3", "title": "post, \"3\""}
+
+
+@pytest.mark.parametrize("fmt", ["csv", "ndjson"])
+def test_export_truncated_at_size_cap(db, monkeypatch, fmt):
+    monkeypatch.setitem(EXPORT_CONFIG, "max_bytes", 4096)
+    monkeypatch.setitem(EXPORT_CONFIG, "chunk_size", 50)
+    buffer, row_count, truncated = asyncio.run(db.export_query(QUERY, fmt))
+    data = buffer.getvalue()
+    assert truncated
+    assert 0 < row_count < ROWS
+    assert len(data) <= 4096
+    # Only whole rows, the first row_count of them
+    lines = read_csv(data)[1:] if fmt == "csv" else data.decode("utf-8").splitlines()
+    assert len(lines) == row_count
+
+
+def test_gzip_export(db, monkeypatch):
+    monkeypatch.setitem(EXPORT_CONFIG, "chunk_size", 64)
+    buffer, row_count, truncated = asyncio.run(db.export_query(QUERY, "csv", compress=True))
+    plain, _, _ = asyncio.run(db.export_query(QUERY, "csv"))
+    assert (row_count, truncated) == (ROWS, False)
+    assert gzip.decompress(buffer.getvalue()) == plain.getvalue()
+
+
+def test_gzip_export_truncated_below_cap(db, monkeypatch):
+    # Compressed size is what the cap is about, and the file must still decompress
+    monkeypatch.setitem(EXPORT_CONFIG, "max_bytes", 2048)
+    monkeypatch.setitem(EXPORT_CONFIG, "chunk_size", 20)
+    buffer, row_count, truncated = asyncio.run(db.export_query(QUERY, "csv", compress=True))
+    data = buffer.getvalue()
+    assert truncated
+    assert len(data) <= 2048
+    assert 0 < row_count < ROWS
+    assert len(read_csv(gzip.decompress(data))) == row_count + 1
@@ -0,0 +1,39 @@
+import time
+import asyncio
+from config import QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SPECULATIVE_CONFIG, TABLE_INDEX_CONFIG
+from commands import CommandHandler
+from llm import LLMLimiter
+from benchmarks.fake_llm import FakeChatModel, AIQUERY_CASES
+from tests.fakes import FakeDatabase
+
+LLM_LATENCY = 0.3
+
+
+def test_concurrent_aiquery_take_one_call_latency(monkeypatch):
+    """N questions at once cost about one question's LLM round trips, not N of them"""
+    monkeypatch.setitem(QUESTION_CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TEMPLATE_CONFIG, "enabled", False)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "enabled", False)
+    questions = list(AIQUERY_CASES)
+    llm = FakeChatModel(latency=LLM_LATENCY, jitter=0)
+    eval_llm = FakeChatModel(latency=LLM_LATENCY, jitter=0)
+    handler = CommandHandler(FakeDatabase(), llm, eval_llm, LLMLimiter(default_limit=len(questions)))
+
+    async def ask_all():
+        return await asyncio.gather(*(handler.handle_aiquery(q, "tester") for q in questions))
+
+    # Table selection and SQL generation, two LLM round trips per question
+    start = time.perf_counter()
+    asyncio.run(handler.handle_aiquery(questions[0], "tester"))
+    single = time.perf_counter() - start
+
+    calls = llm.calls + eval_llm.calls
+    start = time.perf_counter()
+    responses = asyncio.run(ask_all())
+    elapsed = time.perf_counter() - start
+
+    assert len(responses) == len(questions)
+    assert llm.calls + eval_llm.calls - calls >= 2 * len(questions)
+    assert single >= 2 * LLM_LATENCY
+    assert elapsed < single + LLM_LATENCY, f"{len(questions)} questions took {elapsed:.2f}s, one took {single:.2f}s"
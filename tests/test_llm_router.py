@@ -0,0 +1,106 @@
+import time
+import asyncio
+import pytest
+from config import LLM_ROUTER_CONFIG
+from llm import LLMRouter
+
+
+class FakeProvider:
+    """Chat model answering its own name after latency, or failing when told to"""
+    def __init__(self, name, latency=0.0, fail=False):
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    async def ainvoke(self, prompt):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError(f"{self.name} unavailable")
+        return self.name
+
+
+@pytest.fixture
+def router_config(monkeypatch):
+    for key, value in {
+        "hedge": True, "hedge_percentile": 95, "hedge_delay": 5.0, "min_hedge_delay": 0.01,
+        "window": 20, "min_samples": 3, "failure_threshold": 2, "max_error_rate": 1.0, "open_seconds": 0.2
+    }.items():
+        monkeypatch.setitem(LLM_ROUTER_CONFIG, key, value)
+
+
+def test_slow_provider_hedged_after_its_latency_percentile(router_config):
+    primary, backup = FakeProvider("primary", latency=0.05), FakeProvider("backup", latency=0.05)
+    router = LLMRouter([("primary", primary), ("backup", backup)])
+
+    async def run():
+        for _ in range(3):
+            assert await router.ainvoke("q") == "primary"
+        # p95 is now about 50ms, a request 20 times slower goes to the backup as well
+        primary.latency = 1.0
+        start = time.monotonic()
+        response = await router.ainvoke("q")
+        return response, time.monotonic() - start
+
+    response, elapsed = asyncio.run(run())
+    assert response == "backup"
+    assert elapsed < 0.5
+    assert backup.calls == 1 and primary.cancelled == 1
+
+
+def test_failed_provider_replaced_by_the_next(router_config):
+    primary, backup = FakeProvider("primary", fail=True), FakeProvider("backup")
+    router = LLMRouter([("primary", primary), ("backup", backup)])
+
+    assert asyncio.run(router.ainvoke("q")) == "backup"
+    assert router.health["primary"].consecutive_failures == 1
+    assert router.stats()["backup"]["requests"] == 1
+
+
+def test_circuit_opens_half_opens_and_closes(router_config, monkeypatch):
+    monkeypatch.setitem(LLM_ROUTER_CONFIG, "hedge", False)
+    primary, backup = FakeProvider("primary", fail=True), FakeProvider("backup")
+    router = LLMRouter([("primary", primary), ("backup", backup)])
+    health = router.health["primary"]
+
+    async def run():
+        for _ in range(2):
+            assert await router.ainvoke("q") == "backup"
+        assert health.state() == "open"
+
+        # Open: the failing provider is not called at all
+        assert await router.ainvoke("q") == "backup"
+        assert primary.calls == 2
+
+        # Half-open after open_seconds: one trial request, its success closes the circuit
+        await asyncio.sleep(0.25)
+        assert health.state() == "half-open"
+        primary.fail = False
+        assert await router.ainvoke("q") == "primary"
+        assert health.state() == "closed"
+
+    asyncio.run(run())
+
+
+def test_failed_trial_opens_the_circuit_again(router_config, monkeypatch):
+    monkeypatch.setitem(LLM_ROUTER_CONFIG, "hedge", False)
+    primary, backup = FakeProvider("primary", fail=True), FakeProvider("backup")
+    router = LLMRouter([("primary", primary), ("backup", backup)])
+    health = router.health["primary"]
+
+    async def run():
+        for _ in range(2):
+            await router.ainvoke("q")
+        await asyncio.sleep(0.25)
+        assert health.state() == "half-open"
+        assert await router.ainvoke("q") == "backup"
+        assert primary.calls == 3
+        assert health.state() == "open"
+
+    asyncio.run(run())
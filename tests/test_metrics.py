@@ -0,0 +1,143 @@
+import json
+import time
+import pickle
+import asyncio
+import threading
+import pytest
+import metrics
+from config import METRICS_CONFIG
+from workers import ProcessJobQueue
+from tests.fakes import create_fake_command_handler
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.MetricsRegistry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    monkeypatch.setitem(METRICS_CONFIG, "trace_log", "")
+    return registry
+
+
+def test_nested_spans(registry):
+    with metrics.trace("aiquery") as trace:
+        with metrics.span("outer"):
+            time.sleep(0.01)
+            with metrics.span("inner"):
+                time.sleep(0.02)
+        metrics.count("llm_calls")
+        metrics.count("llm_calls")
+
+    # Spans are recorded when they end, the inner one first and inside the outer one
+    (inner, inner_start, inner_duration), (outer, outer_start, outer_duration) = trace.spans
+    assert (inner, outer) == ("inner", "outer")
+    assert outer_start <= inner_start
+    assert inner_start + inner_duration <= outer_start + outer_duration
+    assert outer_duration >= inner_duration + 0.01
+    assert trace.counters == {("llm_calls", ()): 2}
+
+    assert registry.histograms[("stage_seconds", (("stage", "inner"),))].count == 1
+    assert registry.histograms[("command_seconds", (("command", "aiquery"), ("status", "ok")))].count == 1
+    assert registry.counters == {("llm_calls", ()): 2}
+
+
+def test_spans_outside_a_trace_go_to_the_registry(registry):
+    with metrics.span("schema_refresh"):
+        pass
+    metrics.count("queue_full", command_class="llm")
+    assert registry.histograms[("stage_seconds", (("stage", "schema_refresh"),))].count == 1
+    assert registry.counters == {("queue_full", (("command_class", "llm"),)): 1}
+
+
+def test_failed_command_status(registry):
+    with pytest.raises(ValueError):
+        with metrics.trace("hafsql"):
+            raise ValueError("boom")
+    assert ("command_seconds", (("command", "hafsql"), ("status", "error"))) in registry.histograms
+
+
+def test_prometheus_text(registry):
+    registry.inc("llm_tokens", 120, (("kind", "input"),))
+    registry.inc("llm_tokens", 30, (("kind", "output"),))
+    registry.observe("stage_seconds", 0.003, (("stage", "db_query"),))
+    registry.observe("stage_seconds", 0.7, (("stage", "db_query"),))
+    lines = registry.render().splitlines()
+
+    assert lines[:3] == [
+        "# TYPE hafsql_llm_tokens_total counter",
+        'hafsql_llm_tokens_total{kind="input"} 120',
+        'hafsql_llm_tokens_total{kind="output"} 30',
+    ]
+    assert lines[3] == "# TYPE hafsql_stage_seconds histogram"
+    buckets = {line.split(" ")[0]: int(line.split(" ")[1]) for line in lines if "_bucket" in line}
+    assert buckets['hafsql_stage_seconds_bucket{stage="db_query",le="0.005"}'] == 1
+    assert buckets['hafsql_stage_seconds_bucket{stage="db_query",le="0.5"}'] == 1
+    assert buckets['hafsql_stage_seconds_bucket{stage="db_query",le="1"}'] == 2
+    assert buckets['hafsql_stage_seconds_bucket{stage="db_query",le="+Inf"}'] == 2
+    assert len(buckets) == len(metrics.BUCKETS) + 1
+    assert lines[-2:] == ['hafsql_stage_seconds_sum{stage="db_query"} 0.703000',
+                          'hafsql_stage_seconds_count{stage="db_query"} 2']
+
+
+def test_trace_export_and_merge(registry):
+    with metrics.trace("aiquery", record=False) as worker_trace:
+        with metrics.span("sql_generation"):
+            pass
+        metrics.count("llm_calls")
+        metrics.set_status("error")
+    exported = pickle.loads(pickle.dumps(worker_trace.export()))
+    assert registry.counters == {}
+
+    with metrics.trace("aiquery") as trace:
+        with metrics.span("queue_wait"):
+            pass
+        metrics.count("llm_calls")
+        trace.merge(exported)
+
+    assert [stage for stage, _, _ in trace.spans] == ["queue_wait", "sql_generation"]
+    assert trace.counters == {("llm_calls", ()): 2}
+    assert trace.status == "error"
+    assert registry.counters == {("llm_calls", ()): 2}
+
+
+def test_worker_process_traces_merged(registry):
+    async def run():
+        queue = ProcessJobQueue(processes=1, concurrency=1, handler_factory=create_fake_command_handler)
+        queue.start()
+        try:
+            # What HafSQLBot._run_command does with a worker result
+            with metrics.trace("hafsql") as trace:
+                result = await queue.submit("hafsql", "!hafsql SELECT name FROM hafsql.accounts_table LIMIT 3",
+                                            "!hafsql", "tester")
+                trace.merge(result.pop("trace"))
+            return trace
+        finally:
+            queue.stop()
+
+    trace = asyncio.run(run())
+    stages = [stage for stage, _, _ in trace.spans]
+    assert "db_query" in stages and "cost_guard" in stages
+    assert trace.counters[("rows_returned", (("command", "query"),))] == 3
+    assert registry.counters[("rows_returned", (("command", "query"),))] == 3
+
+
+def test_trace_log_written_off_the_calling_thread(registry, tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setitem(METRICS_CONFIG, "trace_log", str(path))
+    writers = set()
+    append = metrics._append_trace_log
+
+    def record_thread(*args):
+        writers.add(threading.current_thread())
+        return append(*args)
+
+    monkeypatch.setattr(metrics, "_append_trace_log", record_thread)
+    for command in ("help", "aiquery", "hafsql"):
+        with metrics.trace(command):
+            with metrics.span("command"):
+                pass
+    metrics.flush_trace_log()
+
+    assert threading.current_thread() not in writers
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [entry["command"] for entry in entries] == ["help", "aiquery", "hafsql"]
+    assert entries[0]["spans"][0][0] == "command"
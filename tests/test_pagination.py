@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from config import PAGINATION_CONFIG, QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SPECULATIVE_CONFIG
+from commands import CommandHandler
+from pagination import keyset_plan, first_page
+from benchmarks.fake_llm import FakeChatModel, AIQUERY_CASES
+from tests.fakes import FakeDatabase
+
+HEADER = ["author", "created"]
+TOP_100_SQL = "SELECT name, reputation FROM hafsql.accounts_table ORDER BY reputation DESC\nLIMIT 100"
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    monkeypatch.setitem(PAGINATION_CONFIG, "enabled", True)
+    monkeypatch.setitem(PAGINATION_CONFIG, "page_size", 3)
+
+
+def test_distinct_on_keeps_its_order_by():
+    sql_query = ("SELECT DISTINCT ON (author) author, created FROM hafsql.comments "
+                 "ORDER BY author, created DESC")
+    inner, keys = keyset_plan(sql_query)
+    assert inner == sql_query
+    assert keys == [("author", False, False), ("created", True, True)]
+
+
+def test_no_next_page_past_the_query_limit(pages):
+    rows = [("user1", 1), ("user2", 2), ("user3", 3)]
+    assert first_page("SELECT author, created FROM hafsql.comments ORDER BY author LIMIT 3", rows, HEADER) is None
+    state = first_page("SELECT author, created FROM hafsql.comments ORDER BY author LIMIT 4", rows, HEADER)
+    assert state is not None and state.has_next
+
+
+def test_aiquery_pages_without_the_validator_limit(pages, monkeypatch):
+    monkeypatch.setitem(AIQUERY_CASES, "top 100 accounts by reputation", (["accounts_table"], TOP_100_SQL))
+    monkeypatch.setitem(QUESTION_CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TEMPLATE_CONFIG, "enabled", False)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "enabled", False)
+    handler = CommandHandler(FakeDatabase(), FakeChatModel(latency=0, jitter=0), FakeChatModel(latency=0, jitter=0))
+
+    # The generated SQL has no LIMIT, validation added one to the first page only
+    response = asyncio.run(handler.handle_aiquery("when was user5 created and how many posts does it have", "tester"))
+    assert handler.db.queries[-1][0].endswith("\nLIMIT 100")
+    assert response.page.sql_query == (
+        "SELECT name, created, post_count FROM hafsql.accounts_table WHERE name = 'user5'")
+
+    # A LIMIT the LLM wrote stays, also when it looks like the one validation adds
+    response = asyncio.run(handler.handle_aiquery("top accounts by reputation", "tester"))
+    assert response.page.sql_query.endswith("LIMIT 10")
+    response = asyncio.run(handler.handle_aiquery("top 100 accounts by reputation", "tester"))
+    assert response.page.sql_query == TOP_100_SQL
@@ -0,0 +1,68 @@
+import copy
+import pytest
+from config import PROMPT_CONFIG
+from prompt_builder import SchemaPromptBuilder
+from table_index import parse_ddl_columns
+from tests.fakes import FakeDatabase, FIXTURE_CATALOG
+
+# Wide table, like the HafSQL operation tables
+EXTRA_COLUMNS = [[f"extension_{n}", "character varying"] for n in range(40)] + [
+    ["json_metadata", "text"], ["beneficiaries", "jsonb"], ["max_accepted_payout", "numeric"],
+    ["last_update", "timestamp without time zone"], ["root_id", "bigint"]]
+
+
+@pytest.fixture
+def builder():
+    catalog = copy.deepcopy(FIXTURE_CATALOG)
+    catalog["comments"]["columns"].extend(EXTRA_COLUMNS)
+    db = FakeDatabase(catalog=catalog)
+    return SchemaPromptBuilder(db)
+
+
+def schemas(builder, *tables):
+    return {table: builder.db.database_schema[table] for table in tables}
+
+
+def test_small_schema_unchanged(builder):
+    relevant = schemas(builder, "accounts_table")
+    assert builder.build("top accounts", relevant) == relevant["accounts_table"]
+    assert builder.stats()["tokens_saved"] == 0
+
+
+@pytest.mark.parametrize("budget", [120, 200, 300])
+def test_budget_respected(builder, monkeypatch, budget):
+    monkeypatch.setitem(PROMPT_CONFIG, "schema_token_budget", budget)
+    relevant = schemas(builder, "comments", "accounts_table")
+    table_info = builder.build("posts with the most votes", relevant)
+    assert builder.count_tokens(table_info) <= budget
+    assert builder.count_tokens("\n".join(relevant.values())) > budget
+    assert builder.stats()["tokens_saved"] > 0
+
+
+def test_key_and_timestamp_columns_survive(builder, monkeypatch):
+    # A budget too small for anything but the columns that are always kept
+    monkeypatch.setitem(PROMPT_CONFIG, "schema_token_budget", 1)
+    columns = parse_ddl_columns(builder.build("posts with the most votes", schemas(builder, "comments")))
+    # The prompt tells the model to ignore id, it is not kept for free
+    assert columns == ["author", "permlink", "parent_author", "parent_permlink", "created",
+                       "last_update", "root_id"]
+
+
+def test_question_columns_kept_first_and_id_last(builder, monkeypatch):
+    relevant = schemas(builder, "comments")
+    monkeypatch.setitem(PROMPT_CONFIG, "schema_token_budget", 1)
+    required = builder.build("", relevant)
+    monkeypatch.setitem(PROMPT_CONFIG, "schema_token_budget", builder.count_tokens(required) + 20)
+    columns = parse_ddl_columns(builder.build("posts with the most net votes and their payout", relevant))
+    assert {"net_votes", "pending_payout_value"} <= set(columns)
+    # Columns without overlap follow in schema order, id after all of them
+    assert "title" in columns
+    assert "id" not in columns and "extension_39" not in columns
+
+
+def test_model_budgets(builder, monkeypatch):
+    monkeypatch.setitem(PROMPT_CONFIG, "model_budgets", {"small-model": 10})
+    monkeypatch.setitem(PROMPT_CONFIG, "schema_token_budget", 5000)
+    relevant = schemas(builder, "comments")
+    assert builder.build("posts", relevant, model="large-model") == relevant["comments"]
+    assert builder.build("posts", relevant, model="small-model") != relevant["comments"]
@@ -0,0 +1,92 @@
+import time
+import pytest
+from cache import QueryCache, normalize_sql, is_read_only
+
+ROWS = ([(1, "alice"), (2, "bob")], ["id", "name"])
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT  *\n  FROM hafsql.Comments -- latest\n WHERE id = 1;") == \
+        "select * from hafsql.comments where id = 1"
+    assert normalize_sql("select /* all */ * from t") == normalize_sql("SELECT * FROM T")
+    # Literals and quoted identifiers are data, not case-folded
+    assert normalize_sql("SELECT \"From\" FROM t WHERE author = 'Alice  B'") == \
+        "select \"From\" from t where author = 'Alice  B'"
+    assert normalize_sql("SELECT '--not a comment' FROM t") == "select '--not a comment' from t"
+    assert normalize_sql("SELECT 5-3") == "select 5-3"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM hafsql.comments",
+    "with recent as (select 1) select * from recent",
+    "SELECT * FROM t WHERE memo = 'drop table users; delete'",
+    "SELECT updated_at, created FROM t",
+])
+def test_read_only(sql):
+    assert is_read_only(normalize_sql(sql))
+
+
+@pytest.mark.parametrize("sql", [
+    "INSERT INTO t VALUES (1)",
+    "UPDATE t SET a = 1",
+    "DELETE FROM t",
+    "DROP TABLE t",
+    "SELECT 1; DROP TABLE t",
+    "SELECT * INTO backup FROM t",
+    "WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d",
+    "SELECT nextval('seq')",
+    "SELECT pg_sleep(10)",
+    "VACUUM t",
+])
+def test_writes_rejected(sql):
+    assert not is_read_only(normalize_sql(sql))
+
+
+def test_key_is_normalized_and_writes_not_cached():
+    cache = QueryCache(ttl=60, max_bytes=1024 * 1024, max_entries=10)
+    assert cache.make_key("SELECT * FROM t;", 100) == cache.make_key("select *\nfrom t", 100)
+    assert cache.make_key("SELECT * FROM t", 100) != cache.make_key("SELECT * FROM t", 101)
+    assert cache.make_key("DELETE FROM t", 100) is None
+
+
+def test_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = QueryCache(ttl=60, max_bytes=1024 * 1024, max_entries=10)
+    cache.put("a", ROWS)
+    now[0] += 59
+    assert cache.get("a") == ROWS
+    now[0] += 2
+    assert not cache.contains("a")
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0 and cache.total_bytes == 0
+
+
+def test_lru_eviction():
+    cache = QueryCache(ttl=60, max_bytes=1024 * 1024, max_entries=2)
+    cache.put("a", ROWS)
+    cache.put("b", ROWS)
+    cache.get("a")
+    cache.put("c", ROWS)
+    assert cache.get("b") is None
+    assert cache.get("a") == ROWS and cache.get("c") == ROWS
+    assert cache.evictions == 1
+
+
+def test_byte_cap():
+    size = QueryCache()._estimate_size(ROWS)
+    cache = QueryCache(ttl=60, max_bytes=size * 2, max_entries=100)
+    for key in "abc":
+        cache.put(key, ROWS)
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.total_bytes == size * 2 <= cache.max_bytes
+
+    # A result larger than the whole budget is not cached and evicts nothing
+    cache.put("big", ([(n, "x" * 100) for n in range(100)], ["id", "name"]))
+    assert "big" not in cache.entries
+    assert list(cache.entries) == ["b", "c"]
+
+    # Replacing an entry does not count it twice
+    cache.put("c", ROWS)
+    assert cache.total_bytes == size * 2
+    assert cache.flush() == 2 and cache.total_bytes == 0
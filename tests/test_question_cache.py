@@ -0,0 +1,45 @@
+import pytest
+from cache import QuestionCache
+
+SQL = "SELECT title FROM hafsql.comments WHERE author = 'alice' AND title <> '' ORDER BY created DESC LIMIT 5"
+
+
+def test_fuzzy_hit_keeps_the_account_of_the_cached_sql():
+    cache = QuestionCache(similarity=0.5, ttl=60, max_entries=10)
+    cache.store("latest posts written by alice", "tester", SQL)
+
+    assert cache.lookup("latest posts written by bob", "tester") is None
+    assert cache.lookup("latest blog posts written by alice", "tester") == SQL
+    assert cache.stats()["fuzzy_hits"] == 1
+
+
+VOTES_SQL = ("SELECT permlink FROM hafsql.comments WHERE author = 'alice' AND net_votes > 10 "
+             "AND category = 'hive-123' AND created >= now() - interval '7 days'")
+VOTES_QUESTION = "posts by alice with more than 10 votes in community hive-123 created last week"
+
+
+@pytest.mark.parametrize("question", [
+    "posts by alice with more than 10 votes not in community hive-123 created last week",
+    "posts by alice with less than 10 votes in community hive-123 created last week",
+    "posts by alice with fewer than 10 votes in community hive-123 created last week",
+    "posts by alice with more than 10 votes in community hive-123 created before last week",
+    "oldest posts by alice with more than 10 votes in community hive-123 created last week",
+    "top posts by alice with more than 10 votes in community hive-123 created last week",
+    "posts by alice with more than 10 votes in community hive-123 created last week desc",
+    "posts by alice without more than 10 votes in community hive-123 created last week",
+])
+def test_modifier_words_must_match(question):
+    cache = QuestionCache(similarity=0.7, ttl=60, max_entries=10)
+    cache.store(VOTES_QUESTION, "tester", VOTES_SQL)
+    assert cache.lookup(question, "tester") is None
+
+
+@pytest.mark.parametrize("question", [
+    "show me posts by alice with more than 10 votes in community hive-123 created last week",
+    "posts written by alice with more than 10 votes in community hive-123 created last week",
+    "Posts by Alice with more than 10 votes in community hive-123 created last week?",
+])
+def test_harmless_rephrasings_still_hit(question):
+    cache = QuestionCache(similarity=0.7, ttl=60, max_entries=10)
+    cache.store(VOTES_QUESTION, "tester", VOTES_SQL)
+    assert cache.lookup(question, "tester") == VOTES_SQL
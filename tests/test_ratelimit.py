@@ -0,0 +1,27 @@
+import asyncio
+import threading
+import pytest
+from ratelimit import RateLimiter, RateLimitStore, SQLiteRateLimitStore
+
+
+class RecordingSQLiteStore(SQLiteRateLimitStore):
+    def take(self, key, capacity, refill_rate, now=None):
+        self.thread = threading.current_thread()
+        return super().take(key, capacity, refill_rate, now)
+
+
+def test_store_interface_is_abstract():
+    with pytest.raises(TypeError):
+        RateLimitStore()
+
+
+def test_sqlite_store_checked_off_the_event_loop(tmp_path):
+    store = RecordingSQLiteStore(str(tmp_path / "ratelimit.db"), idle_ttl=60)
+    limiter = RateLimiter(store, cooldown=60, max_daily=10)
+    try:
+        assert asyncio.run(limiter.acheck("user1")) is None
+        assert store.thread is not threading.main_thread()
+        reason, wait = asyncio.run(limiter.acheck("user1"))
+        assert reason == "cooldown" and 0 < wait <= 60
+    finally:
+        limiter.close()
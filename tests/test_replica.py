@@ -0,0 +1,65 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import REPLICA_CONFIG
+from cache import QueryCache
+from database import Database
+from replica import HotQueryReplica, ReplicaRows
+from tests.fakes import FakeDatabase
+
+QUERY = "SELECT id, name FROM hafsql.accounts_table"
+
+
+class RecordingReplica(HotQueryReplica):
+    """Replica noting the threads its SQLite work runs on"""
+    threads = set()
+
+    def lookup(self, *args, **kwargs):
+        self.threads.add(threading.current_thread())
+        return super().lookup(*args, **kwargs)
+
+    def observe(self, *args, **kwargs):
+        self.threads.add(threading.current_thread())
+        return super().observe(*args, **kwargs)
+
+
+class ReplicaDatabase(FakeDatabase):
+    """Fake HafSQL behind the real query cache and replica code"""
+    execute_query = Database.execute_query
+
+    def __init__(self, replica):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.query_cache = QueryCache(ttl=60, max_bytes=1024 * 1024, max_entries=10)
+        self.replica = replica
+        self.executions = 0
+
+    def _execute_query_sync(self, query, fetch_size, params=None):
+        self.executions += 1
+        return [(1, "alice")], ["id", "name"]
+
+
+def test_replica_rows_served_off_the_loop_and_never_cached(tmp_path, monkeypatch):
+    monkeypatch.setitem(REPLICA_CONFIG, "hot_query_count", 1)
+    replica = RecordingReplica(str(tmp_path / "hot_queries.db"))
+    db = ReplicaDatabase(replica)
+
+    async def run():
+        await db.execute_query(QUERY)      # HafSQL, hot from the first run
+        db.query_cache.flush()
+        first = await db.execute_query(QUERY)
+        second = await db.execute_query(QUERY)
+        return first, second
+
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        db.executor.shutdown()
+        replica.close()
+
+    assert db.executions == 1
+    assert isinstance(first[0], ReplicaRows) and isinstance(second[0], ReplicaRows)
+    # Both answered by the replica, which checks staleness, not by the query cache
+    assert replica.hits == 2
+    assert db.query_cache.stats()["entries"] == 0
+    assert threading.main_thread() not in RecordingReplica.threads
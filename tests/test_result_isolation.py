@@ -0,0 +1,25 @@
+import asyncio
+from commands import CommandHandler
+from workers import execute_command
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+USERS = 20
+
+
+def test_concurrent_commands_get_their_own_results():
+    handler = CommandHandler(FakeDatabase(latency=0.05), FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+
+    async def run_all():
+        return await asyncio.gather(*(
+            execute_command(
+                handler, "hafsql", f"!hafsql SELECT id, title FROM hafsql.comments WHERE author = 'user{n}x'",
+                "!hafsql", f"tester{n}")
+            for n in range(USERS)))
+
+    results = asyncio.run(run_all())
+    for n, result in enumerate(results):
+        text = result["file"].decode("utf-8")
+        assert result["content"].startswith(f"tester{n},")
+        assert f"'user{n}x'" in text
+        assert [m for m in range(USERS) if m != n and f"'user{m}x'" in text] == []
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from scheduler import CommandLane, CommandScheduler, QueueFullError
+
+
+def drain(lane):
+    return [lane.pop() for _ in range(len(lane))]
+
+
+def test_admin_lane_goes_first():
+    lane = CommandLane()
+    lane.push("alice", "alice-1", False)
+    lane.push("bob", "bob-1", False)
+    assert lane.push("admin", "admin-1", True) == 1
+    assert lane.push("admin", "admin-2", True) == 2
+    assert drain(lane) == ["admin-1", "admin-2", "alice-1", "bob-1"]
+
+
+def test_round_robin_across_users():
+    lane = CommandLane()
+    for n in range(3):
+        lane.push("alice", f"alice-{n}", False)
+    lane.push("bob", "bob-0", False)
+    # Bob waits for one alice turn, not for all of alice's jobs
+    assert lane.push("carol", "carol-0", False) == 3
+    assert lane.push("bob", "bob-1", False) == 5
+    assert lane.queued_for("alice") == 3
+    assert drain(lane) == ["alice-0", "bob-0", "carol-0", "alice-1", "bob-1", "alice-2"]
+    assert len(lane) == 0 and lane.queued_for("alice") == 0
+
+
+def test_queue_full():
+    async def run():
+        scheduler = CommandScheduler(max_queued=4, max_queued_per_user=2, workers={"llm": 1, "db": 1})
+        job = asyncio.sleep
+        scheduler.submit("llm", "alice", job)
+        scheduler.submit("llm", "alice", job)
+        with pytest.raises(QueueFullError) as e:
+            scheduler.submit("llm", "alice", job)
+        assert e.value.user_limit and e.value.queued == 2
+
+        scheduler.submit("llm", "bob", job)
+        scheduler.submit("llm", "carol", job)
+        with pytest.raises(QueueFullError) as e:
+            scheduler.submit("llm", "dave", job)
+        assert not e.value.user_limit and e.value.queued == 4
+
+        # Admins are never rejected, a full LLM lane leaves the DB lane open
+        scheduler.submit("llm", "admin", job, is_admin=True)
+        assert scheduler.submit("db", "dave", job) == 0
+        assert scheduler.queued() == 6
+
+    asyncio.run(run())
+
+
+def test_workers_run_jobs_in_lane_order():
+    order = []
+
+    async def run():
+        scheduler = CommandScheduler(max_queued=10, max_queued_per_user=5, workers={"llm": 1})
+        blocker = asyncio.Event()
+
+        def job(name, wait=False):
+            async def run_job():
+                if wait:
+                    await blocker.wait()
+                order.append(name)
+            return run_job
+
+        scheduler.start()
+        assert scheduler.submit("llm", "alice", job("alice-0", wait=True)) == 0
+        await asyncio.sleep(0)
+        assert scheduler.submit("llm", "alice", job("alice-1")) == 1
+        scheduler.submit("llm", "alice", job("alice-2"))
+        scheduler.submit("llm", "bob", job("bob-0"))
+        scheduler.submit("llm", "admin", job("admin-0"), is_admin=True)
+        blocker.set()
+        while scheduler.queued() or scheduler.busy["llm"]:
+            await asyncio.sleep(0.01)
+        await scheduler.stop()
+
+    asyncio.run(run())
+    assert order == ["alice-0", "admin-0", "alice-1", "bob-0", "alice-2"]
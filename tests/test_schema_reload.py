@@ -0,0 +1,125 @@
+import copy
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from config import SCHEMA_CONFIG
+from commands import CommandHandler
+from database import Database
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase, FIXTURE_CATALOG
+
+
+def live_catalog():
+    """FIXTURE_CATALOG with comments changed, operation_transfer_table dropped and a view added"""
+    catalog = copy.deepcopy(FIXTURE_CATALOG)
+    catalog["comments"]["columns"].append(["total_payout_value", "numeric"])
+    del catalog["operation_transfer_table"]
+    catalog["operation_vote_view"] = {"type": "VIEW", "columns": [
+        ["voter", "character varying"], ["author", "character varying"], ["weight", "integer"]]}
+    return catalog
+
+
+class ReloadDatabase(FakeDatabase):
+    """Real schema refresh code, the live HafSQL catalog is self.live"""
+    refresh_schema_async = Database.refresh_schema_async
+
+    def __init__(self):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.live = ("2:def", live_catalog())
+        self.fetching = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def _fetch_schema_changes(self, force=False):
+        self.fetching.set()
+        self.release.wait()
+        fingerprint, catalog = self.live
+        if fingerprint == self.schema_fingerprint and not force:
+            return None
+        return fingerprint, copy.deepcopy(catalog)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setitem(SCHEMA_CONFIG, "snapshot_path", str(tmp_path / "schema.json"))
+    db = ReloadDatabase()
+    yield db
+    db.close()
+
+
+def test_diff_catalog():
+    db = FakeDatabase()
+    added, removed, changed = db._diff_catalog(FIXTURE_CATALOG, live_catalog())
+    assert added == ["operation_vote_view"]
+    assert removed == ["operation_transfer_table"]
+    assert changed == ["comments"]
+    assert db._diff_catalog(FIXTURE_CATALOG, copy.deepcopy(FIXTURE_CATALOG)) == ([], [], [])
+
+
+def test_refresh_applies_changes_and_saves_snapshot(db):
+    accounts_ddl = db.database_schema["accounts_table"]
+    changes = asyncio.run(db.refresh_schema_async())
+
+    assert changes == {"added": ["operation_vote_view"], "removed": ["operation_transfer_table"],
+                       "changed": ["comments"]}
+    assert db.schema_fingerprint == "2:def"
+    assert db.views_list == ["operation_vote_view"]
+    assert "operation_transfer_table" not in db.database_schema
+    assert "total_payout_value numeric" in db.database_schema["comments"]
+    # Unchanged tables keep their DDL, only changed ones are rebuilt
+    assert db.database_schema["accounts_table"] is accounts_ddl
+    assert db._load_snapshot()["fingerprint"] == "2:def"
+
+    # Same fingerprint: nothing to do unless forced
+    assert asyncio.run(db.refresh_schema_async()) is None
+    assert asyncio.run(db.refresh_schema_async(force=True)) == {"added": [], "removed": [], "changed": []}
+
+
+def test_refresh_swaps_schema_atomically(db):
+    old_catalog, old_schema, old_list = db.catalog, db.database_schema, db.database_list
+    old_snapshot = copy.deepcopy(old_catalog)
+    db.release.clear()
+    seen = []
+
+    async def reader(refresh):
+        # Every read between awaits sees one schema, never half old and half new
+        while not refresh.done():
+            seen.append((db.catalog, db.database_schema, db.database_list))
+            await asyncio.sleep(0)
+
+    async def run():
+        refresh = asyncio.create_task(db.refresh_schema_async())
+        read = asyncio.create_task(reader(refresh))
+        await asyncio.get_running_loop().run_in_executor(None, db.fetching.wait)
+        # The catalog query runs off the loop, readers keep going meanwhile
+        await asyncio.sleep(0.05)
+        assert not refresh.done() and len(seen) > 1
+        db.release.set()
+        await refresh
+        await read
+
+    asyncio.run(run())
+    states = [(old_catalog, old_schema, old_list), (db.catalog, db.database_schema, db.database_list)]
+    for read in seen:
+        assert any(all(a is b for a, b in zip(read, state)) for state in states)
+    # Objects handed out before the refresh are replaced, not mutated
+    assert old_catalog == old_snapshot
+    assert "operation_transfer_table" in old_schema
+    assert db.catalog is not old_catalog
+
+
+def test_handle_reloadschema(db):
+    handler = CommandHandler(db, FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+    response = asyncio.run(handler.handle_reloadschema("!reloadschema", "admin"))
+    assert response == ("Database schema reloaded:\n"
+                        "- added: operation_vote_view\n"
+                        "- removed: operation_transfer_table\n"
+                        "- changed: comments\n")
+    assert asyncio.run(handler.handle_reloadschema("!reloadschema", "admin")) == "Database schema is up to date."
+    assert asyncio.run(handler.handle_reloadschema("!reloadschema force", "admin")) == \
+        "Database schema reloaded:\n- no table changes\n"
@@ -0,0 +1,15 @@
+import database
+from config import SCHEMA_CONFIG
+from tests.fakes import FakeDatabase, FIXTURE_CATALOG
+
+
+def test_snapshot_ignored_when_skip_tables_change(tmp_path, monkeypatch):
+    monkeypatch.setitem(SCHEMA_CONFIG, "snapshot_path", str(tmp_path / "schema.json"))
+    monkeypatch.setattr(database, "SKIP_TABLES", [])
+    db = FakeDatabase()
+    db._save_snapshot("1:abc", FIXTURE_CATALOG)
+    assert db._load_snapshot()["catalog"] == FIXTURE_CATALOG
+
+    # Skipping a table must read the catalog from HafSQL again, not the snapshot that has it
+    monkeypatch.setattr(database, "SKIP_TABLES", ["comments"])
+    assert db._load_snapshot() is None
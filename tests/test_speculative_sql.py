@@ -0,0 +1,130 @@
+import time
+import asyncio
+import pytest
+from config import SPECULATIVE_CONFIG, COST_GUARD_CONFIG
+from commands import CommandHandler, CandidatesFailedError
+from sql_validator import SQLValidationError
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+GOOD = "SELECT name, reputation FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 10"
+ALSO_GOOD = "SELECT name FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 10"
+UNKNOWN_TABLE = "SELECT name FROM hafsql.acounts ORDER BY reputation DESC LIMIT 10"
+EXPENSIVE = "SELECT body FROM hafsql.comments ORDER BY created DESC LIMIT 10"
+
+
+class CandidateChatModel(FakeChatModel):
+    """Fake LLM whose copies answer SQL prompts with script[temperature]: (latency, sql or exception)"""
+    def __init__(self, script, temperature=0.1):
+        super().__init__(latency=0, jitter=0, temperature=temperature)
+        self.script = script
+        self.started = []
+
+    def model_copy(self, update=None):
+        copy = CandidateChatModel(self.script, update["temperature"])
+        copy.started = self.started
+        return copy
+
+    async def ainvoke(self, prompt):
+        if "RESPOND ONLY THE SQL" not in str(prompt):
+            return await super().ainvoke(prompt)
+        self.started.append(time.perf_counter())
+        latency, sql = self.script[self.temperature]
+        await asyncio.sleep(latency)
+        if isinstance(sql, Exception):
+            raise sql
+        return await super().ainvoke(f"RESPOND ONLY THE SQL\nQuestion: {sql}")
+
+    def respond(self, prompt):
+        if "RESPOND ONLY THE SQL" in prompt:
+            return f"```sql\n{prompt.split('Question: ', 1)[1]}\n```"
+        return super().respond(prompt)
+
+
+class PlanDatabase(FakeDatabase):
+    async def explain_query(self, query, params=None):
+        if "body" in query:
+            return {"Total Cost": 5e7, "Plan Rows": 10 ** 8}
+        return await super().explain_query(query, params)
+
+
+@pytest.fixture(autouse=True)
+def speculative(monkeypatch):
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "enabled", True)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "candidates", 3)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "temperatures", [0.1, 0.5, 0.9])
+    monkeypatch.setitem(COST_GUARD_CONFIG, "enabled", True)
+
+
+def run_candidates(script):
+    llm = CandidateChatModel(script)
+    handler = CommandHandler(PlanDatabase(), llm, llm)
+    schemas = {"accounts_table": handler.db.database_schema["accounts_table"]}
+
+    async def run():
+        start = time.perf_counter()
+        try:
+            return await handler._speculative_sql_query("top accounts by reputation", schemas, "tester")
+        finally:
+            run.elapsed = time.perf_counter() - start
+            # Losing candidates were cancelled, they end on the next loop iteration
+            await asyncio.sleep(0)
+            run.leftover = len(asyncio.all_tasks()) - 1
+
+    try:
+        return asyncio.run(run()), handler, llm, run
+    except CandidatesFailedError as e:
+        return e, handler, llm, run
+
+
+def test_candidates_run_in_parallel_first_valid_wins():
+    sql_query, handler, llm, run = run_candidates({
+        0.1: (0.4, GOOD),
+        0.5: (0.05, UNKNOWN_TABLE),
+        0.9: (0.15, ALSO_GOOD),
+    })
+    assert sql_query == ALSO_GOOD
+    assert len(llm.started) == 3 and max(llm.started) - min(llm.started) < 0.05
+    assert run.elapsed < 0.3
+    assert run.leftover == 0
+    assert handler.speculative_stats == {
+        "runs": 1, "candidates": 3, "cancelled": 1, "failed": 0, "wins": {0.9: 1}}
+
+
+def test_too_expensive_candidate_loses():
+    sql_query, handler, _, _ = run_candidates({
+        0.1: (0.0, EXPENSIVE),
+        0.5: (0.1, GOOD),
+        0.9: (0.2, ALSO_GOOD),
+    })
+    assert sql_query == GOOD
+    assert handler.speculative_stats["wins"] == {0.5: 1}
+
+
+def test_all_candidates_failed():
+    error, handler, _, _ = run_candidates({
+        0.1: (0.0, ValueError("model output was not SQL")),
+        0.5: (0.05, UNKNOWN_TABLE),
+        0.9: (0.1, EXPENSIVE),
+    })
+    assert isinstance(error, CandidatesFailedError)
+    assert "All 3 SQL candidates failed" in str(error)
+    # The first failure that has SQL to repair, not the failed generation before it
+    assert error.sql_query == UNKNOWN_TABLE
+    assert isinstance(error.error, SQLValidationError)
+    assert handler.speculative_stats["failed"] == 1 and handler.speculative_stats["wins"] == {}
+
+
+def test_failed_candidates_are_repaired(monkeypatch):
+    llm = CandidateChatModel({0.1: (0.0, UNKNOWN_TABLE), 0.5: (0.05, EXPENSIVE), 0.9: (0.1, UNKNOWN_TABLE)})
+    handler = CommandHandler(PlanDatabase(), llm, llm)
+    prompts = []
+
+    async def record_repair(question, schemas, username, sql_query, error, kind):
+        prompts.append((sql_query, kind))
+        return GOOD
+
+    monkeypatch.setattr(handler, "_repair_sql_query", record_repair)
+    sql_query, rows, _ = asyncio.run(handler.retry_sql_generation("top accounts by reputation", "tester"))
+    assert sql_query.startswith(GOOD) and rows
+    assert prompts == [(UNKNOWN_TABLE, "unknown_table")]
@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+from sqlalchemy.exc import SQLAlchemyError, ProgrammingError, OperationalError
+import commands
+from config import QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SPECULATIVE_CONFIG, TABLE_INDEX_CONFIG
+from commands import CommandHandler, REPAIR_HINTS, EmptyResultError, NoRelevantTablesError
+from cost_guard import QueryCostError
+from sql_validator import SQLValidationError
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+QUESTION = "top accounts by reputation"
+REPAIR_MARKER = "was generated to answer a question but it failed"
+
+
+class RateLimitError(Exception):
+    """Named like the provider SDK errors"""
+
+
+class RecordingChatModel(FakeChatModel):
+    """Fake LLM keeping its prompts, raising the queued errors first"""
+    def __init__(self, errors=()):
+        super().__init__(latency=0, jitter=0)
+        self.prompts = []
+        self.errors = list(errors)
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(str(prompt))
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super().ainvoke(prompt)
+
+    @property
+    def repair_prompts(self):
+        return [prompt for prompt in self.prompts if REPAIR_MARKER in prompt]
+
+
+class ScriptedDatabase(FakeDatabase):
+    """Raises the queued errors (or returns no rows for None) before answering"""
+    def __init__(self, outcomes=(), explain_errors=()):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.explain_errors = list(explain_errors)
+
+    async def execute_query(self, query, fetch_size=100, params=None):
+        rows, header = await super().execute_query(query, fetch_size, params)
+        if self.outcomes:
+            outcome = self.outcomes.pop(0)
+            if outcome is None:
+                return [], header
+            raise outcome
+        return rows, header
+
+    async def explain_query(self, query, params=None):
+        if self.explain_errors:
+            raise self.explain_errors.pop(0)
+        return await super().explain_query(query, params)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setitem(QUESTION_CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TEMPLATE_CONFIG, "enabled", False)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "enabled", True)
+
+    # Back-off sleeps are recorded, not waited for
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay, *args):
+        if delay >= 1:
+            sleeps.append(delay)
+            delay = 0
+        return await sleep(delay, *args)
+
+    monkeypatch.setattr(commands.asyncio, "sleep", fake_sleep)
+    return sleeps
+
+
+def db_error(cls, message):
+    return cls("SELECT ...", {}, Exception(message))
+
+
+@pytest.mark.parametrize("error, kind", [
+    (EmptyResultError("no rows"), "empty_result"),
+    (QueryCostError(1e9, 10 ** 8, 1e6, 10 ** 6), "too_expensive"),
+    (NoRelevantTablesError("none"), "no_tables"),
+    (RateLimitError("slow down"), "rate_limit"),
+    (Exception("Error code: 429 - Too Many Requests"), "rate_limit"),
+    (SQLValidationError("Unknown table 'posts'."), "unknown_table"),
+    (SQLValidationError("Column 'votes' does not exist in comments."), "unknown_column"),
+    (SQLValidationError("Syntax error: unexpected token"), "syntax"),
+    (db_error(ProgrammingError, 'relation "hafsql.posts" does not exist'), "unknown_table"),
+    (db_error(ProgrammingError, "column c.votes does not exist"), "unknown_column"),
+    (db_error(ProgrammingError, 'syntax error at or near "FORM"'), "syntax"),
+    (db_error(OperationalError, "canceling statement due to statement timeout"), "timeout"),
+    (asyncio.TimeoutError(), "timeout"),
+    (ValueError("could not parse the model output"), "generation"),
+    (SQLAlchemyError("server closed the connection"), "other"),
+])
+def test_classify_error(error, kind):
+    handler = CommandHandler(FakeDatabase(), FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+    assert handler._classify_error(error) == kind
+
+
+@pytest.mark.parametrize("db, kind", [
+    (ScriptedDatabase([db_error(ProgrammingError, "column reputation_score does not exist")]), "unknown_column"),
+    (ScriptedDatabase([db_error(ProgrammingError, 'relation "hafsql.accounts" does not exist')]), "unknown_table"),
+    (ScriptedDatabase([db_error(ProgrammingError, 'syntax error at or near "FORM"')]), "syntax"),
+    (ScriptedDatabase([db_error(OperationalError, "canceling statement due to statement timeout")]), "timeout"),
+    (ScriptedDatabase(explain_errors=[QueryCostError(1e9, 10 ** 8, 1e6, 10 ** 6)]), "too_expensive"),
+    (ScriptedDatabase([None]), "empty_result"),
+    (ScriptedDatabase([SQLAlchemyError("server closed the connection")]), "other"),
+])
+def test_repair_prompt_has_the_hint_of_the_error(pipeline, db, kind):
+    llm = RecordingChatModel()
+    handler = CommandHandler(db, llm, llm)
+    sql_query, rows, _ = asyncio.run(handler.retry_sql_generation(QUESTION, "tester"))
+    assert rows
+    assert len(llm.repair_prompts) == 1
+    assert REPAIR_HINTS[kind] in llm.repair_prompts[0]
+    assert pipeline == []
+
+
+def test_only_provider_rate_limits_back_off(pipeline):
+    llm = RecordingChatModel([RateLimitError("slow down"), RateLimitError("slow down")])
+    handler = CommandHandler(FakeDatabase(), llm, llm)
+    _, rows, _ = asyncio.run(handler.retry_sql_generation(QUESTION, "tester", retry_delay=2))
+    assert rows
+    # Exponential back-off, and the throttled call runs again as is, no repair
+    assert pipeline == [2, 4]
+    assert llm.repair_prompts == []
+
+    pipeline.clear()
+    db = ScriptedDatabase([db_error(OperationalError, "canceling statement due to statement timeout"),
+                           db_error(ProgrammingError, 'syntax error at or near "FORM"')])
+    handler = CommandHandler(db, RecordingChatModel(), RecordingChatModel())
+    asyncio.run(handler.retry_sql_generation(QUESTION, "tester", retry_delay=2))
+    assert pipeline == []
+
+
+def test_empty_result_repaired_exactly_once(pipeline):
+    llm = RecordingChatModel()
+    db = ScriptedDatabase([None, None, None])
+    handler = CommandHandler(db, llm, llm)
+    sql_query, rows, _ = asyncio.run(handler.retry_sql_generation(QUESTION, "tester"))
+    # The repaired query also found nothing, that is the answer
+    assert rows == []
+    assert len(llm.repair_prompts) == 1
+    assert len(db.queries) == 2
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from config import QUESTION_CACHE_CONFIG, TEMPLATE_CONFIG, SPECULATIVE_CONFIG
+from commands import CommandHandler
+from sql_templates import TemplateCache, render_sql
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+POSTS_SQL = ("SELECT permlink FROM hafsql.comments WHERE author = 'user1' AND title <> '' "
+             "ORDER BY created DESC LIMIT 5")
+
+
+def learned(question="last 5 posts by user1", sql_query=POSTS_SQL):
+    cache = TemplateCache(ttl=60, max_entries=10)
+    template = cache.learn(question, "tester", sql_query, generation_seconds=1.5)
+    return cache, template
+
+
+def test_learn_turns_question_literals_into_parameters():
+    _, template = learned()
+    assert template.shape == "last {number} posts by {name}"
+    assert template.sql_query == ("SELECT permlink FROM hafsql.comments WHERE author = :p0 AND title <> '' "
+                                  "ORDER BY created DESC LIMIT :p1")
+
+
+def test_learn_needs_a_literal_from_the_question():
+    cache = TemplateCache(ttl=60, max_entries=10)
+    assert cache.learn("latest posts", "tester", "SELECT permlink FROM hafsql.comments LIMIT 5") is None
+
+
+def test_fill_and_lookup():
+    cache, template = learned()
+    assert template.fill("last 10 posts by @bob", "tester") == {"p0": "bob", "p1": 10}
+    found, params = cache.lookup("last 3 posts by user-2", "tester")
+    assert found is template and params == {"p0": "user-2", "p1": 3}
+    assert render_sql(found.sql_query, params).endswith("author = 'user-2' AND title <> '' ORDER BY created DESC LIMIT 3")
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("question", [
+    "last 5 posts by everyone",
+    "last 5 posts by yesterday",
+    "last 5 comments by user2",
+    "last posts by user2",
+])
+def test_words_are_not_account_names(question):
+    cache, _ = learned()
+    assert cache.lookup(question, "tester") is None
+
+
+def test_plain_names_stay_part_of_the_sql():
+    cache, template = learned("last 5 posts by alice", POSTS_SQL.replace("user1", "alice"))
+    assert template.shape == "last {number} posts by alice"
+    assert cache.lookup("last 5 posts by everyone", "tester") is None
+    assert cache.lookup("last 8 posts by alice", "tester")[1] == {"p0": 8}
+
+
+class EmptyDatabase(FakeDatabase):
+    """Template queries find nothing, generated ones do"""
+    async def execute_query(self, query, fetch_size=100, params=None):
+        rows, header = await super().execute_query(query, fetch_size, params)
+        return ([] if params else rows), header
+
+
+def test_template_without_rows_falls_back_to_the_llm(monkeypatch):
+    monkeypatch.setitem(QUESTION_CACHE_CONFIG, "enabled", False)
+    monkeypatch.setitem(TEMPLATE_CONFIG, "enabled", True)
+    monkeypatch.setitem(SPECULATIVE_CONFIG, "enabled", False)
+    llm = FakeChatModel(latency=0, jitter=0)
+    handler = CommandHandler(EmptyDatabase(), llm, FakeChatModel(latency=0, jitter=0))
+    handler.template_cache.learn("last 5 posts by user1", "tester", POSTS_SQL)
+
+    sql_query, rows, _ = asyncio.run(handler.retry_sql_generation("last 5 posts by user9", "tester"))
+    # Generated by the LLM, not the template's empty answer
+    assert rows and llm.calls >= 1 and ":p" not in sql_query
+    stats = handler.template_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["empty"]) == (0, 1, 1)
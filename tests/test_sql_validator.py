@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from commands import CommandHandler
+from sql_validator import SQLValidator, SQLValidationError
+from benchmarks.fake_llm import FakeChatModel
+from tests.fakes import FakeDatabase
+
+
+def test_subquery_columns_checked_against_their_own_tables():
+    validator = SQLValidator(FakeDatabase())
+    validator.validate(
+        "SELECT c.author FROM hafsql.comments c "
+        "WHERE c.author = (SELECT name FROM hafsql.accounts_table ORDER BY reputation DESC LIMIT 1)")
+    # Correlated references still resolve through the outer scope
+    validator.validate(
+        "SELECT author FROM hafsql.comments c WHERE EXISTS "
+        "(SELECT 1 FROM hafsql.accounts_table a WHERE a.name = c.author AND title <> '')")
+    # Columns of a derived table resolve against its output names
+    validator.validate(
+        "SELECT c.author, total FROM hafsql.comments c "
+        "JOIN (SELECT name, reputation AS total FROM hafsql.accounts_table) s ON s.name = c.author")
+    with pytest.raises(SQLValidationError, match="bogus_col"):
+        validator.validate(
+            "SELECT c.author FROM hafsql.comments c "
+            "JOIN (SELECT name FROM hafsql.accounts_table) s ON s.name = c.author WHERE bogus_col = 1")
+    with pytest.raises(SQLValidationError, match="bogus"):
+        validator.validate("SELECT bogus FROM hafsql.comments c, (SELECT 1 AS x) s")
+    with pytest.raises(SQLValidationError, match="nme"):
+        validator.validate("SELECT author FROM hafsql.comments WHERE author IN (SELECT nme FROM hafsql.accounts_table)")
+
+
+def test_export_is_validated_without_limit():
+    db = FakeDatabase()
+    handler = CommandHandler(db, FakeChatModel(jitter=0), FakeChatModel(jitter=0))
+
+    content, buffer, _ = asyncio.run(handler.handle_export("csv DELETE FROM hafsql.comments", "tester"))
+    assert buffer is None and "not executed" in content
+    content, buffer, _ = asyncio.run(handler.handle_export("SELECT 1; DROP TABLE hafsql.comments", "tester"))
+    assert buffer is None and "not executed" in content
+    assert db.queries == []
+
+    content, buffer, filename = asyncio.run(handler.handle_export("csv SELECT id, title FROM hafsql.comments", "tester"))
+    assert filename == "export.csv"
+    assert db.queries == [("SELECT id, title FROM hafsql.comments", None)]
+
+
+def test_validate_records_the_sql_before_its_limit():
+    validator = SQLValidator(FakeDatabase(), default_limit=100)
+    added = validator.validate("SELECT name FROM hafsql.accounts_table;")
+    assert added == "SELECT name FROM hafsql.accounts_table\nLIMIT 100"
+    assert added.page_query == "SELECT name FROM hafsql.accounts_table;"
+
+    written = validator.validate("SELECT name FROM hafsql.accounts_table\nLIMIT 100")
+    assert written == written.page_query == "SELECT name FROM hafsql.accounts_table\nLIMIT 100"
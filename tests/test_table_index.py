@@ -0,0 +1,65 @@
+import copy
+import pytest
+from config import TABLE_INDEX_CONFIG
+from table_index import TableIndex, tokenize, parse_ddl_columns
+from tests.fakes import FakeDatabase, FIXTURE_CATALOG
+
+
+@pytest.fixture
+def index():
+    catalog = copy.deepcopy(FIXTURE_CATALOG)
+    catalog["balances"] = {"type": "VIEW", "columns": [
+        ["account_name", "character varying"], ["hbd", "numeric"], ["hive", "numeric"]]}
+    catalog["follows"] = {"type": "BASE TABLE", "columns": [
+        ["follower", "character varying"], ["following", "character varying"],
+        ["created", "timestamp without time zone"]]}
+    return TableIndex(FakeDatabase(catalog=catalog).database_schema)
+
+
+def test_tokenize_and_ddl_columns():
+    assert tokenize("Transfers of @alice") == ["transfers", "transfer", "of", "alice"]
+    assert parse_ddl_columns("CREATE TABLE t (id bigint, created timestamp without time zone);") == \
+        ["id", "created"]
+
+
+def test_bm25_ranking(index):
+    # Each table named by the question ranks above the ones only sharing a column word
+    ranked = index.rank("permlink of posts by accounts")
+    assert [table for table, _ in ranked[:2]] == ["comments", "accounts_table"]
+    assert ranked[2][1] < ranked[1][1] / 2
+    assert [table for table, _ in index.rank("transfer amount memo")][0] == "operation_transfer_table"
+    # "created" is a column of several tables, the shortest document ranks first
+    assert [table for table, _ in index.rank("created")] == ["follows", "accounts_table", "comments"]
+    assert index.rank("created", limit=1)[0][0] == "follows"
+    assert index.rank("weather in paris") == []
+
+
+@pytest.mark.parametrize("question, table", [
+    ("who sent the most to user1", "operation_transfer_table"),
+    ("payments received by alice", "operation_transfer_table"),
+    ("latest blog articles", "comments"),
+    ("my wallet", "balances"),
+    ("who is following alice", "follows"),
+])
+def test_synonyms(index, question, table):
+    assert index.rank(question)[0][0] == table
+
+
+def test_confidence_threshold(index, monkeypatch):
+    (table, score), = index.rank("my wallet")
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "min_score", score)
+    assert index.suggest("my wallet") == (["balances"], True)
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "min_score", score + 0.01)
+    assert index.suggest("my wallet") == (["balances"], False)
+    assert index.suggest("weather in paris") == ([], False)
+
+
+def test_relative_cutoff_and_max_tables(index, monkeypatch):
+    ranked = index.rank("permlink of posts by accounts")
+    (_, top), (_, second) = ranked[:2]
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "relative_cutoff", second / top)
+    tables, _ = index.suggest("permlink of posts by accounts")
+    assert tables == ["comments", "accounts_table"]
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "relative_cutoff", 0.0)
+    monkeypatch.setitem(TABLE_INDEX_CONFIG, "max_tables", 1)
+    assert index.suggest("permlink of posts by accounts")[0] == ["comments"]
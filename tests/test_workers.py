@@ -0,0 +1,47 @@
+import asyncio
+from workers import ProcessJobQueue, send_result
+from streaming import DiscordStreamWriter
+from tests.fakes import FakeChannel, create_fake_command_handler
+
+
+def test_admin_commands_reach_every_worker():
+    async def run():
+        queue = ProcessJobQueue(processes=2, concurrency=2, handler_factory=create_fake_command_handler)
+        queue.start()
+        try:
+            channel = FakeChannel()
+            await send_result(channel, await queue.broadcast("reloadschema", "!reloadschema", "!reloadschema", "admin"))
+            await send_result(channel, await queue.broadcast("cache", "!cache flush", "!cache", "admin"))
+            return channel
+        finally:
+            queue.stop()
+
+    channel = asyncio.run(run())
+    reload_reply, cache_reply = channel.texts
+    assert reload_reply == ("Worker 1: Database schema is up to date.\n\n"
+                            "Worker 2: Database schema is up to date.")
+    assert cache_reply.count("Worker ") == 2
+
+
+def test_streamed_tokens_shown_before_the_result():
+    async def run():
+        queue = ProcessJobQueue(processes=1, concurrency=2, handler_factory=create_fake_command_handler)
+        queue.start()
+        try:
+            # Slow sends: every token is still being relayed when the result arrives
+            channel = FakeChannel(latency=0.3)
+            writer = DiscordStreamWriter(channel, edit_interval=0.5)
+            result = await queue.submit("help", "!help how do I find transfers", "!help", "tester", writer.write)
+            # What HafSQLBot._run_command does with a streamed result
+            if writer.messages:
+                await writer.finish(result["content"])
+            else:
+                await send_result(channel, result)
+            await asyncio.sleep(1)
+            return channel, writer, result
+        finally:
+            queue.stop()
+
+    channel, writer, result = asyncio.run(run())
+    assert writer.first_token is not None
+    assert channel.texts == [result["content"]]
@@ -0,0 +1,325 @@
+import io
+import uuid
+import asyncio
+import threading
+import multiprocessing
+import metrics
+from streaming import MESSAGE_LIMIT
+from config import DB_CONFIG, LLM_CONFIG, LLM_CASSETTE_CONFIG, WORKER_CONFIG
+
+RESULT_FILENAME = "sqlresult.txt"
+
+
+def create_command_handler():
+    """Create Database, LLMs and the CommandHandler that runs bot commands"""
+    from database import Database
+    from commands import CommandHandler
+    from llm import create_chat_model
+
+    db = Database(DB_CONFIG)
+
+    # Replay serves recorded responses, no provider (or API key) needed
+    replay = LLM_CASSETTE_CONFIG["mode"] == "replay"
+
+    # Create evaluator LLM
+    eval_llm = None if replay else create_chat_model(
+        temperature=LLM_CONFIG["eval_temp"],
+        name="Tables-Evaluator")
+
+    # Create SQL generation LLM
+    sql_llm = None if replay else create_chat_model(
+        temperature=LLM_CONFIG["query_temp"],
+        name="SQL-Generator")
+
+    if LLM_CASSETTE_CONFIG["mode"] in ("record", "replay"):
+        from cassette import Cassette, CassetteChatModel
+        cassette = Cassette()
+        print(f"LLM cassette: {cassette.mode} {cassette.path}")
+        eval_llm = CassetteChatModel(eval_llm, cassette, "Tables-Evaluator")
+        sql_llm = CassetteChatModel(sql_llm, cassette, "SQL-Generator")
+
+    # Could not make create_sql_prompt work 100%
+    #self.query_evaluator = self.eval_llm
+    # sql_prompt = self._create_sql_prompt()
+    # self.llm_chain = create_sql_query_chain(
+    #     self.sql_llm,
+    #     self.db.db,
+    #     prompt=sql_prompt
+    # )
+
+    return CommandHandler(db, sql_llm, eval_llm)
+
+
+async def execute_command(handler, command_name, content, alias, user_display_name, on_token=None, page=None):
+    """Run one bot command, returns a picklable result:
+    {"content": str, "file": bytes or None, "filename": str or None, "page": PageState or None}
+    on_token receives streamed text of !help and !hafsql error explanations,
+    page is the PageState the 'page' command (next/previous buttons) fetches"""
+    # Remove the actual command used from message
+    query = content[len(alias):].strip()
+    result = {"content": None, "file": None, "filename": None, "page": None}
+    try:
+        if command_name == 'aiquery':
+            response = await handler.handle_aiquery(query, user_display_name)
+            result["content"] = f"{user_display_name}, here is your query results:"
+            result["file"], result["filename"] = response.getvalue(), RESULT_FILENAME
+            result["page"] = response.page
+
+        elif command_name == 'hafsql':
+            response = await handler.handle_hafsql(query, user_display_name, on_token)
+            if isinstance(response, io.BytesIO):
+                result["content"] = f"{user_display_name}, here is your query results:"
+                result["file"], result["filename"] = response.getvalue(), RESULT_FILENAME
+                result["page"] = response.page
+            else:
+                result["content"] = response
+
+        elif command_name == 'page':
+            response = await handler.handle_page(page, user_display_name)
+            if isinstance(response, io.BytesIO):
+                result["content"] = f"{user_display_name}, here is your query results:"
+                result["file"], result["filename"] = response.getvalue(), RESULT_FILENAME
+            else:
+                result["content"] = response
+            result["page"] = page
+
+        elif command_name == 'export':
+            response, buffer, filename = await handler.handle_export(query, user_display_name)
+            result["content"] = response
+            if buffer is not None:
+                result["file"], result["filename"] = buffer.getvalue(), filename
+
+        elif command_name == 'tablelist':
+            result["content"] = await handler.handle_tablelist(query, user_display_name)
+
+        elif command_name == 'tableinfo':
+            result["content"] = await handler.handle_tableinfo(content, user_display_name)
+
+        elif command_name == 'help':
+            result["content"] = await handler.handle_help(content, user_display_name, on_token=on_token)
+
+        elif command_name == 'cache':
+            result["content"] = await handler.handle_cache(content, user_display_name)
+
+        elif command_name == 'reloadschema':
+            result["content"] = await handler.handle_reloadschema(content, user_display_name)
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        metrics.set_status("error")
+        result = {"content": f"An error occurred: {str(e)}", "file": None, "filename": None, "page": None}
+
+    return result
+
+
+async def send_result(channel, result, view=None):
+    """Deliver a command result to a Discord channel (or anything with the same send()),
+    returns the message the view is attached to"""
+    import discord
+    if result["file"] is not None:
+        kwargs = {"view": view} if view is not None else {}
+        return await channel.send(
+            content=result["content"],
+            file=discord.File(io.BytesIO(result["file"]), filename=result["filename"]),
+            **kwargs)
+    elif result["content"]:
+        return await channel.send(result["content"])
+
+
+def worker_main(job_queue, broadcast_queue, result_queue, concurrency, handler_factory):
+    """Worker process entry point, broadcast_queue has the jobs every worker runs"""
+    asyncio.run(_worker_loop(job_queue, broadcast_queue, result_queue, concurrency, handler_factory))
+
+
+async def _worker_loop(job_queue, broadcast_queue, result_queue, concurrency, handler_factory):
+    handler = handler_factory()
+    handler.db.start_schema_refresh()
+    handler.db.start_replica_refresh()
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def run(job, slot=True):
+        on_token = None
+        if job.get("stream"):
+            async def on_token(token):
+                result_queue.put({"job_id": job["job_id"], "token": token})
+        try:
+            # Stage timings go back with the result, the gateway records them
+            with metrics.trace(job["command"], record=False) as trace:
+                result = await execute_command(
+                    handler, job["command"], job["content"], job["alias"], job["user_display_name"], on_token,
+                    job.get("page"))
+            result["trace"] = trace.export()
+            result["job_id"] = job["job_id"]
+            result_queue.put(result)
+        finally:
+            if slot:
+                slots.release()
+
+    def start(job, slot=True):
+        task = asyncio.create_task(run(job, slot))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def read_broadcasts():
+        # Admin jobs are rare and short, they do not wait for a slot
+        while True:
+            job = await loop.run_in_executor(None, broadcast_queue.get)
+            if job is None:
+                break
+            start(job, slot=False)
+
+    broadcasts = asyncio.create_task(read_broadcasts())
+    while True:
+        await slots.acquire()
+        job = await loop.run_in_executor(None, job_queue.get)
+        if job is None:
+            break
+        start(job)
+
+    await broadcasts
+    await asyncio.gather(*tasks, return_exceptions=True)
+    handler.db.close()
+
+
+class ProcessJobQueue:
+    """Gateway side of the worker pool: commands go out on a job queue,
+    results come back on a result queue, matched by job id"""
+    def __init__(self, processes=None, concurrency=None, handler_factory=create_command_handler):
+        """handler_factory is a picklable function called in each worker to build its CommandHandler"""
+        self.processes = processes or WORKER_CONFIG["processes"]
+        self.concurrency = concurrency or WORKER_CONFIG["concurrency"]
+
+        context = multiprocessing.get_context("spawn")
+        self.job_queue = context.Queue()
+        self.result_queue = context.Queue()
+        # One queue per worker for jobs all of them run (cache flush, schema reload)
+        self.broadcast_queues = [context.Queue() for _ in range(self.processes)]
+        self.workers = [
+            context.Process(
+                target=worker_main,
+                args=(self.job_queue, self.broadcast_queues[n], self.result_queue, self.concurrency, handler_factory),
+                name=f"hafsql-worker-{n}",
+                daemon=True)
+            for n in range(self.processes)
+        ]
+        self.pending = {}
+        self.token_queues = {}
+        self.loop = None
+        self.reader = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            worker.start()
+        # Blocking queue reads stay off the event loop
+        self.reader = threading.Thread(target=self._read_results, name="hafsql-results", daemon=True)
+        self.reader.start()
+        # Each worker has its own HafSQL connection pool
+        print(f"Started {self.processes} worker processes, up to "
+              f"{self.processes * (DB_CONFIG['pool_size'] + DB_CONFIG['max_overflow'])} HafSQL connections")
+
+    def _read_results(self):
+        while True:
+            result = self.result_queue.get()
+            if result is None:
+                break
+            self.loop.call_soon_threadsafe(self._resolve, result)
+
+    def _resolve(self, result):
+        if "token" in result:
+            # Streamed text arrives on the same queue, ahead of the final result
+            tokens = self.token_queues.get(result["job_id"])
+            if tokens is not None:
+                tokens.put_nowait(result["token"])
+            return
+        tokens = self.token_queues.pop(result["job_id"], None)
+        if tokens is not None:
+            tokens.put_nowait(None)
+        future = self.pending.pop(result.pop("job_id"), None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    async def submit(self, command_name, content, alias, user_display_name, on_token=None, page=None):
+        """Send a command to the worker pool and wait for its result"""
+        return await self._submit(self.job_queue, command_name, content, alias, user_display_name, on_token, page)
+
+    async def broadcast(self, command_name, content, alias, user_display_name):
+        """Run a command on every worker, each has its own caches and schema.
+        Returns one result with the replies of all workers"""
+        results = await asyncio.gather(*(
+            self._submit(queue, command_name, content, alias, user_display_name)
+            for queue in self.broadcast_queues
+        ), return_exceptions=True)
+
+        replies = []
+        for n, result in enumerate(results, 1):
+            if isinstance(result, Exception):
+                replies.append(f"Worker {n}: no answer ({type(result).__name__})")
+            elif result["content"]:
+                replies.append(f"Worker {n}: {result['content']}")
+        traces = [result["trace"] for result in results if not isinstance(result, Exception)]
+        combined = {
+            "content": "\n\n".join(replies), "file": None, "filename": None, "page": None,
+            # Every worker ran the same stages, one of them stands for the command
+            "trace": traces[0] if traces else None
+        }
+        if len(combined["content"]) > MESSAGE_LIMIT:
+            # Stats of many workers do not fit in one Discord message
+            combined["file"], combined["filename"] = combined["content"].encode("utf-8"), "workers.txt"
+            combined["content"] = f"{user_display_name}, replies of {len(results)} workers:"
+        return combined
+
+    async def _submit(self, queue, command_name, content, alias, user_display_name, on_token=None, page=None):
+        job_id = uuid.uuid4().hex
+        future = self.loop.create_future()
+        self.pending[job_id] = future
+        relay = None
+        if on_token is not None:
+            tokens = self.token_queues[job_id] = asyncio.Queue()
+            relay = asyncio.create_task(self._relay_tokens(tokens, on_token))
+        queue.put({
+            "job_id": job_id,
+            "command": command_name,
+            "content": content,
+            "alias": alias,
+            "user_display_name": user_display_name,
+            "stream": on_token is not None,
+            "page": page
+        })
+        try:
+            # A crashed worker never answers, don't leave the user waiting forever
+            result = await asyncio.wait_for(future, WORKER_CONFIG["job_timeout"])
+            if relay is not None:
+                # Streamed text is shown before the caller renders the result
+                await relay
+            return result
+        finally:
+            self.pending.pop(job_id, None)
+            self.token_queues.pop(job_id, None)
+            if relay is not None and not relay.done():
+                relay.cancel()
+
+    async def _relay_tokens(self, tokens, on_token):
+        """Pass streamed text of one job to on_token in arrival order, until None"""
+        while True:
+            token = await tokens.get()
+            if token is None:
+                return
+            try:
+                await on_token(token)
+            except Exception as e:
+                print(f"Streaming failed: {str(e)}")
+
+    def stop(self):
+        for queue in self.broadcast_queues:
+            queue.put(None)
+        for _ in self.workers:
+            self.job_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        self.result_queue.put(None)